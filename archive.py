@@ -0,0 +1,87 @@
+# archive.py
+"""
+Hot/cold split of the transactions table. Settled (approved/rejected) transactions older than
+ARCHIVE_DAYS move to archive.transactions (same ids) so the hot table, its indexes and the page
+cache stay small; pending rows and anything a commission job may still read are never moved.
+- archive_transactions(days, batch, pause_s, max_batches) -> {"moved", "batches", "cutoff", "seconds"}
+- archive_stats() -> hot / archived row counts, oldest settled hot row, archive file size
+Reads that need full history use the all_transactions view (hot + archived) instead of
+transactions: payment listings with include_archive=True, CSV exports, rollup checks and the
+commission simulator. Rollups (stats.py) keep covering every transaction, so KPIs do not change.
+On SQLite the archive is a separate file attached to every connection (db.archive_path): each
+batch is copied and committed first, then deleted from the hot table, so an interruption can only
+leave a row in both places, which all_transactions reads once and the next run cleans up.
+Back up the archive file together with the main database.
+Run: python manage.py archive [--days 90] [--batch 2000] [--every SECONDS]
+"""
+
+import os
+import time
+from datetime import datetime, timedelta
+
+import cache
+import db
+from db import get_db, begin
+
+ARCHIVE_DAYS = int(os.getenv("PYRAMID_ARCHIVE_DAYS", "90"))
+ARCHIVE_BATCH = int(os.getenv("PYRAMID_ARCHIVE_BATCH", "2000"))  # rows per (short) write transaction
+ARCHIVE_PAUSE_S = float(os.getenv("PYRAMID_ARCHIVE_PAUSE", "0.05"))  # between batches, lets app writers in
+
+# settled, older than the cutoff, and not the deposit/commission of a commission job that is not done
+# (pay_commissions checks the hot table for existing commission rows)
+_DUE_SQL = """
+SELECT t.id FROM transactions t
+WHERE t.status IN ('approved', 'rejected') AND t.created_at < ?
+  AND NOT EXISTS (SELECT 1 FROM commission_jobs j WHERE j.source_tx_id IN (t.id, t.source_tx_id) AND j.status <> 'done')
+ORDER BY t.created_at, t.id LIMIT ?
+"""
+
+def _move(con, ids, now):
+    marks = ",".join("?" * len(ids))
+    cols = ", ".join(db.TX_COLUMNS)
+    begin(con)
+    con.execute(f"INSERT INTO archive.transactions ({cols}, archived_at) SELECT {cols}, ? FROM transactions "
+                f"WHERE id IN ({marks}) ON CONFLICT(id) DO NOTHING", (now, *ids))
+    if db.dialect() == "sqlite":
+        # two files commit independently: make the copy durable before deleting the originals
+        con.commit()
+        begin(con)
+    con.execute(f"DELETE FROM transactions WHERE id IN ({marks}) AND id IN (SELECT id FROM archive.transactions WHERE id IN ({marks}))",
+                (*ids, *ids))
+    con.commit()
+
+def archive_transactions(days=ARCHIVE_DAYS, batch=ARCHIVE_BATCH, pause_s=ARCHIVE_PAUSE_S, max_batches=None) -> dict:
+    """Move settled transactions created more than `days` days ago to the archive, `batch` rows per transaction."""
+    started = time.perf_counter()
+    cutoff = (datetime.utcnow() - timedelta(days=days)).date().isoformat()
+    moved = batches = 0
+    with get_db() as con:
+        while max_batches is None or batches < max_batches:
+            ids = [r["id"] for r in con.execute(_DUE_SQL, (cutoff, batch)).fetchall()]
+            if not ids:
+                break
+            _move(con, ids, datetime.utcnow().isoformat())
+            moved += len(ids)
+            batches += 1
+            if len(ids) < batch:
+                break
+            if pause_s:
+                time.sleep(pause_s)
+    if moved:
+        cache.invalidate("tx:*")
+    return {"moved": moved, "batches": batches, "cutoff": cutoff, "seconds": round(time.perf_counter() - started, 3)}
+
+def archive_stats() -> dict:
+    """Row counts of the hot and archive tables, oldest settled hot row and (SQLite) archive file size."""
+    with get_db() as con:
+        hot = con.execute("SELECT COUNT(*) AS c FROM transactions").fetchone()["c"]
+        archived = con.execute("SELECT COUNT(*) AS c FROM archive.transactions").fetchone()["c"]
+        oldest = con.execute("SELECT MIN(created_at) AS t FROM transactions WHERE status IN ('approved', 'rejected')").fetchone()["t"]
+        last = con.execute("SELECT MAX(archived_at) AS t FROM archive.transactions").fetchone()["t"]
+    out = {"hot_rows": hot, "archived_rows": archived, "oldest_settled_hot": oldest, "last_archived_at": last,
+           "horizon_days": ARCHIVE_DAYS}
+    if db.dialect() == "sqlite" and not db.DATABASE_URL:
+        path = db.archive_path(db.DB_PATH)
+        out["archive_file"] = str(path)
+        out["archive_bytes"] = path.stat().st_size if path.exists() else 0
+    return out
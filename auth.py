@@ -4,59 +4,182 @@
 """
 Authentication utilities:
 - register_user(username, password, email, referrer_username)
-- authenticate(username, password) -> user_row or None
-- get_user_by_id / by_username
+- authenticate(username, password, ip) -> user_row or None (raises LoginThrottled when shed)
+- get_user_by_id / by_username (get_user_by_id is session-cached, see cache.py)
 - owner_login (uses st.secrets["owner"])
+- PBKDF2 runs on a bounded hashing thread pool (hashlib releases the GIL) so Streamlit
+  script threads don't serialize on it; per-user iteration counts allow transparent rehash
+- hash_stats() latency / throttling metrics
 """
 
 import os
 import hashlib
+import hmac
 import binascii
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
 from typing import Optional
 import streamlit as st
-from db import get_db  # CHANGED: removed relative import
+import cache
+from db import get_db, insert_id  # CHANGED: removed relative import
+from stats import bump_counter
 
 # PBKDF2 params
-ITERATIONS = 200_000
+ITERATIONS = int(os.getenv("PYRAMID_PBKDF2_ITERATIONS", "200000"))  # cost for new hashes / rehash target
+LEGACY_ITERATIONS = 200_000  # rows without an iterations value were hashed with this
+
+# Hashing pool
+HASH_WORKERS = int(os.getenv("PYRAMID_HASH_WORKERS", str(os.cpu_count() or 2)))
+HASH_QUEUE_DEPTH = int(os.getenv("PYRAMID_HASH_QUEUE", str(HASH_WORKERS * 4)))  # queued + running hashes
+HASH_TIMEOUT = 10.0
+
+# Throttling: attempts allowed per sliding window, checked before any hashing
+THROTTLE_WINDOW = 60.0
+THROTTLE_PER_USER = 5
+THROTTLE_PER_IP = 30
+
+class LoginThrottled(ValueError):
+    """Raised when a login/registration is shed (too many attempts or hashing pool saturated)."""
+
+_executor = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix="pbkdf2")
+_slots = threading.BoundedSemaphore(HASH_QUEUE_DEPTH)
+_metrics_lock = threading.Lock()
+_latencies = deque(maxlen=2000)  # seconds from submit to result
+_counters = defaultdict(int)
+
+class _Throttle:
+    """Sliding-window attempt counter per key (username or IP)."""
+    def __init__(self, limit, window=THROTTLE_WINDOW):
+        self.limit, self.window = limit, window
+        self._hits = defaultdict(deque)
+        self._lock = threading.Lock()
+
+    def allow(self, key) -> bool:
+        if not key:
+            return True
+        now = time.monotonic()
+        with self._lock:
+            q = self._hits[key]
+            while q and now - q[0] > self.window:
+                q.popleft()
+            if len(q) >= self.limit:
+                return False
+            q.append(now)
+            if len(self._hits) > 100_000:  # drop idle keys so the map stays bounded
+                for k in [k for k, v in self._hits.items() if not v or now - v[-1] > self.window]:
+                    del self._hits[k]
+            return True
+
+    def reset(self, key):
+        with self._lock:
+            self._hits.pop(key, None)
+
+_user_throttle = _Throttle(THROTTLE_PER_USER)
+_ip_throttle = _Throttle(THROTTLE_PER_IP)
 
 def _make_salt() -> str:
     return binascii.hexlify(os.urandom(16)).decode()
 
-def _hash_password(password: str, salt: str) -> str:
-    dk = hashlib.pbkdf2_hmac("sha256", password.encode(), salt.encode(), ITERATIONS)
+def _pbkdf2(password: str, salt: str, iterations: int) -> str:
+    dk = hashlib.pbkdf2_hmac("sha256", password.encode(), salt.encode(), iterations)
     return binascii.hexlify(dk).decode()
 
-def register_user(username: str, password: str, email: Optional[str]=None, referrer_username: Optional[str]=None):
+def _hash_password(password: str, salt: str, iterations: int = None) -> str:
+    """PBKDF2 on the hashing pool; raises LoginThrottled if HASH_QUEUE_DEPTH hashes are already in flight."""
+    if not _slots.acquire(blocking=False):
+        with _metrics_lock:
+            _counters["shed_busy"] += 1
+        raise LoginThrottled("Server busy, please try again in a moment")
+    started = time.perf_counter()
+    try:
+        future = _executor.submit(_pbkdf2, password, salt, iterations or ITERATIONS)
+    except BaseException:
+        _slots.release()
+        raise
+    # the slot belongs to the hash, not the caller: a caller that times out leaves it taken until the job ends
+    future.add_done_callback(lambda _: _slots.release())
+    try:
+        return future.result(timeout=HASH_TIMEOUT)
+    finally:
+        with _metrics_lock:
+            _latencies.append(time.perf_counter() - started)
+            _counters["hashes"] += 1
+
+def hash_stats():
+    """Hash count, shed counts and submit-to-result latency percentiles (ms)."""
+    with _metrics_lock:
+        lat = sorted(_latencies)
+        out = dict(_counters)
+    pct = lambda p: round(lat[min(len(lat) - 1, int(p * len(lat)))] * 1000, 2) if lat else None
+    out.update({"workers": HASH_WORKERS, "queue_depth": HASH_QUEUE_DEPTH, "iterations": ITERATIONS,
+                "p50_ms": pct(0.50), "p95_ms": pct(0.95), "p99_ms": pct(0.99)})
+    return out
+
+def _throttle(username, ip):
+    if not _ip_throttle.allow(ip) or not _user_throttle.allow(username):
+        with _metrics_lock:
+            _counters["shed_throttled"] += 1
+        raise LoginThrottled("Too many attempts, please wait a minute and try again")
+
+def register_user(username: str, password: str, email: Optional[str]=None, referrer_username: Optional[str]=None, ip: Optional[str]=None):
+    _throttle(None, ip)
     salt = _make_salt()
     ph = _hash_password(password, salt)
     parent_id = None
     level = 0
-    if referrer_username:
-        with get_db() as con:
-            cur = con.execute("SELECT id, level FROM users WHERE username = ?", (referrer_username,))
-            r = cur.fetchone()
+    with get_db() as con:
+        if referrer_username:
+            r = con.execute("SELECT id, level FROM users WHERE username = ?", (referrer_username,)).fetchone()
             if r:
                 parent_id = r["id"]
                 level = (r["level"] or 0) + 1
-    with get_db() as con:
+        uid = insert_id(
+            con,
+            "INSERT INTO users (username, email, password_hash, salt, iterations, parent_id, level) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (username, email, ph, salt, ITERATIONS, parent_id, level)
+        )
+        # closure rows: self at depth 0 plus every ancestor of the parent one level further away
         con.execute(
-            "INSERT INTO users (username, email, password_hash, salt, parent_id, level) VALUES (?, ?, ?, ?, ?, ?)",
-            (username, email, ph, salt, parent_id, level)
+            "INSERT INTO user_closure (ancestor_id, descendant_id, depth) "
+            "SELECT ?, ?, 0 UNION ALL "
+            "SELECT ancestor_id, ?, depth + 1 FROM user_closure WHERE descendant_id = ?",
+            (uid, uid, uid, parent_id)
         )
+        bump_counter(con, "users")
+        upline = [r["ancestor_id"] for r in con.execute(
+            "SELECT ancestor_id FROM user_closure WHERE descendant_id = ? AND depth > 0", (uid,)).fetchall()]
         con.commit()
+    cache.invalidate("kpi", *(f"referrals:{a}" for a in upline))
     return True
 
-def authenticate(username: str, password: str):
+def authenticate(username: str, password: str, ip: Optional[str]=None):
+    _throttle(username, ip)
     with get_db() as con:
-        cur = con.execute("SELECT * FROM users WHERE username = ?", (username,))
-        row = cur.fetchone()
-        if not row:
-            return None
-        expected = _hash_password(password, row["salt"])
-        if expected == row["password_hash"]:
-            return row
-    return None
+        row = con.execute("SELECT * FROM users WHERE username = ?", (username,)).fetchone()
+    if not row:
+        return None
+    iterations = row["iterations"] or LEGACY_ITERATIONS
+    expected = _hash_password(password, row["salt"], iterations)
+    if not hmac.compare_digest(expected, row["password_hash"]):
+        return None
+    _user_throttle.reset(username)
+    if iterations != ITERATIONS:
+        # transparent rehash at the current cost
+        salt = _make_salt()
+        ph = _hash_password(password, salt)
+        with get_db() as con:
+            con.execute("UPDATE users SET password_hash = ?, salt = ?, iterations = ? WHERE id = ? AND password_hash = ?",
+                        (ph, salt, ITERATIONS, row["id"], row["password_hash"]))
+            con.commit()
+            row = con.execute("SELECT * FROM users WHERE id = ?", (row["id"],)).fetchone()
+        cache.invalidate(f"user:{row['id']}")
+        with _metrics_lock:
+            _counters["rehashed"] += 1
+    return row
 
+@cache.cached("user:{uid}")
 def get_user_by_id(uid: int):
     with get_db() as con:
         return con.execute("SELECT * FROM users WHERE id = ?", (uid,)).fetchone()
@@ -0,0 +1,17 @@
+# benchmarks/__init__.py
+"""
+Micro-benchmarks for the hot database paths.
+Run from the repository root, e.g.:
+    python -m benchmarks.run --users 10000 100000 1000000 --out bench.json
+    python -m benchmarks.generate --users 100000   (synthetic tree + history only)
+    python -m benchmarks.bench_parent_chain
+
+Benchmarks never touch the real pyramid_app.db: unless PYRAMID_DB is already
+set, importing this package points the db module at a throwaway file.
+"""
+
+import os
+import tempfile
+
+if "PYRAMID_DB" not in os.environ:
+    os.environ["PYRAMID_DB"] = os.path.join(tempfile.mkdtemp(prefix="pyramid_bench_"), "bench.db")
@@ -0,0 +1,63 @@
+# benchmarks/bench_parent_chain.py
+"""
+Upline resolution: per-level SELECT loop (old get_parent_chain / distribute_commissions)
+vs the single WITH RECURSIVE query in referral.get_ancestors, for chain depths 1..50.
+
+    python -m benchmarks.bench_parent_chain [--repeat 200]
+"""
+
+import argparse
+import time
+
+import benchmarks  # noqa: F401  (selects a throwaway DB before db is imported)
+from db import get_db, init_db, insert_id
+from referral import get_ancestors
+
+MAX_DEPTH = 50
+
+def build_chain(depth):
+    """Insert a straight line of `depth + 1` users; returns the id of the deepest one."""
+    with get_db() as con:
+        con.execute("DELETE FROM users")
+        parent = None
+        for lvl in range(depth + 1):
+            parent = insert_id(
+                con, "INSERT INTO users (username, password_hash, salt, parent_id, level) VALUES (?, 'x', 'x', ?, ?)",
+                (f"bench_{lvl}", parent, lvl))
+        con.commit()
+    return parent
+
+def loop_chain(con, user_id, max_levels):
+    """The pre-CTE implementation: one round-trip per level."""
+    chain = []
+    cur_id = user_id
+    for _ in range(max_levels):
+        r = con.execute("SELECT parent_id FROM users WHERE id = ?", (cur_id,)).fetchone()
+        if not r or not r["parent_id"]:
+            break
+        chain.append(r["parent_id"])
+        cur_id = r["parent_id"]
+    return chain
+
+def timeit(fn, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat * 1e6
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__)
+    ap.add_argument("--repeat", type=int, default=200)
+    args = ap.parse_args()
+    init_db()
+    leaf = build_chain(MAX_DEPTH)
+    print(f"{'depth':>5} {'loop_us':>10} {'cte_us':>10} {'speedup':>8}")
+    for depth in (1, 2, 3, 5, 10, 20, 30, 40, 50):
+        with get_db() as con:
+            assert loop_chain(con, leaf, depth) == [a for a, _ in get_ancestors(leaf, depth, con)]
+            loop_us = timeit(lambda: loop_chain(con, leaf, depth), args.repeat)
+            cte_us = timeit(lambda: get_ancestors(leaf, depth, con), args.repeat)
+        print(f"{depth:>5} {loop_us:>10.1f} {cte_us:>10.1f} {loop_us / cte_us:>7.1f}x")
+
+if __name__ == "__main__":
+    main()
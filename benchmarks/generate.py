@@ -0,0 +1,171 @@
+# benchmarks/generate.py
+"""
+Synthetic data for benchmarks: one referral tree of `users` members plus a chronological
+transaction history (approved deposits with their commissions, some withdrawals) and a tail
+of pending requests, written straight into the current database with executemany.
+Derived tables (closure, rollups, ledger checkpoints / users.balance) are rebuilt at the end,
+so the result looks like a database grown through the app.
+
+    python -m benchmarks.generate --users 100000 [--branching 3] [--max-depth 20] [--balanced]
+"""
+
+import argparse
+import random
+import time
+from collections import deque
+from datetime import datetime, timedelta
+
+import benchmarks  # noqa: F401  (selects a throwaway DB before db is imported)
+import auth
+import db
+import ledger
+import stats
+from db import get_db, get_config
+from payment import _commission_rates, _commissions_for
+
+BENCH_PASSWORD = "bench-password"  # every generated member can log in with this
+BATCH = 20_000  # transactions per executemany/commit
+
+def _sync_sequence(con, table):
+    """Rows were inserted with explicit ids: move the Postgres id sequence past them."""
+    if db.dialect() == "postgresql":
+        con.execute(f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), (SELECT MAX(id) FROM {table}))")
+
+def build_tree(users, branching, max_depth=None, balanced=False, seed=42):
+    """
+    parent index per member (None for the root) and depth. Each new member joins under an
+    'open' member (fewer than `branching` referrals, above max_depth): the oldest one when
+    balanced, otherwise a random one, which gives a deeper, uneven tree.
+    """
+    rng = random.Random(seed)
+    parents, levels, children = [None], [0], [0]
+    open_ = deque([0]) if balanced else [0]
+    for i in range(1, users):
+        if not open_:
+            raise ValueError("tree is full: raise branching or max_depth")
+        if balanced:
+            p = open_[0]
+        else:
+            k = rng.randrange(len(open_))
+            p = open_[k]
+        parents.append(p)
+        levels.append(levels[p] + 1)
+        children.append(0)
+        children[p] += 1
+        if children[p] >= branching:
+            if balanced:
+                open_.popleft()
+            else:
+                open_[k] = open_[-1]
+                open_.pop()
+        if max_depth is None or levels[i] < max_depth:
+            open_.append(i)
+    return parents, levels
+
+def generate(users, branching=None, max_depth=None, balanced=False, tx_per_user=2, withdraw_ratio=0.2,
+             pending=500, days=90, seed=42):
+    """
+    Fill the empty current database; returns a summary dict. Member i gets id i + 1 and
+    username 'bench_<id>'; the root is id 1.
+    """
+    branching = branching or get_config("branching", 3)
+    rng = random.Random(seed)
+    started = time.perf_counter()
+    parents, levels = build_tree(users, branching, max_depth, balanced, seed)
+    rates = _commission_rates()
+    salt = "benchsalt"
+    ph = auth._pbkdf2(BENCH_PASSWORD, salt, auth.ITERATIONS)
+
+    events = users * (1 + tx_per_user)  # one join + tx_per_user money events per member, spread over `days`
+    t0 = datetime.utcnow() - timedelta(days=days)
+    step = timedelta(days=days) / events
+    balances = [0] * users
+    user_rows, tx_rows, ledger_rows = [], [], []
+    tx_id, joined = 0, 0
+    counts = {"deposit": 0, "withdrawal": 0, "commission": 0, "pending": 0}
+
+    def flush(con):
+        con.executemany("INSERT INTO users (id, username, password_hash, salt, iterations, parent_id, level, created_at) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?, ?)", user_rows)
+        con.executemany("INSERT INTO transactions (id, member_id, type, method, amount, status, note, source_tx_id, created_at) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", tx_rows)
+        con.executemany("INSERT INTO ledger (tx_id, account, user_id, amount, created_at) VALUES (?, ?, ?, ?, ?)", ledger_rows)
+        con.commit()
+        user_rows.clear(); tx_rows.clear(); ledger_rows.clear()
+
+    with get_db() as con:
+        if con.execute("SELECT 1 FROM users LIMIT 1").fetchone():
+            raise ValueError("generate() expects an empty database")
+        for j in range(events):
+            now = (t0 + step * j).isoformat()
+            if joined < users and j >= joined * events // users:
+                p = parents[joined]
+                user_rows.append((joined + 1, f"bench_{joined + 1}", ph, salt, auth.ITERATIONS,
+                                  None if p is None else p + 1, levels[joined], now.replace("T", " ")[:19]))
+                joined += 1
+                continue
+            m = rng.randrange(joined)
+            if balances[m] and rng.random() < withdraw_ratio:
+                amount = rng.randint(1, balances[m] // 100 or 1) * 100
+                tx_id += 1
+                tx_rows.append((tx_id, m + 1, "withdrawal", rng.choice(("nagad", "bkash", "rocket")), amount, "approved", None, None, now))
+                ledger_rows.extend((tx_id, acc, uid, amt, now) for acc, uid, amt in ledger.withdrawal_legs(m + 1, amount))
+                balances[m] -= amount
+                counts["withdrawal"] += 1
+            else:
+                amount = rng.randint(1, 500) * 1000  # ৳10 .. ৳5000
+                tx_id += 1
+                dep_id = tx_id
+                tx_rows.append((dep_id, m + 1, "deposit", rng.choice(("nagad", "bkash", "rocket")), amount, "approved", None, None, now))
+                legs = ledger.deposit_legs(m + 1, amount)
+                balances[m] += amount
+                chain, cur = [], parents[m]
+                while cur is not None and len(chain) < len(rates):
+                    chain.append(cur + 1)
+                    cur = parents[cur]
+                for parent_id, comm, level in _commissions_for(m + 1, amount, chain, rates):
+                    tx_id += 1
+                    tx_rows.append((tx_id, parent_id, "commission", "system", comm, "approved",
+                                    f"Level {level} commission from member {m + 1}", dep_id, now))
+                    legs += ledger.commission_legs(parent_id, comm)
+                    balances[parent_id - 1] += comm
+                    counts["commission"] += 1
+                ledger_rows.extend((dep_id, acc, uid, amt, now) for acc, uid, amt in legs)
+                counts["deposit"] += 1
+            if len(tx_rows) >= BATCH:
+                flush(con)
+        now = datetime.utcnow().isoformat()
+        for _ in range(pending):  # work for the approval benchmarks
+            m = rng.randrange(users)
+            tx_id += 1
+            tx_rows.append((tx_id, m + 1, "deposit", "bkash", rng.randint(1, 500) * 1000, "pending", None, None, now))
+            counts["pending"] += 1
+        flush(con)
+        _sync_sequence(con, "users")
+        _sync_sequence(con, "transactions")
+        con.commit()
+        closure = db.rebuild_user_closure(con)
+    stats.rebuild_rollups()
+    ledger.compact(min_entries=1)
+    db.invalidate_config_cache()
+    return {"users": users, "branching": branching, "max_depth": max(levels), "transactions": tx_id,
+            "closure_rows": closure, **counts, "seconds": round(time.perf_counter() - started, 2)}
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--users", type=int, default=10_000)
+    ap.add_argument("--branching", type=int, default=None, help="max direct referrals per member (default: config 'branching')")
+    ap.add_argument("--max-depth", type=int, default=None)
+    ap.add_argument("--balanced", action="store_true", help="fill level by level instead of joining random open members")
+    ap.add_argument("--tx-per-user", type=int, default=2)
+    ap.add_argument("--pending", type=int, default=500)
+    ap.add_argument("--days", type=int, default=90)
+    ap.add_argument("--seed", type=int, default=42)
+    args = ap.parse_args()
+    db.init_db()
+    print(generate(args.users, args.branching, args.max_depth, args.balanced, args.tx_per_user,
+                   pending=args.pending, days=args.days, seed=args.seed))
+    print(f"database: {db.DB_PATH if db.dialect() == 'sqlite' else 'DATABASE_URL'}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+# benchmarks/ingest.py
+"""
+Load test for the ingestion service (ingest.py): generates a member tree into a throwaway
+database, starts `python -m ingest` on it and drives it with keep-alive clients, each sending
+single-transaction POST /transactions requests back to back (the worst case for commit cost).
+
+    python -m benchmarks.ingest [--users 10000] [--clients 64] [--seconds 10] [--items 1] [--out ingest.json]
+
+Reports requests/s, latency percentiles, the resubmission (duplicate) pass and the service's own
+group-commit counters from /health.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.run import _meta, _summary
+
+TOKEN = "bench-token"
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+async def _call(reader, writer, method, path, body=None):
+    data = json.dumps(body).encode() if body is not None else b""
+    writer.write(f"{method} {path} HTTP/1.1\r\nHost: bench\r\nAuthorization: Bearer {TOKEN}\r\n"
+                 f"Content-Type: application/json\r\nContent-Length: {len(data)}\r\n\r\n".encode() + data)
+    await writer.drain()
+    head = await reader.readuntil(b"\r\n\r\n")
+    length = next(int(l.split(b":", 1)[1]) for l in head.split(b"\r\n") if l.lower().startswith(b"content-length:"))
+    status = int(head.split(b" ", 2)[1])
+    return status, json.loads(await reader.readexactly(length))
+
+async def _client(port, k, users, items, until, refs, samples, errors):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    rng = random.Random(k)
+    i = 0
+    while time.perf_counter() < until:
+        batch = [{"member_id": rng.randint(1, users), "type": "deposit", "amount": rng.randint(1, 500) * 100, "method": "bkash",
+                  "external_ref": f"bench-{k}-{i}-{j}"} for j in range(items)]
+        i += 1
+        started = time.perf_counter()
+        status, body = await _call(reader, writer, "POST", "/transactions", batch)
+        samples.append(time.perf_counter() - started)
+        if status != 200 or any("error" in r for r in body["results"]):
+            errors.append(body)
+        refs.extend(it for it in batch)
+    writer.close()
+
+async def _drive(port, users, clients, seconds, items):
+    samples, errors, sent = [], [], []
+    started = time.perf_counter()
+    await asyncio.gather(*(_client(port, k, users, items, started + seconds, sent, samples, errors) for k in range(clients)))
+    elapsed = time.perf_counter() - started
+    # resubmit a sample of what was sent: every item must come back as a duplicate
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    again = random.Random(0).sample(sent, min(1000, len(sent)))
+    _, body = await _call(reader, writer, "POST", "/transactions", again)
+    _, health = await _call(reader, writer, "GET", "/health")
+    writer.close()
+    return {"requests": len(samples), "items": len(sent), "seconds": round(elapsed, 2),
+            "requests_per_sec": round(len(samples) / elapsed, 1), "items_per_sec": round(len(sent) / elapsed, 1),
+            "latency": _summary(samples), "errors": len(errors), "first_error": errors[0] if errors else None,
+            "resubmitted": len(again), "resubmitted_duplicates": sum(bool(r.get("duplicate")) for r in body["results"]),
+            "service": health}
+
+async def _wait_ready(port, proc, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise SystemExit("ingest service exited during startup")
+        try:
+            reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        except OSError:
+            await asyncio.sleep(0.1)
+            continue
+        await _call(reader, writer, "GET", "/health")
+        writer.close()
+        return
+    raise SystemExit("ingest service did not start")
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--users", type=int, default=10_000)
+    ap.add_argument("--clients", type=int, default=64, help="concurrent keep-alive connections")
+    ap.add_argument("--seconds", type=float, default=10)
+    ap.add_argument("--items", type=int, default=1, help="transactions per request")
+    ap.add_argument("--out", default=None, help="write JSON here (default: stdout)")
+    args = ap.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="pyramid_ingest_")
+    env = dict(os.environ, PYRAMID_DB=os.path.join(workdir, "ingest.db"), PYRAMID_INGEST_TOKEN=TOKEN)
+    print(f"[bench] generating {args.users:,} users ...", file=sys.stderr)
+    subprocess.run([sys.executable, "-m", "benchmarks.generate", "--users", str(args.users), "--tx-per-user", "0"],
+                   env=env, check=True, stdout=subprocess.DEVNULL)
+    port = _free_port()
+    proc = subprocess.Popen([sys.executable, "-m", "ingest", "--port", str(port)], env=env, stdout=subprocess.DEVNULL)
+    try:
+        asyncio.run(_wait_ready(port, proc))
+        print(f"[bench] {args.clients} clients x {args.seconds:g}s, {args.items} item(s) per request ...", file=sys.stderr)
+        result = asyncio.run(_drive(port, args.users, args.clients, args.seconds, args.items))
+    finally:
+        proc.terminate()
+        proc.wait()
+    text = json.dumps({"meta": _meta(), "config": vars(args), "result": result}, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text + "\n")
+        print(f"[bench] results written to {args.out}", file=sys.stderr)
+    else:
+        print(text)
+
+if __name__ == "__main__":
+    main()
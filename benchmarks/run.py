@@ -0,0 +1,148 @@
+# benchmarks/run.py
+"""
+Hot-path benchmark suite. For every size a fresh database is generated (benchmarks.generate)
+in a child process, then each path is timed; results are written as JSON so runs can be
+compared across versions.
+
+    python -m benchmarks.run [--users 10000 100000 1000000] [--out bench.json] [--repeat 50]
+
+Paths: register_user, authenticate, approve_transaction, approve_transactions (bulk),
+distribute_commissions (inline, rolled back), commission_worker (queue drain),
+get_parent_chain, referral_tree, kpi_cards queries, CSV export (one member / one day).
+With DATABASE_URL set every size runs against that database, which must start out empty
+(run one size at a time).
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date
+
+SIZES = (10_000, 100_000, 1_000_000)
+
+def _summary(samples):
+    s = sorted(samples)
+    pct = lambda p: s[min(len(s) - 1, int(p * len(s)))] * 1000
+    total = sum(s)
+    return {"n": len(s), "mean_ms": round(total / len(s) * 1000, 3), "p50_ms": round(pct(0.50), 3),
+            "p95_ms": round(pct(0.95), 3), "max_ms": round(s[-1] * 1000, 3),
+            "ops_per_sec": round(len(s) / total, 1) if total else None}
+
+def _time(fn, args_list):
+    samples = []
+    for a in args_list:
+        started = time.perf_counter()
+        fn(*a)
+        samples.append(time.perf_counter() - started)
+    return _summary(samples)
+
+def run_size(users, repeat, seed=7):
+    """Generate `users` members into the current (empty) database and time every path; runs in the child process."""
+    import auth
+    import commission_worker
+    import db
+    import payment
+    import referral
+    import stats
+    import ui
+    from benchmarks.generate import BENCH_PASSWORD, generate
+
+    db.init_db()
+    auth._user_throttle.limit = auth._ip_throttle.limit = 10 ** 9  # measure hashing, not the limiter
+    rng = random.Random(seed)
+    out = {"generate": generate(users, seed=seed)}
+    ids = lambda n: [rng.randint(1, users) for _ in range(n)]
+    results = out["results"] = {}
+
+    hash_n = min(repeat, 20)  # PBKDF2 dominates these; a few samples are enough
+    results["register_user"] = _time(lambda i, ref: auth.register_user(f"new_{i}", BENCH_PASSWORD, referrer_username=f"bench_{ref}"),
+                                     [(i, r) for i, r in enumerate(ids(hash_n))])
+    results["authenticate"] = _time(lambda u: auth.authenticate(f"bench_{u}", BENCH_PASSWORD), [(u,) for u in ids(hash_n)])
+
+    with db.get_db() as con:
+        pending = [r["id"] for r in con.execute("SELECT id FROM transactions WHERE status = 'pending' ORDER BY id").fetchall()]
+    single, bulk = pending[:repeat], pending[repeat:]
+    results["approve_transaction"] = _time(payment.approve_transaction, [(t,) for t in single])
+    started = time.perf_counter()
+    r = payment.approve_transactions(bulk)
+    results["approve_transactions"] = {"n": len(bulk), "seconds": round(time.perf_counter() - started, 3),
+                                       "tx_per_sec": round(r["tx_per_sec"], 1)}
+    started = time.perf_counter()
+    drained = commission_worker.drain()
+    elapsed = time.perf_counter() - started
+    results["commission_worker"] = {"n": drained, "seconds": round(elapsed, 3),
+                                    "jobs_per_sec": round(drained / elapsed, 1) if elapsed else None}
+
+    def distribute(member_id):
+        with db.get_db() as con:
+            db.begin(con)
+            payment.distribute_commissions(con, member_id, 100_000)
+            con.rollback()
+    results["distribute_commissions"] = _time(distribute, [(u,) for u in ids(repeat)])
+
+    results["get_parent_chain"] = _time(referral.get_parent_chain, [(u,) for u in ids(repeat)])
+    results["referral_tree_root"] = _time(lambda: referral.referral_tree(1, depth=2, child_limit=25), [()] * min(repeat, 20))
+    results["referral_tree"] = _time(lambda u: referral.referral_tree(u, depth=3, child_limit=25), [(u,) for u in ids(repeat)])
+
+    def kpis():
+        stats.get_counter("users")
+        stats.get_total("deposit", "approved")
+        stats.get_total("withdrawal", "approved")
+        stats.daily_series(30)
+    results["kpi_cards"] = _time(kpis, [()] * repeat)
+
+    def export(**filters):
+        path, _ = ui.transactions_csv_file(**filters)
+        os.remove(path)
+    results["csv_export_member"] = _time(lambda u: export(member_id=u), [(u,) for u in ids(min(repeat, 20))])
+    results["csv_export_day"] = _time(lambda: export(date_from=date.today(), date_to=date.today()), [()] * 3)
+    return out
+
+def _meta():
+    try:
+        rev = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        rev = None
+    return {"git_rev": rev, "python": platform.python_version(), "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(), "database_url": bool(os.getenv("DATABASE_URL")),
+            "started_at": time.strftime("%Y-%m-%dT%H:%M:%S")}
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--users", type=int, nargs="+", default=list(SIZES))
+    ap.add_argument("--repeat", type=int, default=50, help="samples per timed path")
+    ap.add_argument("--out", default=None, help="write JSON here (default: stdout)")
+    ap.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args.child:  # one size against the database selected by the parent
+        print(json.dumps(run_size(args.users[0], args.repeat)))
+        return
+    report = {"meta": _meta(), "sizes": {}}
+    for n in args.users:
+        workdir = tempfile.mkdtemp(prefix=f"pyramid_bench_{n}_")
+        env = dict(os.environ, PYRAMID_DB=os.path.join(workdir, "bench.db"), PYRAMID_COMMISSION_WORKERS="0")
+        print(f"[bench] {n:,} users ...", file=sys.stderr)
+        proc = subprocess.run([sys.executable, "-m", "benchmarks.run", "--child", "--users", str(n), "--repeat", str(args.repeat)],
+                              env=env, capture_output=True, text=True)
+        if proc.returncode:
+            sys.stderr.write(proc.stderr)
+            raise SystemExit(f"benchmark for {n} users failed")
+        report["sizes"][str(n)] = json.loads(proc.stdout.strip().splitlines()[-1])
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text + "\n")
+        print(f"[bench] results written to {args.out}", file=sys.stderr)
+    else:
+        print(text)
+
+if __name__ == "__main__":
+    main()
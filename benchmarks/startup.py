@@ -0,0 +1,108 @@
+# benchmarks/startup.py
+"""
+Cold-start benchmark: every sample runs in a fresh interpreter (imports are per process), so the
+numbers are what a new Streamlit server process, a worker or a manage.py command pays.
+
+    python -m benchmarks.startup [--repeat 5] [--out startup.json]
+
+Phases (each timed in its own child process against a throwaway database):
+- imports: app modules without the UI (db, auth, payment, referral, ledger, stats, config, cache,
+  commission_worker), then ui; reports which heavy libraries ended up loaded
+- init_db: on a new database (schema + seed), on an existing one (new process), and a repeat call
+- render: first run of main.py for an anonymous visitor (includes importing the app), an unchanged
+  rerun, and the first render of a logged-in user's dashboard
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from benchmarks.run import _meta, _summary
+
+CORE = ("db", "auth", "payment", "referral", "ledger", "stats", "config", "cache", "commission_worker")
+HEAVY = ("pandas", "matplotlib", "numpy", "plotly")
+MAIN = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "main.py")
+
+def _loaded():
+    return [m for m in HEAVY if m in sys.modules]
+
+def _clock(fn):
+    started = time.perf_counter()
+    fn()
+    return time.perf_counter() - started
+
+def phase_imports():
+    out = {"import_core": _clock(lambda: [__import__(m) for m in CORE])}
+    out["loaded_after_core"] = _loaded()
+    out["import_ui"] = _clock(lambda: __import__("ui"))
+    out["loaded_after_ui"] = _loaded()
+    return out
+
+def phase_init():
+    import db
+    new = not db.DB_PATH.exists()
+    first = _clock(db.init_db)
+    return {"init_db_new" if new else "init_db_existing": first, "init_db_repeat": _clock(db.init_db)}
+
+def phase_render():
+    from streamlit.testing.v1 import AppTest
+    at = AppTest.from_file(MAIN, default_timeout=120)
+    out = {"first_render": _clock(at.run)}
+    out["rerun"] = _clock(at.run)
+    out["loaded_after_render"] = _loaded()
+    import auth
+    auth.register_user(f"startup_{os.getpid()}", "startup-pass")
+    user = auth.authenticate(f"startup_{os.getpid()}", "startup-pass")
+    at = AppTest.from_file(MAIN, default_timeout=120)
+    at.session_state["user_id"] = user["id"]
+    out["user_first_render"] = _clock(at.run)
+    out["loaded_after_user_render"] = _loaded()
+    if at.exception:
+        raise SystemExit(f"main.py raised: {at.exception[0].message}")
+    return out
+
+PHASES = {"imports": phase_imports, "init": phase_init, "render": phase_render}
+
+def _child(phase, env):
+    proc = subprocess.run([sys.executable, "-m", "benchmarks.startup", "--child", phase], env=env, capture_output=True, text=True)
+    if proc.returncode:
+        sys.stderr.write(proc.stderr)
+        raise SystemExit(f"startup benchmark phase {phase!r} failed")
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument("--repeat", type=int, default=5, help="fresh processes per phase")
+    ap.add_argument("--out", default=None, help="write JSON here (default: stdout)")
+    ap.add_argument("--child", choices=sorted(PHASES), help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args.child:
+        print(json.dumps(PHASES[args.child]()))
+        return
+    samples, loaded = {}, {}
+    for i in range(args.repeat):
+        workdir = tempfile.mkdtemp(prefix="pyramid_startup_")
+        env = dict(os.environ, PYRAMID_DB=os.path.join(workdir, "startup.db"), PYRAMID_COMMISSION_WORKERS="0")
+        print(f"[bench] startup sample {i + 1}/{args.repeat} ...", file=sys.stderr)
+        for phase in ("init", "init", "imports", "render"):  # new database, then existing
+            for k, v in _child(phase, env).items():
+                if k.startswith("loaded_"):
+                    loaded[k] = v
+                else:
+                    samples.setdefault(k, []).append(v)
+    report = {"meta": _meta(), "results": {k: _summary(v) for k, v in samples.items()}, "heavy_modules": loaded}
+    text = json.dumps(report, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(text + "\n")
+        print(f"[bench] results written to {args.out}", file=sys.stderr)
+    else:
+        print(text)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+# cache.py
+"""
+Per-session read cache for Streamlit reruns with write-driven invalidation.
+- @cached(*tags): memoize a read function in the current session's LRU (bypassed outside a
+  Streamlit session, so workers/scripts always read the database)
+- invalidate(*tags): the invalidation bus; write paths publish the tags they changed after commit
+  and every live session cache in the process drops the matching entries ("user:*" = prefix)
+- member_changed(*member_ids): the usual publication for a money write
+- stats(): hits / misses / evictions / invalidations
+Tags:
+- "user:<id>"       user row and ledger balance of a member
+- "tx:<id>"         that member's transaction lists; "tx:all" lists not filtered by member
+- "referrals:<id>"  downline of a member (direct referrals, level counts, tree)
+- "kpi"             rollup-backed KPIs and charts
+Entries also expire after CACHE_TTL seconds, which bounds staleness from writers in other
+processes (e.g. `python -m commission_worker`).
+"""
+
+import inspect
+import os
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from functools import wraps
+
+import streamlit as st
+
+try:
+    from streamlit.runtime.scriptrunner import get_script_run_ctx
+except ImportError:  # streamlit layout without the runtime package: no session caching
+    def get_script_run_ctx(suppress_warning=False):
+        return None
+
+CACHE_MAX_ENTRIES = int(os.getenv("PYRAMID_CACHE_SIZE", "256"))  # per session
+CACHE_TTL = float(os.getenv("PYRAMID_CACHE_TTL", "60"))
+_SESSION_KEY = "_pyramid_read_cache"
+
+_lock = threading.Lock()
+_caches = weakref.WeakSet()  # every live session cache, reached by invalidate()
+_seq = 0  # bumped by every invalidation; a read that overlapped one is not stored
+_stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0, "dropped": 0, "bypassed": 0}
+
+class SessionCache:
+    """Size-bounded LRU of key -> (value, tags, stored_at) with a tag -> keys index."""
+
+    def __init__(self, maxsize=CACHE_MAX_ENTRIES):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+        self.by_tag = {}
+
+    def get(self, key):
+        e = self.entries.get(key)
+        if e is None:
+            return None
+        if time.monotonic() - e[2] > CACHE_TTL:
+            self._drop(key)
+            return None
+        self.entries.move_to_end(key)
+        return e
+
+    def put(self, key, value, tags):
+        if key in self.entries:
+            self._drop(key)
+        self.entries[key] = (value, tags, time.monotonic())
+        for t in tags:
+            self.by_tag.setdefault(t, set()).add(key)
+        while len(self.entries) > self.maxsize:
+            self._drop(next(iter(self.entries)))
+            _stats["evictions"] += 1
+
+    def _drop(self, key):
+        _, tags, _ = self.entries.pop(key)
+        for t in tags:
+            keys = self.by_tag.get(t)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.by_tag[t]
+
+    def invalidate(self, tags):
+        n = 0
+        for tag in tags:
+            if tag.endswith("*"):
+                matched = [t for t in self.by_tag if t.startswith(tag[:-1])]
+            else:
+                matched = [tag] if tag in self.by_tag else []
+            for t in matched:
+                for key in list(self.by_tag.get(t, ())):
+                    self._drop(key)
+                    n += 1
+        return n
+
+def _session_cache():
+    if get_script_run_ctx(suppress_warning=True) is None:  # worker thread, script, ingest service
+        return None
+    c = st.session_state.get(_SESSION_KEY)
+    if c is None:
+        c = st.session_state[_SESSION_KEY] = SessionCache()
+        with _lock:
+            _caches.add(c)
+    return c
+
+def invalidate(*tags):
+    """Publish changed tags to every session cache in this process (call after the write committed)."""
+    global _seq
+    with _lock:
+        _seq += 1
+        _stats["invalidations"] += 1
+        for c in list(_caches):
+            _stats["dropped"] += c.invalidate(tags)
+
+def member_changed(*member_ids):
+    """Money moved for these members: their rows/balances, their and global transaction lists, KPIs."""
+    ids = set(member_ids)
+    invalidate("tx:all", "kpi", *(f"user:{m}" for m in ids), *(f"tx:{m}" for m in ids))
+
+def tx_tag(member_id):
+    return f"tx:{member_id}" if member_id else "tx:all"
+
+def _hashable(v):
+    if isinstance(v, (set, frozenset)):
+        return frozenset(v)
+    if isinstance(v, dict):
+        return tuple(sorted((k, _hashable(x)) for k, x in v.items()))
+    if isinstance(v, list):
+        return tuple(_hashable(x) for x in v)
+    return v
+
+def cached(*tags):
+    """
+    Cache a read function per session. Each tag is a format string over the call's arguments
+    (defaults applied, **kwargs flattened), e.g. "user:{uid}", or a callable taking that mapping.
+    """
+    def wrap(fn):
+        sig = inspect.signature(fn)
+        var_kw = next((p.name for p in sig.parameters.values() if p.kind is p.VAR_KEYWORD), None)
+
+        @wraps(fn)
+        def inner(*args, **kwargs):
+            cache = _session_cache()
+            if cache is None:
+                return fn(*args, **kwargs)
+            bound = sig.bind(*args, **kwargs)
+            bound.apply_defaults()
+            arguments = dict(bound.arguments)
+            arguments.update(arguments.pop(var_kw, None) or {})
+            try:
+                key = (fn.__module__, fn.__qualname__, _hashable(arguments))
+                hash(key)
+            except TypeError:
+                with _lock:
+                    _stats["bypassed"] += 1
+                return fn(*args, **kwargs)
+            with _lock:
+                hit = cache.get(key)
+                if hit is not None:
+                    _stats["hits"] += 1
+                    return hit[0]
+                _stats["misses"] += 1
+                seq = _seq
+            value = fn(*args, **kwargs)
+            entry_tags = tuple(t(arguments) if callable(t) else t.format_map(arguments) for t in tags)
+            with _lock:
+                if seq == _seq:  # no invalidation raced with the read
+                    cache.put(key, value, entry_tags)
+            return value
+        inner.uncached = fn
+        return inner
+    return wrap
+
+def clear_session():
+    """Drop the current session's entries (e.g. on logout)."""
+    cache = _session_cache()
+    if cache is not None:
+        with _lock:
+            cache.entries.clear()
+            cache.by_tag.clear()
+
+def stats():
+    with _lock:
+        out = dict(_stats)
+        out["sessions"] = len(_caches)
+        out["entries"] = sum(len(c.entries) for c in _caches)
+    lookups = out["hits"] + out["misses"]
+    out["hit_ratio"] = out["hits"] / lookups if lookups else 0.0
+    out.update(max_entries_per_session=CACHE_MAX_ENTRIES, ttl_s=CACHE_TTL)
+    return out
@@ -0,0 +1,186 @@
+# commission_worker.py
+"""
+Background commission distribution. Approvals enqueue one commission_jobs row per deposit in
+their own transaction (payment._approve_chunk); the workers here drain the queue in batches:
+- process_batch(size) -> jobs handled; failing jobs are retried with exponential backoff up to MAX_ATTEMPTS
+- drain(): process everything that is due, synchronously (scripts, maintenance)
+- start_workers(n) / stop_workers(): daemon threads, started once per process (main.py)
+- queue_stats(): depth per status, lag of the oldest unfinished job, worker counters
+Payment itself is payment.pay_commissions, idempotent on source_tx_id, so a job that is
+retried or reclaimed after a crash never pays twice.
+Run standalone: python -m commission_worker [--workers 4] [--batch 200] [--once]
+"""
+
+import argparse
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+import cache
+import db
+import payment
+from db import get_db, begin, for_update
+
+log = logging.getLogger(__name__)
+
+WORKERS = int(os.getenv("PYRAMID_COMMISSION_WORKERS", "1"))
+BATCH_SIZE = int(os.getenv("PYRAMID_COMMISSION_BATCH", "200"))
+POLL_S = float(os.getenv("PYRAMID_COMMISSION_POLL", "0.5"))  # idle sleep between empty polls
+MAX_ATTEMPTS = 5
+RETRY_BASE_S = 2.0  # backoff: RETRY_BASE_S * 2 ** (attempt - 1)
+LEASE_S = 300  # a 'running' job not finished within this is reclaimed (worker died)
+
+_stats = {"processed": 0, "retried": 0, "failed": 0, "batches": 0, "busy_s": 0.0}
+_stats_lock = threading.Lock()
+_workers = []
+_stop = threading.Event()
+
+def _ts(dt=None) -> str:
+    return (dt or datetime.utcnow()).isoformat()
+
+def _count(**kw):
+    with _stats_lock:
+        for k, v in kw.items():
+            _stats[k] += v
+
+_DUE = "(status = 'queued' AND available_at <= ?) OR (status = 'running' AND claimed_at < ?)"
+
+def _claim(con, size, worker):
+    """
+    Mark up to `size` due jobs running and return them (concurrent workers skip each other's rows on Postgres).
+    An idle queue is detected with a read-only probe first, so polling workers take no write lock.
+    """
+    now = datetime.utcnow()
+    due = (_ts(now), _ts(now - timedelta(seconds=LEASE_S)))
+    if con.execute(f"SELECT 1 FROM commission_jobs WHERE {_DUE} LIMIT 1", due).fetchone() is None:
+        con.rollback()  # end the read transaction the probe opened (Postgres drivers, SQLAlchemy)
+        return []
+    begin(con)
+    jobs = con.execute(
+        f"SELECT id, source_tx_id, member_id, amount, attempts FROM commission_jobs WHERE {_DUE} "
+        "ORDER BY id LIMIT ?" + for_update(skip_locked=True), (*due, size)).fetchall()
+    con.executemany("UPDATE commission_jobs SET status = 'running', attempts = attempts + 1, claimed_at = ?, claimed_by = ? WHERE id = ?",
+                    [(_ts(now), worker, j["id"]) for j in jobs])
+    con.commit()
+    return jobs
+
+def _pay(con, jobs):
+    begin(con)
+    _, credited = payment.pay_commissions(con, [(j["source_tx_id"], j["member_id"], j["amount"]) for j in jobs])
+    con.executemany("UPDATE commission_jobs SET status = 'done', finished_at = ?, last_error = NULL WHERE id = ?",
+                    [(_ts(), j["id"]) for j in jobs])
+    con.commit()
+    if credited:
+        cache.member_changed(*credited)  # sessions in this process; other processes rely on the cache TTL
+
+def _retry(con, job, error):
+    attempts = job["attempts"] + 1  # claimed row was bumped in the database
+    if attempts >= MAX_ATTEMPTS:
+        con.execute("UPDATE commission_jobs SET status = 'failed', last_error = ?, finished_at = ? WHERE id = ?",
+                    (str(error), _ts(), job["id"]))
+        _count(failed=1)
+    else:
+        later = datetime.utcnow() + timedelta(seconds=RETRY_BASE_S * 2 ** (attempts - 1))
+        con.execute("UPDATE commission_jobs SET status = 'queued', last_error = ?, available_at = ? WHERE id = ?",
+                    (str(error), _ts(later), job["id"]))
+        _count(retried=1)
+    con.commit()
+
+def process_batch(size=BATCH_SIZE, worker="main") -> int:
+    """Claim and pay one batch of due jobs; returns how many jobs were handled (0 = nothing due)."""
+    started = time.perf_counter()
+    with get_db() as con:
+        jobs = _claim(con, size, worker)
+        if not jobs:
+            return 0
+        try:
+            _pay(con, jobs)
+            done = len(jobs)
+        except Exception:
+            con.rollback()
+            # isolate the offending job(s): one transaction per job for this batch
+            done = 0
+            for job in jobs:
+                try:
+                    _pay(con, [job])
+                    done += 1
+                except Exception as e:
+                    con.rollback()
+                    _retry(con, job, e)
+    _count(processed=done, batches=1, busy_s=time.perf_counter() - started)
+    return len(jobs)
+
+def drain(size=BATCH_SIZE) -> int:
+    """Process due jobs until none are left; returns jobs handled."""
+    total = 0
+    while True:
+        n = process_batch(size)
+        if not n:
+            return total
+        total += n
+
+def _loop(name, size):
+    while not _stop.is_set():
+        try:
+            n = process_batch(size, worker=name)
+        except Exception:  # keep the worker alive; the lease lets another worker reclaim its jobs
+            log.exception("commission worker %s: batch failed", name)
+            n = 0
+        if not n:
+            _stop.wait(POLL_S)
+
+def start_workers(n=WORKERS, size=BATCH_SIZE):
+    """Start (once per process) `n` daemon threads draining the queue."""
+    global _workers
+    alive = [t for t in _workers if t.is_alive()]
+    if alive or n <= 0:
+        return alive
+    _stop.clear()
+    _workers = [threading.Thread(target=_loop, args=(f"{os.getpid()}-{i}", size), name=f"pyramid-commissions-{i}", daemon=True)
+                for i in range(n)]
+    for t in _workers:
+        t.start()
+    return _workers
+
+def stop_workers(timeout=5.0):
+    _stop.set()
+    for t in _workers:
+        t.join(timeout)
+
+def queue_stats() -> dict:
+    """Queue depth per unfinished status, lag (seconds) of the oldest unfinished job and this process's worker counters."""
+    with get_db() as con:
+        depth = {r["status"]: r["c"] for r in con.execute(
+            "SELECT status, COUNT(*) AS c FROM commission_jobs WHERE status IN ('queued', 'running', 'failed') GROUP BY status")}
+        oldest = con.execute("SELECT MIN(created_at) AS t FROM commission_jobs WHERE status IN ('queued', 'running')").fetchone()["t"]
+    lag = (datetime.utcnow() - datetime.fromisoformat(oldest)).total_seconds() if oldest else 0.0
+    with _stats_lock:
+        counters = dict(_stats)
+    counters["jobs_per_sec"] = counters["processed"] / counters["busy_s"] if counters["busy_s"] else 0.0
+    return {"queued": depth.get("queued", 0), "running": depth.get("running", 0), "failed": depth.get("failed", 0),
+            "lag_s": lag, "workers": sum(t.is_alive() for t in _workers), **counters}
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Drain the commission job queue")
+    ap.add_argument("--workers", type=int, default=WORKERS)
+    ap.add_argument("--batch", type=int, default=BATCH_SIZE)
+    ap.add_argument("--once", action="store_true", help="process what is due and exit")
+    ap.add_argument("--report-every", type=float, default=30, help="print queue stats every N seconds")
+    args = ap.parse_args(argv)
+    db.init_db()
+    if args.once:
+        print(f"processed {drain(args.batch)} commission jobs")
+        return 0
+    start_workers(max(args.workers, 1), args.batch)
+    try:
+        while True:
+            time.sleep(args.report_every)
+            print(queue_stats())
+    except KeyboardInterrupt:
+        stop_workers()
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -4,6 +4,8 @@
 """
 Helper to manage config UI and default settings.
 Wraps db.get_config / set_config with typed defaults.
+Reads are served from db's in-process config cache; set_* invalidates it everywhere
+through the generation counter stored next to the config rows.
 """
 
 from db import get_config, set_config  # CHANGED: removed relative import
@@ -11,6 +13,10 @@ from db import get_config, set_config  # CHANGED: removed relative import
 def get_commission_rates():
     return get_config("commission_rates", [0.10, 0.05, 0.02])
 
+def parse_rates(text):
+    """'0.1, 0.05, 0.02' -> [0.1, 0.05, 0.02]; raises ValueError on anything else."""
+    return [float(x.strip()) for x in text.split(",") if x.strip()]
+
 def set_commission_rates(rates):
     set_config("commission_rates", rates)
 
@@ -2,66 +2,748 @@
 """
 Database layer.
 - Default: SQLite local file pyramid_app.db
-- Optional: use DATABASE_URL (Postgres/MySQL) via SQLAlchemy if provided in st.secrets or env
+- Optional: use DATABASE_URL (Postgres, or sqlite:/// for the SQLAlchemy path) via SQLAlchemy if provided in st.secrets or env
 Provides:
-- get_conn() contextmanager returning sqlite3.Connection (or SQLAlchemy if extended)
-- init_db() to create schema
-- helpers for migrations/backups
+- get_db() contextmanager returning a pooled connection (sqlite3, or a DB-API wrapper on a SQLAlchemy engine)
+  with the same execute/executemany/commit/rollback API and name-addressable rows
+- dialect helpers so module SQL stays portable: begin(), for_update(), insert_id(), reserve_ids(), upsert_sql(),
+  stream() for large reads (server-side cursor on Postgres)
+- pool_stats() / close_pool() for the connection pool
+- query instrumentation: per-statement / per-caller counts and latency percentiles, slow-query log
+  with EXPLAIN plans, per-render query budget, Prometheus text dump (query_stats(), query_metrics_prometheus())
+- get_config / set_config with an in-process cache invalidated via a DB generation counter
+- init_db() to create schema, run versioned MIGRATIONS (schema_version table) and seed default config;
+  entry points call it explicitly, it does its work once per process and nothing happens at import
+- cold storage for settled transactions (archive.py): schema "archive" (an attached file on SQLite)
+  and the all_transactions view (hot + archived) for the few reads that need full history
+- rebuild_user_closure() to backfill the referral closure table
+- helpers for migrations/backups (online backups of the database and its archive file via the SQLite
+  backup API; see the restore notes above backup_to())
 """
 
 import os
+import re
+import sys
+import hashlib
 import sqlite3
+import threading
+import itertools
+from collections import defaultdict, deque
 from contextlib import contextmanager
+from functools import lru_cache
 from pathlib import Path
+import copy
 import json
+import gzip
+import logging
+import shutil
+import tempfile
+import time
 import streamlit as st
 from datetime import datetime
 
+log = logging.getLogger(__name__)
+
 BASE = Path(__file__).parent
 DEFAULT_DB = BASE / "pyramid_app.db"
 DB_PATH = Path(os.getenv("PYRAMID_DB", DEFAULT_DB))
 
+def _secret_database_url():
+    try:
+        return st.secrets.get("DATABASE_URL")
+    except Exception:  # no secrets.toml
+        return None
+
+DATABASE_URL = os.getenv("DATABASE_URL") or _secret_database_url()
+
 # Ensure folder exists
 DB_PATH.parent.mkdir(parents=True, exist_ok=True)
 
+# Connection pool tuning (env overridable)
+POOL_MAX_IDLE = int(os.getenv("PYRAMID_DB_POOL_SIZE", "8"))
+POOL_MAX_OVERFLOW = int(os.getenv("PYRAMID_DB_POOL_OVERFLOW", "16"))
+MMAP_SIZE = int(os.getenv("PYRAMID_DB_MMAP_SIZE", str(256 * 1024 * 1024)))
+CACHE_SIZE_KB = int(os.getenv("PYRAMID_DB_CACHE_KB", str(64 * 1024)))
+
+SUPPORTED_DIALECTS = ("sqlite", "postgresql")
+
+# Archived transactions live in schema "archive": a separate file attached to every SQLite
+# connection (<db stem>_archive.db unless PYRAMID_ARCHIVE_DB is set), a schema on Postgres.
+ARCHIVE_DB = os.getenv("PYRAMID_ARCHIVE_DB")
+TX_COLUMNS = ("id", "member_id", "type", "method", "amount", "status", "note", "source_tx_id", "created_at", "external_ref")
+
+def archive_path(db_path):
+    """Archive file used with the SQLite database at db_path."""
+    if ARCHIVE_DB:
+        return Path(ARCHIVE_DB)
+    p = Path(db_path)
+    return p.with_name(p.stem + "_archive" + p.suffix)
+
+def _all_transactions_sql():
+    """Hot rows plus archived rows; a row present in both (interrupted archive batch) is read from the hot table."""
+    cols = ", ".join(TX_COLUMNS)
+    return (f"SELECT {cols} FROM transactions UNION ALL SELECT {cols} FROM archive.transactions a "
+            "WHERE NOT EXISTS (SELECT 1 FROM transactions h WHERE h.id = a.id)")
+
+def _attach_archive(conn, db_path):
+    """ATTACH the archive file to a sqlite3 connection and define its all_transactions view."""
+    memory = not db_path or str(db_path) == ":memory:"
+    conn.execute("ATTACH DATABASE ? AS archive", (":memory:" if memory else str(archive_path(db_path)),))
+    if not memory:
+        conn.execute("PRAGMA archive.journal_mode=WAL")
+    conn.execute(f"CREATE TEMP VIEW IF NOT EXISTS all_transactions AS {_all_transactions_sql()}")
+
+class _Backend:
+    """
+    Common connection handling: a thread keeps the same connection for nested get_db()
+    blocks; on release of the outermost block any open transaction is rolled back (same
+    semantics as the old connect/close per call) and the connection goes back to the pool.
+    Subclasses implement _take/_give_back and set `dialect`.
+    """
+    dialect = None
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._stats = {"created": 0, "reused": 0, "checkouts": 0, "closed": 0, "in_use": 0, "peak_in_use": 0}
+
+    @contextmanager
+    def connection(self):
+        local = self._local
+        conn = getattr(local, "conn", None)
+        if conn is not None:
+            # nested get_db() in the same thread shares the outer connection
+            local.depth += 1
+            try:
+                yield conn
+            finally:
+                local.depth -= 1
+            return
+        conn = self._take()
+        local.conn, local.depth = conn, 1
+        with self._lock:
+            self._stats["checkouts"] += 1
+            self._stats["in_use"] += 1
+            self._stats["peak_in_use"] = max(self._stats["peak_in_use"], self._stats["in_use"])
+        try:
+            yield conn
+        finally:
+            local.conn, local.depth = None, 0
+            with self._lock:
+                self._stats["in_use"] -= 1
+            self._give_back(conn)
+
+    def stats(self):
+        with self._lock:
+            out = dict(self._stats)
+        out["backend"] = type(self).__name__
+        out["dialect"] = self.dialect
+        return out
+
+class _PooledConnection(sqlite3.Connection):
+    """sqlite3.Connection that remembers which file it was opened against."""
+    db_path = None
+
+class SQLiteBackend(_Backend):
+    """
+    Process-wide pool of sqlite3 connections on DB_PATH.
+    Pragmas (WAL, synchronous, mmap, cache) are applied once per connection.
+    """
+    dialect = "sqlite"
+
+    def __init__(self, max_idle=POOL_MAX_IDLE):
+        super().__init__()
+        self.max_idle = max_idle
+        self._idle = []
+
+    def _connect(self, path):
+        conn = sqlite3.connect(str(path), timeout=30, detect_types=sqlite3.PARSE_DECLTYPES,
+                               check_same_thread=False, factory=_PooledConnection)
+        conn.row_factory = sqlite3.Row
+        conn.db_path = str(path)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA mmap_size={MMAP_SIZE}")
+        conn.execute(f"PRAGMA cache_size=-{CACHE_SIZE_KB}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        _attach_archive(conn, path)
+        return conn
+
+    def _take(self):
+        path = str(DB_PATH)
+        with self._lock:
+            while self._idle:
+                conn = self._idle.pop()
+                if conn.db_path == path:
+                    self._stats["reused"] += 1
+                    return conn
+                conn.close()  # DB_PATH changed since this connection was opened
+                self._stats["closed"] += 1
+            self._stats["created"] += 1
+        return self._connect(path)
+
+    def _give_back(self, conn):
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        except sqlite3.Error:
+            conn.close()
+            with self._lock:
+                self._stats["closed"] += 1
+            return
+        with self._lock:
+            if len(self._idle) < self.max_idle and conn.db_path == str(DB_PATH):
+                self._idle.append(conn)
+                return
+            self._stats["closed"] += 1
+        conn.close()
+
+    def stats(self):
+        out = super().stats()
+        with self._lock:
+            out["idle"] = len(self._idle)
+        out["max_idle"] = self.max_idle
+        return out
+
+    def close_all(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+            self._stats["closed"] += len(idle)
+        for conn in idle:
+            conn.close()
+
+class Row:
+    """Name- and index-addressable row (the sqlite3.Row interface) for non-sqlite3 drivers."""
+    __slots__ = ("_index", "_values")
+
+    def __init__(self, index, values):
+        self._index, self._values = index, values
+
+    def __getitem__(self, key):
+        return self._values[key if isinstance(key, int) else self._index[key]]
+
+    def keys(self):
+        return list(self._index)
+
+    def __iter__(self):
+        return iter(self._values)
+
+    def __len__(self):
+        return len(self._values)
+
+    def __repr__(self):
+        return f"Row({dict(zip(self._index, self._values))!r})"
+
+class _Cursor:
+    def __init__(self, cur):
+        self._cur = cur
+        self._index = {d[0]: i for i, d in enumerate(cur.description)} if cur.description else {}
+
+    description = property(lambda self: self._cur.description)
+    rowcount = property(lambda self: self._cur.rowcount)
+    lastrowid = property(lambda self: self._cur.lastrowid)
+
+    def _wrap(self, r):
+        return Row(self._index, tuple(r)) if r is not None else None
+
+    def fetchone(self):
+        return self._wrap(self._cur.fetchone())
+
+    def fetchmany(self, size):
+        return [self._wrap(r) for r in self._cur.fetchmany(size)]
+
+    def fetchall(self):
+        return [self._wrap(r) for r in self._cur.fetchall()]
+
+    def close(self):
+        self._cur.close()
+
+    def __iter__(self):
+        return iter(self.fetchall())
+
+class _SAConnection:
+    """
+    sqlite3.Connection-like facade over a pooled DB-API connection from a SQLAlchemy engine:
+    '?' placeholders are rewritten to the driver's paramstyle and rows come back as Row.
+    """
+    def __init__(self, raw, paramstyle, dialect):
+        self.raw, self.dialect = raw, dialect
+        self._format = paramstyle in ("format", "pyformat")
+        if paramstyle not in ("qmark", "format", "pyformat"):
+            raise RuntimeError(f"Unsupported DB-API paramstyle: {paramstyle}")
+        self.in_transaction = False
+
+    def _sql(self, sql):
+        return sql.replace("%", "%%").replace("?", "%s") if self._format else sql
+
+    def execute(self, sql, params=()):
+        cur = self.raw.cursor()
+        if params:
+            cur.execute(self._sql(sql), tuple(params))
+        else:
+            cur.execute(sql)
+        self.in_transaction = True
+        return _Cursor(cur)
+
+    def executemany(self, sql, seq):
+        seq = [tuple(p) for p in seq]
+        cur = self.raw.cursor()
+        if seq:
+            cur.executemany(self._sql(sql), seq)
+            self.in_transaction = True
+        return _Cursor(cur)
+
+    def executescript(self, script):
+        for stmt in _split_sql(script):
+            self.execute(stmt)
+
+    def commit(self):
+        self.raw.commit()
+        self.in_transaction = False
+
+    def rollback(self):
+        self.raw.rollback()
+        self.in_transaction = False
+
+class SQLAlchemyBackend(_Backend):
+    """Pooled SQLAlchemy engine (QueuePool) for DATABASE_URL; modules talk plain SQL through _SAConnection."""
+
+    def __init__(self, url):
+        super().__init__()
+        from sqlalchemy import create_engine  # optional dependency, only needed with DATABASE_URL
+        kwargs = {"pool_pre_ping": True}
+        if not url.startswith("sqlite"):
+            kwargs.update(pool_size=POOL_MAX_IDLE, max_overflow=POOL_MAX_OVERFLOW)
+        self.engine = create_engine(url, **kwargs)
+        self.dialect = self.engine.dialect.name
+        if self.dialect not in SUPPORTED_DIALECTS:
+            raise RuntimeError(f"DATABASE_URL dialect {self.dialect!r} not supported (use one of {SUPPORTED_DIALECTS})")
+        if self.dialect == "sqlite":
+            from sqlalchemy import event
+            event.listen(self.engine, "connect", lambda dbapi_conn, _: _attach_archive(dbapi_conn, self.engine.url.database))
+
+    def _take(self):
+        return _SAConnection(self.engine.raw_connection(), self.engine.dialect.paramstyle, self.dialect)
+
+    def _give_back(self, conn):
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+        finally:
+            conn.raw.close()  # returns the DB-API connection to the engine pool
+
+    def stats(self):
+        out = super().stats()
+        out["pool"] = self.engine.pool.status()
+        return out
+
+    def close_all(self):
+        self.engine.dispose()
+
+def _split_sql(script):
+    """Split a schema script into statements (no ';' inside literals in our DDL)."""
+    script = re.sub(r"--[^\n]*", "", script)
+    return [s.strip() for s in script.split(";") if s.strip()]
+
+backend = SQLAlchemyBackend(DATABASE_URL) if DATABASE_URL else SQLiteBackend()
+
+# Query instrumentation: connections handed out by get_db() are wrapped so every statement is
+# counted and timed per normalized SQL text and per calling function ("module.function").
+# Latency percentiles cover execute(); time spent fetching rows is added to the cumulative total.
+QUERY_STATS = os.getenv("PYRAMID_QUERY_STATS", "1") != "0"
+SLOW_QUERY_MS = float(os.getenv("PYRAMID_SLOW_QUERY_MS", "100"))
+QUERY_BUDGET = int(os.getenv("PYRAMID_QUERY_BUDGET", "60"))  # statements per page render before it is flagged
+LATENCY_SAMPLES = 512  # most recent samples kept per statement for percentiles
+
+_qlock = threading.Lock()
+_queries = {}  # normalized sql -> stats
+_callers = {}  # "module.function" -> {"count", "total_s"}
+_renders = {}  # page -> render counters
+_slow_log = deque(maxlen=100)
+_render_local = threading.local()
+_PASSTHROUGH = {"insert_id", "execute", "executemany", "executescript", "__enter__", "__exit__", "get_db", "connection"}
+
+@lru_cache(maxsize=2048)
+def _normalize(sql):
+    """Collapse whitespace and IN (?,?,...) lists so one call site maps to one statement."""
+    return re.sub(r"\bIN \(\?(?:\s*,\s*\?)+\)", "IN (?, ...)", " ".join(sql.split()), flags=re.IGNORECASE)
+
+def _caller():
+    f = sys._getframe(2)
+    while f.f_back is not None and f.f_code.co_name in _PASSTHROUGH and f.f_globals.get("__name__") in (__name__, "contextlib"):
+        f = f.f_back
+    return f"{f.f_globals.get('__name__', '?')}.{getattr(f.f_code, 'co_qualname', f.f_code.co_name)}"
+
+def _pct(samples, p):
+    return samples[min(len(samples) - 1, int(p * len(samples)))] if samples else 0.0
+
+def _explain(conn, sql, params):
+    """Query plan for a slow statement, on the same connection (a savepoint keeps Postgres transactions intact)."""
+    words = sql.split(None, 1)
+    if not words or words[0].upper() not in ("SELECT", "WITH", "INSERT", "UPDATE", "DELETE"):
+        return None
+    try:
+        if backend.dialect == "sqlite":
+            return "\n".join(str(r[3]) for r in conn.execute("EXPLAIN QUERY PLAN " + sql, params or ()).fetchall())
+        conn.execute("SAVEPOINT pyramid_explain")
+        try:
+            rows = conn.execute("EXPLAIN " + sql, params or ()).fetchall()
+        finally:
+            conn.execute("ROLLBACK TO SAVEPOINT pyramid_explain")
+        return "\n".join(str(r[0]) for r in rows)
+    except Exception as e:
+        return f"EXPLAIN failed: {e}"
+
+def _record(conn, sql, params, elapsed, rows=0, error=False):
+    key = _normalize(sql)
+    caller = _caller()
+    slow = elapsed * 1000 >= SLOW_QUERY_MS
+    with _qlock:
+        e = _queries.get(key)
+        if e is None:
+            e = _queries[key] = {"count": 0, "total_s": 0.0, "rows": 0, "errors": 0, "slow": 0, "plan": None,
+                                 "samples": deque(maxlen=LATENCY_SAMPLES), "callers": defaultdict(int)}
+        e["count"] += 1
+        e["total_s"] += elapsed
+        e["rows"] += rows
+        e["errors"] += error
+        e["slow"] += slow
+        e["samples"].append(elapsed)
+        e["callers"][caller] += 1
+        c = _callers.setdefault(caller, {"count": 0, "total_s": 0.0})
+        c["count"] += 1
+        c["total_s"] += elapsed
+        need_plan = slow and not error and e["plan"] is None
+    scope = getattr(_render_local, "scope", None)
+    if scope is not None:
+        scope["queries"] += 1
+        scope["db_s"] += elapsed
+    if slow and not error:
+        plan = _explain(conn, sql, params) if need_plan else e["plan"]
+        e["plan"] = plan
+        _slow_log.append({"at": datetime.utcnow().isoformat(timespec="seconds"), "ms": round(elapsed * 1000, 1),
+                          "caller": caller, "sql": key, "plan": plan})
+        log.warning("slow query: %.1f ms in %s: %s%s", elapsed * 1000, caller, key[:200], f"\n{plan}" if need_plan and plan else "")
+    return e
+
+class _TracedCursor:
+    """Cursor proxy that adds fetch time and returned rows to its statement's stats."""
+    __slots__ = ("_cur", "_entry")
+
+    def __init__(self, cur, entry):
+        self._cur, self._entry = cur, entry
+
+    def __getattr__(self, name):
+        return getattr(self._cur, name)
+
+    def _fetched(self, started, n):
+        with _qlock:
+            self._entry["total_s"] += time.perf_counter() - started
+            self._entry["rows"] += n
+
+    def fetchone(self):
+        started = time.perf_counter()
+        r = self._cur.fetchone()
+        self._fetched(started, r is not None)
+        return r
+
+    def fetchmany(self, *args):
+        started = time.perf_counter()
+        rows = self._cur.fetchmany(*args)
+        self._fetched(started, len(rows))
+        return rows
+
+    def fetchall(self):
+        started = time.perf_counter()
+        rows = self._cur.fetchall()
+        self._fetched(started, len(rows))
+        return rows
+
+    def __iter__(self):
+        started, n = time.perf_counter(), 0
+        try:
+            for r in self._cur:
+                n += 1
+                yield r
+        finally:
+            self._fetched(started, n)
+
+class _TracedConnection:
+    """Connection proxy recording every statement (see query_stats); everything else passes through."""
+    __slots__ = ("_conn",)
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def execute(self, sql, params=()):
+        started = time.perf_counter()
+        try:
+            cur = self._conn.execute(sql, params)
+        except Exception:
+            _record(self._conn, sql, params, time.perf_counter() - started, error=True)
+            raise
+        return _TracedCursor(cur, _record(self._conn, sql, params, time.perf_counter() - started))
+
+    def executemany(self, sql, seq):
+        seq = seq if isinstance(seq, (list, tuple)) else list(seq)
+        started = time.perf_counter()
+        try:
+            cur = self._conn.executemany(sql, seq)
+        except Exception:
+            _record(self._conn, sql, None, time.perf_counter() - started, error=True)
+            raise
+        # rows = parameter sets written; the plan is explained with the first set
+        _record(self._conn, sql, seq[0] if seq else None, time.perf_counter() - started, rows=len(seq))
+        return cur
+
+    def executescript(self, script):
+        started = time.perf_counter()
+        self._conn.executescript(script)
+        _record(self._conn, "-- executescript", None, time.perf_counter() - started)
+
 @contextmanager
 def get_db():
-    """Context manager returning sqlite3 connection with row_factory dict-like access."""
-    conn = sqlite3.connect(str(DB_PATH), timeout=30, detect_types=sqlite3.PARSE_DECLTYPES)
-    conn.row_factory = sqlite3.Row
+    """Context manager returning a pooled connection with row_factory dict-like access."""
+    with backend.connection() as conn:
+        yield _TracedConnection(conn) if QUERY_STATS else conn
+
+def start_render():
+    """Start counting this thread's statements for one page render (closed by finish_render)."""
+    _render_local.scope = {"queries": 0, "db_s": 0.0, "started": time.perf_counter()}
+
+def finish_render(page, budget=QUERY_BUDGET):
+    """Record the render's statement count under `page`; flags renders over `budget`. Returns the scope or None."""
+    scope = getattr(_render_local, "scope", None)
+    _render_local.scope = None
+    if scope is None:
+        return None
+    scope.update(page=page, budget=budget, wall_s=time.perf_counter() - scope.pop("started"),
+                 over_budget=scope["queries"] > budget)
+    with _qlock:
+        r = _renders.setdefault(page, {"renders": 0, "queries": 0, "max_queries": 0, "over_budget": 0, "db_s": 0.0, "wall_s": 0.0})
+        r["renders"] += 1
+        r["queries"] += scope["queries"]
+        r["max_queries"] = max(r["max_queries"], scope["queries"])
+        r["over_budget"] += scope["over_budget"]
+        r["db_s"] += scope["db_s"]
+        r["wall_s"] += scope["wall_s"]
+    if scope["over_budget"]:
+        log.warning("query budget exceeded: %s ran %d statements in one render (budget %d)", page, scope["queries"], budget)
+    return scope
+
+def query_stats(order="total_s", limit=None):
+    """Per-statement stats, heaviest first: count, total/mean/p50/p95/p99 ms, rows, slow count, callers, plan."""
+    with _qlock:
+        items = [(k, dict(e, samples=sorted(e["samples"]), callers=dict(e["callers"]))) for k, e in _queries.items()]
+    out = []
+    for sql, e in items:
+        lat = e["samples"]
+        out.append({"sql": sql, "count": e["count"], "total_ms": e["total_s"] * 1000, "mean_ms": e["total_s"] / e["count"] * 1000,
+                    "p50_ms": _pct(lat, 0.50) * 1000, "p95_ms": _pct(lat, 0.95) * 1000, "p99_ms": _pct(lat, 0.99) * 1000,
+                    "rows": e["rows"], "errors": e["errors"], "slow": e["slow"],
+                    "top_caller": max(e["callers"], key=e["callers"].get), "callers": e["callers"], "plan": e["plan"]})
+    key = {"total_s": "total_ms", "count": "count", "p95": "p95_ms", "rows": "rows"}.get(order, order)
+    out.sort(key=lambda r: r[key], reverse=True)
+    return out[:limit] if limit else out
+
+def caller_stats():
+    """[{caller, count, total_ms}] heaviest first."""
+    with _qlock:
+        rows = [{"caller": k, "count": v["count"], "total_ms": v["total_s"] * 1000} for k, v in _callers.items()]
+    return sorted(rows, key=lambda r: r["total_ms"], reverse=True)
+
+def render_stats():
+    """{page: {renders, queries, avg_queries, max_queries, over_budget, db_s, wall_s}}."""
+    with _qlock:
+        out = {p: dict(r) for p, r in _renders.items()}
+    for r in out.values():
+        r["avg_queries"] = r["queries"] / r["renders"]
+    return out
+
+def slow_queries():
+    """Most recent slow statements (newest last) with their EXPLAIN output."""
+    return list(_slow_log)
+
+def reset_query_stats():
+    with _qlock:
+        _queries.clear()
+        _callers.clear()
+        _renders.clear()
+        _slow_log.clear()
+
+def _label(v):
+    return str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", " ")
+
+def query_metrics_prometheus():
+    """Query/render metrics in the Prometheus text exposition format."""
+    lines = []
+    def metric(name, kind, help_, samples):
+        lines.append(f"# HELP {name} {help_}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in samples:
+            lab = ",".join(f'{k}="{_label(v)}"' for k, v in labels.items())
+            lines.append(f"{name}{{{lab}}} {value}")
+    stmts = query_stats()
+    sid = {q["sql"]: hashlib.sha1(q["sql"].encode()).hexdigest()[:12] for q in stmts}
+    metric("pyramid_db_statement_info", "gauge", "Normalized SQL text per statement id",
+           [({"statement": sid[q["sql"]], "sql": q["sql"][:300]}, 1) for q in stmts])
+    metric("pyramid_db_queries_total", "counter", "Statements executed",
+           [({"statement": sid[q["sql"]], "caller": c}, n) for q in stmts for c, n in q["callers"].items()])
+    metric("pyramid_db_query_seconds_total", "counter", "Time spent executing and fetching",
+           [({"statement": sid[q["sql"]]}, round(q["total_ms"] / 1000, 6)) for q in stmts])
+    metric("pyramid_db_query_rows_total", "counter", "Rows returned (parameter sets for executemany)",
+           [({"statement": sid[q["sql"]]}, q["rows"]) for q in stmts])
+    metric("pyramid_db_slow_queries_total", "counter", f"Statements slower than {SLOW_QUERY_MS:g} ms",
+           [({"statement": sid[q["sql"]]}, q["slow"]) for q in stmts if q["slow"]])
+    metric("pyramid_db_query_latency_seconds", "summary", "Execute latency over recent samples",
+           [({"statement": sid[q["sql"]], "quantile": qt}, round(q[f"p{int(qt * 100)}_ms"] / 1000, 6))
+            for q in stmts for qt in (0.5, 0.95, 0.99)])
+    metric("pyramid_db_caller_queries_total", "counter", "Statements executed per calling function",
+           [({"caller": c["caller"]}, c["count"]) for c in caller_stats()])
+    renders = render_stats()
+    metric("pyramid_render_total", "counter", "Page renders", [({"page": p}, r["renders"]) for p, r in renders.items()])
+    metric("pyramid_render_queries_total", "counter", "Statements issued by page renders",
+           [({"page": p}, r["queries"]) for p, r in renders.items()])
+    metric("pyramid_render_over_budget_total", "counter", f"Renders over the query budget ({QUERY_BUDGET})",
+           [({"page": p}, r["over_budget"]) for p, r in renders.items()])
+    pool = pool_stats()
+    metric("pyramid_db_pool", "gauge", "Connection pool counters",
+           [({"stat": k}, v) for k, v in pool.items() if isinstance(v, (int, float))])
+    return "\n".join(lines) + "\n"
+
+def pool_stats():
+    """Counters for the connection pool (created/reused/checkouts/in_use/idle...)."""
+    return backend.stats()
+
+def close_pool():
+    """Close all idle pooled connections (e.g. before replacing the DB file)."""
+    backend.close_all()
+
+def dialect():
+    """'sqlite' or 'postgresql'."""
+    return backend.dialect
+
+def begin(con):
+    """
+    Start an explicit write transaction. SQLite takes the write lock up front (BEGIN IMMEDIATE);
+    Postgres drivers open the transaction implicitly and lock rows via for_update().
+    """
+    if backend.dialect == "sqlite":
+        con.execute("BEGIN IMMEDIATE")
+
+def for_update(skip_locked=False):
+    """
+    Row-locking suffix for SELECTs inside a write transaction ('' on SQLite, whose lock is per database).
+    skip_locked=True lets concurrent queue consumers pass over rows another transaction already holds.
+    """
+    if backend.dialect != "postgresql":
+        return ""
+    return " FOR UPDATE SKIP LOCKED" if skip_locked else " FOR UPDATE"
+
+def insert_id(con, sql, params=()):
+    """Run an INSERT into a table with an `id` primary key and return the new id."""
+    if backend.dialect == "postgresql":
+        return con.execute(sql + " RETURNING id", params).fetchone()["id"]
+    return con.execute(sql, params).lastrowid
+
+def reserve_ids(con, table, n):
+    """
+    n fresh ids for `table` (id {pk} column) inside the caller's write transaction, for batch
+    inserts with explicit ids (executemany cannot hand back generated ids).
+    """
+    if backend.dialect == "postgresql":
+        return [r["id"] for r in con.execute(
+            f"SELECT nextval(pg_get_serial_sequence('{table}', 'id')) AS id FROM generate_series(1, ?)", (n,)).fetchall()]
+    # SQLite: BEGIN IMMEDIATE holds the write lock; stay above AUTOINCREMENT's high-water mark
+    top = con.execute(f"SELECT MAX(x) AS top FROM (SELECT MAX(id) AS x FROM {table} "
+                      "UNION ALL SELECT seq FROM sqlite_sequence WHERE name = ?) AS t", (table,)).fetchone()["top"] or 0
+    return list(range(top + 1, top + n + 1))
+
+_stream_ids = itertools.count(1)
+
+def stream(con, sql, params=(), chunk_size=1000):
+    """
+    Run a large SELECT and yield its column names, then row tuples fetched `chunk_size` at a time.
+    SQLite cursors step through the result natively. On Postgres a named (server-side) cursor keeps
+    the result on the server; psycopg2's default cursor would load all of it into client memory.
+    `con` stays busy until the generator is exhausted or closed.
+    """
+    raw = getattr(con, "_conn", con)  # below the query-stats proxy
+    if backend.dialect == "postgresql":
+        started = time.perf_counter()
+        cur = raw.raw.cursor(name=f"pyramid_stream_{next(_stream_ids)}")
+        cur.itersize = chunk_size
+        if params:
+            cur.execute(raw._sql(sql), tuple(params))
+        else:
+            cur.execute(sql)
+        raw.in_transaction = True  # the cursor lives inside a transaction; get_db's release rolls it back
+        rows = cur.fetchmany(chunk_size)  # a named cursor has no description before the first fetch
+        if QUERY_STATS:
+            _record(raw, sql, params, time.perf_counter() - started)
+    else:
+        cur = con.execute(sql, tuple(params))
+        rows = cur.fetchmany(chunk_size)
     try:
-        yield conn
+        yield [d[0] for d in cur.description]
+        while rows:
+            for r in rows:
+                yield tuple(r)
+            rows = cur.fetchmany(chunk_size)
     finally:
-        conn.close()
+        cur.close()
+
+def upsert_sql(table, keys, cols, add=()):
+    """
+    INSERT ... ON CONFLICT(keys) DO UPDATE statement (SQLite >= 3.24 and Postgres) with '?' placeholders
+    for `keys + cols`; columns in `add` are accumulated (existing + new), the rest replaced.
+    """
+    allcols = list(keys) + list(cols)
+    sets = ", ".join(f"{c} = {table}.{c} + excluded.{c}" if c in add else f"{c} = excluded.{c}" for c in cols)
+    return (f"INSERT INTO {table} ({', '.join(allcols)}) VALUES ({', '.join('?' * len(allcols))}) "
+            f"ON CONFLICT({', '.join(keys)}) DO UPDATE SET {sets}")
+
+_DDL = {
+    "sqlite": {"pk": "INTEGER PRIMARY KEY AUTOINCREMENT", "money": "INTEGER", "now": "(datetime('now'))",
+               "without_rowid": " WITHOUT ROWID", "pragmas": "PRAGMA foreign_keys = ON;",
+               "id": "INTEGER PRIMARY KEY", "archive_schema": "", "ix": "archive.", "on": ""},
+    "postgresql": {"pk": "BIGSERIAL PRIMARY KEY", "money": "BIGINT",
+                   "now": "(to_char(now() AT TIME ZONE 'utc', 'YYYY-MM-DD HH24:MI:SS'))",
+                   "without_rowid": "", "pragmas": "",
+                   "id": "BIGINT PRIMARY KEY", "archive_schema": "CREATE SCHEMA IF NOT EXISTS archive;", "ix": "", "on": "archive."},
+}
 
-def init_db():
-    """Initialize DB schema if not exists."""
-    schema = r"""
-    PRAGMA foreign_keys = ON;
+SCHEMA = r"""
+    {pragmas}
 
     CREATE TABLE IF NOT EXISTS users (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        id {pk},
         username TEXT UNIQUE NOT NULL,
         email TEXT,
         password_hash TEXT NOT NULL,
         salt TEXT NOT NULL,
-        balance REAL DEFAULT 0,
+        iterations INTEGER, -- PBKDF2 cost used for password_hash (NULL = legacy 200000)
+        balance {money} DEFAULT 0, -- minor units (poisha), see money.py; cached projection of the ledger (ledger.compact)
         parent_id INTEGER,
         level INTEGER DEFAULT 0,
         role TEXT DEFAULT 'user', -- user|admin|staff
-        created_at TEXT DEFAULT (datetime('now'))
+        created_at TEXT DEFAULT {now}
     );
 
     CREATE TABLE IF NOT EXISTS transactions (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        id {pk},
         member_id INTEGER NOT NULL,
         type TEXT NOT NULL, -- deposit, withdrawal, commission, adjustment
         method TEXT, -- nagad, bkash, rocket, admin, system
-        amount REAL NOT NULL,
+        amount {money} NOT NULL, -- minor units (poisha)
         status TEXT DEFAULT 'pending', -- pending, approved, rejected
         note TEXT,
         source_tx_id INTEGER, -- for commission idempotency relation
-        created_at TEXT DEFAULT (datetime('now')),
+        created_at TEXT DEFAULT {now},
+        external_ref TEXT, -- client / provider idempotency key (ingest.py), unique when set
         FOREIGN KEY(member_id) REFERENCES users(id) ON DELETE CASCADE
     );
 
@@ -70,36 +752,451 @@ def init_db():
         value TEXT
     );
 
+    -- closure of the referral tree: one row per (ancestor, descendant) pair, incl. depth 0 self rows
+    CREATE TABLE IF NOT EXISTS user_closure (
+        ancestor_id INTEGER NOT NULL,
+        descendant_id INTEGER NOT NULL,
+        depth INTEGER NOT NULL,
+        PRIMARY KEY (ancestor_id, depth, descendant_id)
+    ){without_rowid};
+
+    -- analytics rollups, maintained by stats.py alongside every transaction write
+    CREATE TABLE IF NOT EXISTS tx_rollup_totals (
+        type TEXT NOT NULL,
+        status TEXT NOT NULL,
+        tx_count INTEGER NOT NULL DEFAULT 0,
+        amount {money} NOT NULL DEFAULT 0,
+        PRIMARY KEY (type, status)
+    );
+
+    CREATE TABLE IF NOT EXISTS tx_rollup_daily (
+        day TEXT NOT NULL, -- YYYY-MM-DD of created_at
+        type TEXT NOT NULL,
+        status TEXT NOT NULL,
+        tx_count INTEGER NOT NULL DEFAULT 0,
+        amount {money} NOT NULL DEFAULT 0,
+        PRIMARY KEY (day, type, status)
+    ){without_rowid};
+
+    -- append-only double-entry ledger: one posting per approval, legs sum to 0 (see ledger.py)
+    CREATE TABLE IF NOT EXISTS ledger (
+        id {pk},
+        tx_id INTEGER, -- approved transaction the posting belongs to (NULL = opening balances)
+        account TEXT NOT NULL, -- member | cash | commission | opening
+        user_id INTEGER, -- set on member legs only
+        amount {money} NOT NULL, -- signed minor units
+        created_at TEXT NOT NULL
+    );
+
+    -- per-user balance as of ledger entry entry_id; balance = latest checkpoint + later entries
+    CREATE TABLE IF NOT EXISTS balance_checkpoints (
+        user_id INTEGER NOT NULL,
+        entry_id INTEGER NOT NULL,
+        balance {money} NOT NULL,
+        as_of TEXT NOT NULL, -- created_at of entry entry_id
+        PRIMARY KEY (user_id, entry_id)
+    ){without_rowid};
+
+    -- durable commission queue: one job per approved deposit, drained by commission_worker.py
+    CREATE TABLE IF NOT EXISTS commission_jobs (
+        id {pk},
+        source_tx_id INTEGER NOT NULL UNIQUE, -- the approved deposit (idempotency key)
+        member_id INTEGER NOT NULL,
+        amount {money} NOT NULL,
+        status TEXT NOT NULL DEFAULT 'queued', -- queued | running | done | failed
+        attempts INTEGER NOT NULL DEFAULT 0,
+        last_error TEXT,
+        created_at TEXT NOT NULL,
+        available_at TEXT NOT NULL, -- not picked up before this (retry backoff)
+        claimed_at TEXT,
+        claimed_by TEXT,
+        finished_at TEXT
+    );
+
+    CREATE TABLE IF NOT EXISTS schema_version (
+        version INTEGER NOT NULL
+    );
+
+    CREATE TABLE IF NOT EXISTS counters (
+        name TEXT PRIMARY KEY,
+        value INTEGER NOT NULL DEFAULT 0
+    );
+
     CREATE INDEX IF NOT EXISTS idx_users_parent ON users(parent_id);
-    CREATE INDEX IF NOT EXISTS idx_tx_member ON transactions(member_id);
-    CREATE INDEX IF NOT EXISTS idx_tx_status ON transactions(status);
+    CREATE INDEX IF NOT EXISTS idx_closure_descendant ON user_closure(descendant_id, depth, ancestor_id);
+    -- listing indexes: (filter, created_at) serves keyset paging in created_at, id order (rowid is implicit)
+    DROP INDEX IF EXISTS idx_tx_member;
+    DROP INDEX IF EXISTS idx_tx_status;
+    CREATE INDEX IF NOT EXISTS idx_tx_member_created ON transactions(member_id, created_at);
+    CREATE INDEX IF NOT EXISTS idx_tx_status_created ON transactions(status, created_at);
+    CREATE INDEX IF NOT EXISTS idx_tx_type_created ON transactions(type, created_at);
+    CREATE INDEX IF NOT EXISTS idx_tx_created ON transactions(created_at);
+    CREATE INDEX IF NOT EXISTS idx_tx_source ON transactions(source_tx_id);
+    CREATE INDEX IF NOT EXISTS idx_ledger_user ON ledger(user_id, id, amount);
+    CREATE INDEX IF NOT EXISTS idx_ledger_tx ON ledger(tx_id);
+    CREATE INDEX IF NOT EXISTS idx_jobs_status ON commission_jobs(status, available_at);
+"""
+
+# cold storage (archive.py); on SQLite "archive" is the attached archive file, so index names carry the schema
+ARCHIVE_SCHEMA = r"""
+    {archive_schema}
+    CREATE TABLE IF NOT EXISTS archive.transactions (
+        id {id}, -- id it had in the hot table
+        member_id INTEGER NOT NULL,
+        type TEXT NOT NULL,
+        method TEXT,
+        amount {money} NOT NULL,
+        status TEXT,
+        note TEXT,
+        source_tx_id INTEGER,
+        created_at TEXT,
+        external_ref TEXT,
+        archived_at TEXT NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS {ix}idx_archive_member_created ON {on}transactions(member_id, created_at);
+    CREATE INDEX IF NOT EXISTS {ix}idx_archive_created ON {on}transactions(created_at);
+    CREATE INDEX IF NOT EXISTS {ix}idx_archive_source ON {on}transactions(source_tx_id);
+    CREATE INDEX IF NOT EXISTS {ix}idx_archive_external_ref ON {on}transactions(external_ref);
+"""
+
+# indexes on columns that MIGRATIONS add: SCHEMA runs before the migrations on existing databases,
+# so these are created once the columns are guaranteed to exist
+MIGRATED_INDEXES = r"""
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_tx_external_ref ON transactions(external_ref) WHERE external_ref IS NOT NULL;
+"""
+
+def _ensure_archive(con):
+    con.executescript(ARCHIVE_SCHEMA.format(**_DDL[backend.dialect]))
+    if backend.dialect == "postgresql":
+        con.execute(f"CREATE OR REPLACE VIEW all_transactions AS {_all_transactions_sql()}")
+    else:  # per connection (_attach_archive); recreated here after _create_schema dropped it
+        con.execute(f"CREATE TEMP VIEW IF NOT EXISTS all_transactions AS {_all_transactions_sql()}")
+
+def _migrate_money_to_minor_units(con):
+    """users.balance / transactions.amount: REAL major units -> INTEGER minor units (x100, rounded)."""
+    for table, column, decl in (("users", "balance", "DEFAULT 0"), ("transactions", "amount", "NOT NULL DEFAULT 0")):
+        if backend.dialect == "postgresql":
+            con.execute(f"ALTER TABLE {table} ALTER COLUMN {column} TYPE BIGINT USING ROUND({column} * 100)::BIGINT")
+        else:
+            # SQLite can't change a column type in place: add, copy, drop, rename (SQLite >= 3.35)
+            con.execute(f"ALTER TABLE {table} ADD COLUMN {column}_minor INTEGER {decl}")
+            con.execute(f"UPDATE {table} SET {column}_minor = CAST(ROUND(COALESCE({column}, 0) * 100) AS INTEGER)")
+            con.execute(f"ALTER TABLE {table} DROP COLUMN {column}")
+            con.execute(f"ALTER TABLE {table} RENAME COLUMN {column}_minor TO {column}")
+    # rollups are derived: drop them (recreated with integer columns and backfilled by init_db)
+    con.execute("DROP TABLE IF EXISTS tx_rollup_daily")
+    con.execute("DROP TABLE IF EXISTS tx_rollup_totals")
+    con.execute("DELETE FROM counters WHERE name = 'users'")
+
+def _migrate_seed_ledger(con):
+    """Open the ledger with every user's current balance and checkpoint it."""
+    from ledger import open_balances
+    open_balances(con)
+
+def _migrate_external_ref(con):
+    """transactions.external_ref (idempotency key for ingest.py), in the hot table and an existing archive."""
+    _ensure_column(con, "transactions", "external_ref", "TEXT")
+    if _table_exists(con, "transactions", schema="archive"):
+        _ensure_column(con, "transactions", "external_ref", "TEXT", schema="archive")
+
+# (version, description, fn(con)) applied in order to databases below that version;
+# brand-new databases are created at the latest version directly from SCHEMA.
+MIGRATIONS = [
+    (1, "money columns to integer minor units", _migrate_money_to_minor_units),
+    (2, "seed ledger from users.balance", _migrate_seed_ledger),
+    (3, "transactions.external_ref idempotency keys", _migrate_external_ref),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+def _table_exists(con, table, schema=None):
+    if backend.dialect == "sqlite":
+        master = f"{schema}.sqlite_master" if schema else "sqlite_master"
+        return con.execute(f"SELECT 1 FROM {master} WHERE type = 'table' AND name = ?", (table,)).fetchone() is not None
+    return con.execute("SELECT 1 FROM information_schema.tables WHERE table_schema = COALESCE(?, current_schema()) AND table_name = ?",
+                       (schema, table)).fetchone() is not None
+
+def schema_version(con):
+    r = con.execute("SELECT MAX(version) AS v FROM schema_version").fetchone()
+    return r["v"] or 0
+
+def _set_schema_version(con, version):
+    con.execute("DELETE FROM schema_version")
+    con.execute("INSERT INTO schema_version (version) VALUES (?)", (version,))
+
+_init_lock = threading.Lock()
+_initialized = False
+
+def _schema_current(con):
+    """True when the database is at SCHEMA_VERSION with its archive table, i.e. there is no DDL to run."""
+    return (_table_exists(con, "schema_version") and schema_version(con) == SCHEMA_VERSION
+            and _table_exists(con, "transactions", schema="archive"))
+
+def init_db(force=False):
     """
-    with get_db() as con:
-        con.executescript(schema)
+    Initialize DB schema if not exists, apply pending migrations and seed default config.
+    Runs once per process (later calls return immediately unless force=True); a database that is
+    already at SCHEMA_VERSION only costs a few catalog reads, no executescript or commit.
+    """
+    global _initialized
+    with _init_lock:
+        if _initialized and not force:
+            return
+        with get_db() as con:
+            fresh = False if _schema_current(con) else _create_schema(con)
+            # backfill the closure table for databases created before it existed
+            if (con.execute("SELECT 1 FROM user_closure LIMIT 1").fetchone() is None
+                    and con.execute("SELECT 1 FROM users LIMIT 1").fetchone() is not None):
+                rebuild_user_closure(con)
+            # same for analytics rollups
+            if con.execute("SELECT 1 FROM counters WHERE name = 'users'").fetchone() is None:
+                from stats import rebuild_rollups
+                rebuild_rollups(con)
+        if fresh and get_config("commission_rates") is None:
+            # default commission_rates setting (levels 1..3)
+            set_config("commission_rates", [0.10, 0.05, 0.02])
+            set_config("max_levels", 10)
+            set_config("branching", 3)
+        _initialized = True
+
+def _create_schema(con):
+    """CREATE IF NOT EXISTS the whole schema and run pending MIGRATIONS; returns True for a new database."""
+    schema = SCHEMA.format(**_DDL[backend.dialect])
+    # the view names every transactions column and (SQLite) the attached archive table: a migration
+    # that rebuilds transactions would fail on it, so it is recreated by _ensure_archive at the end
+    con.execute("DROP VIEW IF EXISTS temp.all_transactions" if backend.dialect == "sqlite" else "DROP VIEW IF EXISTS all_transactions")
+    fresh = not _table_exists(con, "users")
+    versioned = _table_exists(con, "schema_version")
+    con.executescript(schema)
+    _ensure_column(con, "users", "iterations", "INTEGER")
+    if fresh:
+        _set_schema_version(con, SCHEMA_VERSION)
+    elif not versioned:
+        _set_schema_version(con, 0)  # database predates schema_version
+    con.commit()
+    current = schema_version(con)
+    for version, _, migrate in MIGRATIONS:
+        if version > current:
+            begin(con)
+            migrate(con)
+            _set_schema_version(con, version)
+            con.commit()
+    if current < SCHEMA_VERSION:
+        con.executescript(schema)  # recreate anything a migration dropped
         con.commit()
+    con.executescript(MIGRATED_INDEXES)
+    _ensure_archive(con)
+    con.commit()
+    return fresh
 
-def get_config(key, default=None):
+def table_columns(con, table, schema=None):
+    """Column names of `table` (in `schema`, default the main one) on either dialect."""
+    if backend.dialect == "sqlite":
+        return {r["name"] for r in con.execute(f"PRAGMA {schema + '.' if schema else ''}table_info({table})")}
+    return {r["column_name"] for r in con.execute(
+        "SELECT column_name FROM information_schema.columns WHERE table_schema = COALESCE(?, current_schema()) AND table_name = ?",
+        (schema, table))}
+
+def _ensure_column(con, table, column, decl, schema=None):
+    """Add a column introduced after the table was first created."""
+    if column not in table_columns(con, table, schema):
+        con.execute(f"ALTER TABLE {schema + '.' if schema else ''}{table} ADD COLUMN {column} {decl}")
+
+def rebuild_user_closure(con=None):
+    """
+    Recompute user_closure from users.parent_id in one statement/transaction.
+    Returns number of closure rows written.
+    """
+    if con is None:
+        with get_db() as con:
+            return rebuild_user_closure(con)
+    con.execute("DELETE FROM user_closure")
+    con.execute("""
+        WITH RECURSIVE c(ancestor_id, descendant_id, depth) AS (
+            SELECT id, id, 0 FROM users
+            UNION ALL
+            SELECT c.ancestor_id, u.id, c.depth + 1 FROM c JOIN users u ON u.parent_id = c.descendant_id
+            WHERE c.depth < (SELECT COUNT(*) FROM users)  -- guards against parent_id cycles
+        )
+        INSERT INTO user_closure (ancestor_id, descendant_id, depth)
+        SELECT ancestor_id, descendant_id, depth FROM c
+    """)
+    con.commit()
+    return con.execute("SELECT COUNT(*) AS c FROM user_closure").fetchone()["c"]
+
+# Config cache: values are cached per key; the DB-stored generation counter (bumped by every
+# set_config) is re-read at most every CONFIG_CHECK_INTERVAL seconds to pick up other
+# sessions'/processes' changes with one query instead of one per key.
+CONFIG_CHECK_INTERVAL = float(os.getenv("PYRAMID_CONFIG_TTL", "2.0"))
+CONFIG_GENERATION_KEY = "__generation__"
+_MISSING = object()
+_config_lock = threading.Lock()
+_config_cache = {}
+_config_state = {"generation": None, "checked_at": 0.0}
+_config_stats = {"hits": 0, "misses": 0, "checks": 0, "invalidations": 0}
+
+def _check_config_generation():
+    now = time.monotonic()
+    if now - _config_state["checked_at"] < CONFIG_CHECK_INTERVAL:
+        return
     with get_db() as con:
-        cur = con.execute("SELECT value FROM config WHERE key = ?", (key,))
-        row = cur.fetchone()
-        if row:
-            return json.loads(row["value"])
+        row = con.execute("SELECT value FROM config WHERE key = ?", (CONFIG_GENERATION_KEY,)).fetchone()
+    generation = int(row["value"]) if row else 0
+    with _config_lock:
+        _config_state["checked_at"] = now
+        _config_stats["checks"] += 1
+        if generation != _config_state["generation"]:
+            if _config_state["generation"] is not None:
+                _config_stats["invalidations"] += 1
+            _config_cache.clear()
+            _config_state["generation"] = generation
+
+def get_config(key, default=None):
+    _check_config_generation()
+    with _config_lock:
+        value = _config_cache.get(key, _MISSING)
+        if value is not _MISSING:
+            _config_stats["hits"] += 1
+    if value is _MISSING:
+        with get_db() as con:
+            cur = con.execute("SELECT value FROM config WHERE key = ?", (key,))
+            row = cur.fetchone()
+        value = json.loads(row["value"]) if row else None
+        with _config_lock:
+            _config_stats["misses"] += 1
+            _config_cache[key] = value
+    if value is None:
         return default
+    return copy.deepcopy(value)  # callers may mutate lists/dicts
 
 def set_config(key, value):
     with get_db() as con:
-        con.execute("REPLACE INTO config (key, value) VALUES (?, ?)", (key, json.dumps(value)))
+        con.execute(upsert_sql("config", ["key"], ["value"]), (key, json.dumps(value)))
+        con.execute("INSERT INTO config (key, value) VALUES (?, '1') "
+                    "ON CONFLICT(key) DO UPDATE SET value = CAST(CAST(config.value AS INTEGER) + 1 AS TEXT)", (CONFIG_GENERATION_KEY,))
         con.commit()
+    invalidate_config_cache()
+
+def invalidate_config_cache():
+    """Drop cached config values; the next get_config re-reads the generation and the key."""
+    with _config_lock:
+        _config_cache.clear()
+        _config_state["checked_at"] = 0.0
+
+def config_cache_stats():
+    """Hit/miss/check/invalidation counters plus current generation and cached key count."""
+    with _config_lock:
+        out = dict(_config_stats)
+        out["generation"] = _config_state["generation"]
+        out["cached_keys"] = len(_config_cache)
+    return out
+
+# Online backup: copy BACKUP_PAGES pages per step and sleep in between so writers keep the lock
+BACKUP_PAGES = int(os.getenv("PYRAMID_BACKUP_PAGES", "1024"))
+BACKUP_SLEEP = float(os.getenv("PYRAMID_BACKUP_SLEEP", "0.01"))
+
+# Restoring a backup (stop the app, workers and ingest service first):
+#   gunzip the snapshots if compressed, copy <stem>-<time>.db to PYRAMID_DB and the archive
+#   snapshot <stem>_archive-<time>.db (same <time>) to archive_path(PYRAMID_DB), and delete any
+#   stale -wal / -shm files next to both. The database is copied before the archive, so a row
+#   archived in between is in both snapshots (all_transactions reads the hot copy), never in neither.
+
+def backup_to(dest_path, pages=BACKUP_PAGES, sleep=BACKUP_SLEEP, compress=False, archive=False):
+    """
+    Consistent snapshot of the live database (including WAL content) written to dest_path,
+    gzip'd if compress=True; archive=True copies the archive file instead (see archive_path).
+    Uses sqlite3.Connection.backup on dedicated connections,
+    so it never holds a pooled connection or the write lock for long.
+    SQLite only: with DATABASE_URL pointing at Postgres use pg_dump / base backups (the archive
+    schema is part of the same database there).
+    """
+    if backend.dialect != "sqlite" or DATABASE_URL:
+        raise NotImplementedError("Online file backups are only available for the default SQLite backend")
+    source = archive_path(DB_PATH) if archive else DB_PATH
+    if not source.exists():
+        raise ValueError(f"Nothing to back up: {source} does not exist")
+    dest_path = Path(dest_path)
+    fd, raw_path = tempfile.mkstemp(suffix=".db", dir=dest_path.parent)
+    os.close(fd)
+    try:
+        src = sqlite3.connect(str(source), timeout=30)
+        dst = sqlite3.connect(raw_path)
+        try:
+            src.backup(dst, pages=pages, sleep=sleep)
+        finally:
+            dst.close()
+            src.close()
+        if compress:
+            with open(raw_path, "rb") as fin, gzip.open(dest_path, "wb") as fout:
+                shutil.copyfileobj(fin, fout, 1024 * 1024)
+        else:
+            os.replace(raw_path, dest_path)
+    finally:
+        if os.path.exists(raw_path):
+            os.remove(raw_path)
+    return dest_path
+
+def backup_file(compress=False, **kwargs):
+    """
+    Snapshot into a temp file and return it reopened read-only (a regular binary file at position 0,
+    which st.download_button accepts). The temp copy is unlinked right away on POSIX, so it
+    disappears when the returned file is closed. Pass archive=True for the archive file.
+    """
+    tmpdir = tempfile.mkdtemp(prefix="pyramid_backup_")
+    try:
+        path = backup_to(Path(tmpdir) / "snapshot", compress=compress, **kwargs)
+        return open(path, "rb")
+    finally:
+        shutil.rmtree(tmpdir, ignore_errors=True)
+
+def backup_files(compress=False, **kwargs):
+    """
+    backup_file() for the database and then the archive file (when there is one):
+    list of (file name to save it as, open file).
+    """
+    suffix = ".gz" if compress else ""
+    out = [(DB_PATH.name + suffix, backup_file(compress=compress, **kwargs))]
+    if archive_path(DB_PATH).exists():
+        out.append((archive_path(DB_PATH).name + suffix, backup_file(compress=compress, archive=True, **kwargs)))
+    return out
 
 def backup_db_bytes():
-    """Return bytes of DB file for download/backup."""
-    with open(DB_PATH, "rb") as f:
+    """Return bytes of a consistent DB snapshot (prefer backup_file() to avoid holding it in memory)."""
+    with backup_file() as f:
         return f.read()
 
-# initialize at import if missing
-if not DB_PATH.exists():
-    init_db()
-    # default commission_rates setting (levels 1..3)
-    set_config("commission_rates", [0.10, 0.05, 0.02])
-    set_config("max_levels", 10)
-    set_config("branching", 3)
+def snapshot(directory, keep=7, compress=True):
+    """
+    Write timestamped snapshots of the database and then the archive file into `directory`,
+    keeping the newest `keep` of each. Returns the paths written (database first).
+    """
+    directory = Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    suffix = ".db.gz" if compress else ".db"
+    stamp = f"{datetime.utcnow():%Y%m%d-%H%M%S}"
+    paths = []
+    for source, archive in ((DB_PATH, False), (archive_path(DB_PATH), True)):
+        if archive and not source.exists():
+            continue
+        paths.append(backup_to(directory / f"{source.stem}-{stamp}{suffix}", compress=compress, archive=archive))
+        olds = sorted(directory.glob(f"{source.stem}-*.db*"))
+        for old in olds[:-keep] if keep > 0 else []:
+            old.unlink()
+    return paths
+
+_backup_thread = None
+
+def start_backup_scheduler(directory, every_s, keep=7, compress=True):
+    """Start (once per process) a daemon thread taking a rotating snapshot every `every_s` seconds."""
+    global _backup_thread
+    if _backup_thread is not None and _backup_thread.is_alive():
+        return _backup_thread
+    def loop():
+        while True:
+            time.sleep(every_s)
+            try:
+                snapshot(directory, keep=keep, compress=compress)
+            except Exception as e:  # keep the scheduler alive; next run retries
+                log.warning("backup snapshot failed: %s", e)
+    _backup_thread = threading.Thread(target=loop, name="pyramid-backup", daemon=True)
+    _backup_thread.start()
+    return _backup_thread
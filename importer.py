@@ -0,0 +1,264 @@
+# importer.py
+"""
+Bulk member import (partner network onboarding) from CSV or JSONL.
+- import_members(path, rejects_path, batch, workers) -> summary dict
+Columns / keys: username, email, referrer (username, in the file or already registered) and either
+password (plaintext) or password_hash + salt [+ iterations] (PBKDF2-SHA256 hex as written by auth.py).
+Rows are ordered so referrers come before their referees, `level` is computed in memory, plaintext
+passwords are hashed on a thread pool (hashlib releases the GIL, so hashes run on all cores) while
+the previous batch is written, and users are inserted with executemany, `batch` rows per transaction.
+idx_users_parent and user_closure are rebuilt once at the end (the index also when the load fails).
+Bad rows never abort the load: they are written with an `error` field to the rejects file
+(<input>.rejects.<ext> by default), with plaintext passwords blanked; fill them in again to re-import.
+Run: python manage.py import-members members.csv [--rejects bad.csv] [--batch 5000]
+"""
+
+import csv
+import json
+import os
+import re
+import time
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+import auth
+import cache
+import db
+from db import get_db, begin
+from referral import IN_CHUNK
+from stats import bump_counter
+
+IMPORT_BATCH = int(os.getenv("PYRAMID_IMPORT_BATCH", "5000"))  # users per transaction
+
+_HEX = re.compile(r"^[0-9a-fA-F]+$")
+_INSERT = ("INSERT INTO users (id, username, email, password_hash, salt, iterations, parent_id, level) "
+           "VALUES (?, ?, ?, ?, ?, ?, ?, ?)")
+
+def _is_jsonl(path):
+    return path.lower().endswith((".jsonl", ".ndjson", ".json"))
+
+def read_rows(path):
+    """Yield (line, row dict) from a CSV file with a header row or a JSONL file; unparsable lines carry an 'error'."""
+    with open(path, newline="", encoding="utf-8") as f:
+        if not _is_jsonl(path):
+            reader = csv.DictReader(f)
+            for row in reader:
+                yield reader.line_num, row
+            return
+        for n, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as e:
+                row = {"error": f"invalid JSON: {e}", "raw": line.rstrip("\n")}
+            yield n, row if isinstance(row, dict) else {"error": "not a JSON object", "raw": line.rstrip("\n")}
+
+def _clean(row):
+    """Normalized member dict from one input row; raises ValueError describing what is wrong with it."""
+    if row.get("error"):
+        raise ValueError(row["error"])
+    get = lambda k: (str(row[k]).strip() if row.get(k) not in (None, "") else None)
+    username = get("username")
+    if not username:
+        raise ValueError("missing username")
+    m = {"username": username, "email": get("email"), "referrer": get("referrer") or get("referrer_username"),
+         "password": str(row["password"]) if row.get("password") not in (None, "") else None,  # not stripped
+         "password_hash": get("password_hash"), "salt": get("salt"), "iterations": auth.ITERATIONS}
+    if m["referrer"] == username:
+        raise ValueError("member cannot refer themselves")
+    if m["password_hash"]:
+        if not m["salt"]:
+            raise ValueError("password_hash given without salt")
+        if not _HEX.match(m["password_hash"]):
+            raise ValueError("password_hash must be hex (PBKDF2-SHA256)")
+        try:
+            m["iterations"] = int(get("iterations") or auth.LEGACY_ITERATIONS)
+        except ValueError:
+            raise ValueError("iterations must be an integer")
+        m["password"] = None
+    elif not m["password"]:
+        raise ValueError("missing password or password_hash")
+    return m
+
+def _existing(con, usernames):
+    """{username: (id, level)} for the given usernames that are already registered."""
+    names = list(usernames)
+    out = {}
+    for i in range(0, len(names), IN_CHUNK):
+        chunk = names[i:i + IN_CHUNK]
+        for r in con.execute(f"SELECT id, username, level FROM users WHERE username IN ({','.join('?' * len(chunk))})",
+                             tuple(chunk)).fetchall():
+            out[r["username"]] = (r["id"], r["level"] or 0)
+    return out
+
+def plan(rows, con):
+    """
+    Validate and order the input: returns (members in referrer-before-referee order, rejects, registered)
+    where rejects = [(line, row, error)] and registered = {username: (id, level)} for referrers already in the database.
+    """
+    members, rejects, seen = {}, [], set()
+    for line, row in rows:
+        try:
+            m = _clean(row)
+            if m["username"] in seen:
+                raise ValueError("duplicate username in file")
+        except ValueError as e:
+            rejects.append((line, row, str(e)))
+            continue
+        seen.add(m["username"])
+        m["line"], m["row"] = line, row
+        members[m["username"]] = m
+    registered = _existing(con, seen | {m["referrer"] for m in members.values() if m["referrer"]})
+    for name in [n for n in members if n in registered]:
+        m = members.pop(name)
+        rejects.append((m["line"], m["row"], "username already exists"))
+
+    # breadth-first from members whose referrer is empty or already registered: parents always precede children
+    children = defaultdict(list)
+    queue = deque()
+    for m in members.values():
+        ref = m["referrer"]
+        if ref is None:
+            m["level"] = 0
+            queue.append(m)
+        elif ref in registered:
+            m["level"] = registered[ref][1] + 1
+            queue.append(m)
+        else:
+            children[ref].append(m)
+    ordered = []
+    while queue:
+        m = queue.popleft()
+        ordered.append(m)
+        for c in children.pop(m["username"], ()):
+            c["level"] = m["level"] + 1
+            queue.append(c)
+    rejected = {r[1].get("username") for r in rejects}
+    for ref, kids in children.items():
+        if ref in members:
+            reason = f"referrer '{ref}' is part of a referral cycle or below one"
+        elif ref in rejected:
+            reason = f"referrer '{ref}' was rejected"
+        else:
+            reason = f"unknown referrer '{ref}'"
+        rejects.extend((c["line"], c["row"], reason) for c in kids)
+    return ordered, rejects, registered
+
+def _hash(m):
+    if m["password"] is None:
+        return m["password_hash"], m["salt"]
+    salt = auth._make_salt()
+    return auth._pbkdf2(m["password"], salt, m["iterations"]), salt
+
+def _insert(con, batch, ids_by_name):
+    """Insert one batch in its own transaction (caller handles failure)."""
+    begin(con)
+    ids = db.reserve_ids(con, "users", len(batch))  # explicit ids let referees point at referrers in the same batch
+    rows = []
+    for uid, (m, (ph, salt)) in zip(ids, batch):
+        ids_by_name[m["username"]] = uid
+        rows.append((uid, m["username"], m["email"], ph, salt, m["iterations"],
+                     ids_by_name.get(m["referrer"]), m["level"]))
+    con.executemany(_INSERT, rows)
+    bump_counter(con, "users", len(rows))
+    con.commit()
+
+def _redact(row):
+    """Rejected row as written to the rejects file: plaintext passwords are never written back out."""
+    row = dict(row)
+    if row.get("password") not in (None, ""):
+        row["password"] = ""
+    if "password" in str(row.get("raw", "")):  # unparsable JSONL line: `line` points at the original
+        row["raw"] = ""
+    return row
+
+def _write_rejects(path, source, rejects):
+    if _is_jsonl(source):
+        with open(path, "w", encoding="utf-8") as f:
+            for line, row, error in rejects:
+                f.write(json.dumps({**_redact(row), "line": line, "error": error}) + "\n")
+        return
+    fields = []
+    for _, row, _ in rejects:
+        fields.extend(k for k in row if k is not None and k not in fields)
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        w = csv.DictWriter(f, fieldnames=fields + ["line", "error"], extrasaction="ignore")
+        w.writeheader()
+        for line, row, error in rejects:
+            w.writerow({**_redact(row), "line": line, "error": error})
+
+def _load(con, pool, batches, ids_by_name, rejects):
+    """Insert the planned batches (hashing the next one meanwhile); returns how many users were imported."""
+    failed = set()
+    imported = 0
+    hashed = pool.map(_hash, batches[0]) if batches else None
+    for i, members in enumerate(batches):
+        current = list(zip(members, hashed))
+        if i + 1 < len(batches):
+            hashed = pool.map(_hash, batches[i + 1])  # hash the next batch while this one is written
+        todo = []
+        for m, h in current:
+            if m["referrer"] in failed:
+                failed.add(m["username"])
+                rejects.append((m["line"], m["row"], f"referrer '{m['referrer']}' was rejected"))
+            else:
+                todo.append((m, h))
+        if not todo:
+            continue
+        try:
+            _insert(con, todo, ids_by_name)
+            imported += len(todo)
+        except Exception:
+            con.rollback()
+            for m, _ in todo:
+                ids_by_name.pop(m["username"], None)
+            # e.g. a username registered through the app meanwhile: isolate it row by row
+            for m, h in todo:
+                if m["referrer"] in failed:
+                    failed.add(m["username"])
+                    rejects.append((m["line"], m["row"], f"referrer '{m['referrer']}' was rejected"))
+                    continue
+                try:
+                    _insert(con, [(m, h)], ids_by_name)
+                    imported += 1
+                except Exception as e:
+                    con.rollback()
+                    ids_by_name.pop(m["username"], None)
+                    failed.add(m["username"])
+                    rejects.append((m["line"], m["row"], str(e)))
+    return imported
+
+def import_members(path, rejects_path=None, batch=IMPORT_BATCH, workers=None):
+    """
+    Import members from `path` (CSV or JSONL). Returns {"read", "imported", "rejected", "rejects_path",
+    "closure_rows", "seconds", "rows_per_sec"}; rejects_path is None when every row was imported.
+    """
+    started = time.perf_counter()
+    with get_db() as con:
+        ordered, rejects, registered = plan(read_rows(path), con)
+    read = len(ordered) + len(rejects)
+    ids_by_name = {name: uid for name, (uid, _) in registered.items()}
+    batches = [ordered[i:i + batch] for i in range(0, len(ordered), batch)]
+    with ThreadPoolExecutor(max_workers=workers or auth.HASH_WORKERS, thread_name_prefix="import-hash") as pool, \
+            get_db() as con:
+        con.execute("DROP INDEX IF EXISTS idx_users_parent")  # rebuilt once below
+        con.commit()
+        try:
+            imported = _load(con, pool, batches, ids_by_name, rejects)
+        finally:
+            con.rollback()  # a batch interrupted by an error must not keep its transaction open
+            con.execute("CREATE INDEX IF NOT EXISTS idx_users_parent ON users(parent_id)")
+            con.commit()
+        closure = db.rebuild_user_closure(con) if imported else None
+    if imported:
+        cache.invalidate("kpi", "referrals:*")
+    if rejects:
+        root, ext = os.path.splitext(path)
+        rejects_path = rejects_path or f"{root}.rejects{ext or '.csv'}"
+        _write_rejects(rejects_path, path, sorted(rejects, key=lambda r: r[0]))
+    else:
+        rejects_path = None
+    elapsed = time.perf_counter() - started
+    return {"read": read, "imported": imported, "rejected": len(rejects), "rejects_path": rejects_path,
+            "closure_rows": closure, "seconds": round(elapsed, 2), "rows_per_sec": round(imported / elapsed, 1) if elapsed else None}
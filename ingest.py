@@ -0,0 +1,338 @@
+# ingest.py
+"""
+Headless ingestion API for payment-provider feeds (nagad/bkash/rocket statements) and other
+machine clients, outside the Streamlit rerun loop. Stdlib asyncio HTTP/1.1 (keep-alive), JSON:
+- POST /transactions          [{member_id | username, type, amount, method, note, external_ref}, ...]
+                              (or {"transactions": [...]}, or one object) -> {"results": [{"id", "status", "duplicate"} | {"error"}]}
+- GET  /transactions?ids=1,2&external_refs=a,b -> {"transactions": [...]} (hot and archived rows)
+- POST /transactions/approve  {"ids": [...], "approver": "..."} -> payment.approve_transactions summary
+- POST /transactions/reject   {"ids": [...], "reason": "..."} -> payment.reject_transactions summary
+- GET  /health -> writer queue depth and counters
+amount is integer minor units (poisha). external_ref is the idempotency key (provider txn id):
+resubmitting it returns the original transaction with duplicate=true. An Idempotency-Key header
+is used as external_ref when the body holds a single transaction without one.
+All writes go through one writer task that group-commits: whatever create requests queued up
+while the previous batch was committing (up to INGEST_GROUP_MAX items) become one
+payment.create_transactions call, i.e. one BEGIN/commit, on a dedicated writer thread.
+Reads run on a small thread pool (WAL readers do not block the writer).
+Requests need "Authorization: Bearer $PYRAMID_INGEST_TOKEN"; without a token the service only
+binds to loopback and refuses approve/reject (they move money), so a token is always required there.
+POST bodies must be sent as Content-Type: application/json; anything else (e.g. a cross-site
+text/plain form post) is refused with 415.
+Run: python -m ingest [--host 127.0.0.1] [--port 8502]
+"""
+
+import argparse
+import asyncio
+import hmac
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import parse_qs, urlsplit
+
+import db
+import payment
+
+log = logging.getLogger(__name__)
+
+INGEST_TOKEN = os.getenv("PYRAMID_INGEST_TOKEN")
+INGEST_GROUP_MAX = int(os.getenv("PYRAMID_INGEST_GROUP_MAX", "2000"))  # items per group commit
+INGEST_GROUP_WAIT_MS = float(os.getenv("PYRAMID_INGEST_GROUP_WAIT_MS", "0"))  # linger for more work before committing
+INGEST_MAX_BODY = int(os.getenv("PYRAMID_INGEST_MAX_BODY", str(8 * 1024 * 1024)))
+INGEST_MAX_ITEMS = int(os.getenv("PYRAMID_INGEST_MAX_ITEMS", "5000"))  # per request
+READ_WORKERS = int(os.getenv("PYRAMID_INGEST_READERS", "4"))
+
+_REASONS = {200: "OK", 400: "Bad Request", 401: "Unauthorized", 403: "Forbidden", 404: "Not Found", 405: "Method Not Allowed",
+            411: "Length Required", 413: "Payload Too Large", 415: "Unsupported Media Type", 500: "Internal Server Error",
+            503: "Service Unavailable"}
+_MONEY_ROUTES = ("/transactions/approve", "/transactions/reject")
+
+class HttpError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+class Writer:
+    """
+    Single writer: requests are (op, payload, future) on a queue; consecutive creates are merged into
+    one payment.create_transactions call, approve/reject run one request at a time between them.
+    """
+
+    def __init__(self, group_max=INGEST_GROUP_MAX, group_wait_ms=INGEST_GROUP_WAIT_MS):
+        self.queue = asyncio.Queue()
+        self.group_max = group_max
+        self.group_wait = group_wait_ms / 1000
+        self.thread = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ingest-writer")
+        self.held = None  # a non-create request that ended the previous group
+        self.stats = {"requests": 0, "items": 0, "created": 0, "duplicates": 0, "invalid": 0, "groups": 0,
+                      "largest_group": 0, "fallbacks": 0, "commit_s": 0.0}
+
+    async def submit(self, op, payload):
+        fut = asyncio.get_running_loop().create_future()
+        await self.queue.put((op, payload, fut))
+        return await fut
+
+    async def _next(self, deadline):
+        if self.held:
+            item, self.held = self.held, None
+            return item
+        if deadline is None:
+            return await self.queue.get()
+        try:
+            return self.queue.get_nowait()
+        except asyncio.QueueEmpty:
+            remaining = deadline - asyncio.get_running_loop().time()
+            if remaining <= 0:
+                return None
+            try:
+                return await asyncio.wait_for(self.queue.get(), remaining)
+            except asyncio.TimeoutError:
+                return None
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            op, payload, fut = await self._next(None)
+            if op != "create":
+                await self._call(fut, _OPS[op], payload)
+                continue
+            group = [(payload, fut)]
+            size = len(payload)
+            deadline = loop.time() + self.group_wait
+            while size < self.group_max:
+                item = await self._next(deadline)
+                if item is None:
+                    break
+                if item[0] != "create":
+                    self.held = item
+                    break
+                group.append(item[1:])
+                size += len(item[1])
+            started = time.perf_counter()
+            outcomes = await loop.run_in_executor(self.thread, self._create_group, [p for p, _ in group])
+            self.stats["commit_s"] += time.perf_counter() - started
+            self.stats["groups"] += 1
+            self.stats["largest_group"] = max(self.stats["largest_group"], size)
+            for (_, f), outcome in zip(group, outcomes):
+                if f.done():  # client went away
+                    continue
+                if isinstance(outcome, Exception):
+                    f.set_exception(outcome)
+                else:
+                    f.set_result({"results": outcome})
+
+    def _create_group(self, payloads):
+        """One create_transactions call for the whole group; on failure retry request by request to isolate it."""
+        try:
+            results = payment.create_transactions([it for p in payloads for it in p])
+        except Exception:
+            log.exception("group of %d requests failed; retrying one by one", len(payloads))
+            self.stats["fallbacks"] += 1
+            outcomes = []
+            for p in payloads:
+                try:
+                    outcomes.append(self._count(payment.create_transactions(p)))
+                except Exception as err:
+                    outcomes.append(err)
+            return outcomes
+        self._count(results)
+        outcomes, i = [], 0
+        for p in payloads:
+            outcomes.append(results[i:i + len(p)])
+            i += len(p)
+        return outcomes
+
+    def _count(self, results):
+        for r in results:
+            key = "invalid" if "error" in r else "duplicates" if r["duplicate"] else "created"
+            self.stats[key] += 1
+        return results
+
+    async def _call(self, fut, fn, payload):
+        try:
+            result = await asyncio.get_running_loop().run_in_executor(self.thread, fn, payload)
+        except Exception as e:
+            if not fut.done():
+                fut.set_exception(e)
+            return
+        if not fut.done():
+            fut.set_result(result)
+
+def _approve(payload):
+    r = payment.approve_transactions(payload["ids"], approver=payload.get("approver") or "ingest")
+    return {**r, "failed": {str(k): v for k, v in r["failed"].items()}}
+
+def _reject(payload):
+    r = payment.reject_transactions(payload["ids"], reason=payload.get("reason"))
+    return {**r, "failed": {str(k): v for k, v in r["failed"].items()}}
+
+_OPS = {"approve": _approve, "reject": _reject}
+
+def _ids(values):
+    if not isinstance(values, list) or not values or not all(isinstance(v, int) and not isinstance(v, bool) for v in values):
+        raise HttpError(400, "ids must be a non-empty list of integers")
+    if len(values) > INGEST_MAX_ITEMS:
+        raise HttpError(413, f"at most {INGEST_MAX_ITEMS} ids per request")
+    return values
+
+def _create_items(body, headers):
+    items = body.get("transactions") if isinstance(body, dict) and "transactions" in body else body
+    if isinstance(items, dict):
+        items = [items]
+    if not isinstance(items, list) or not items or not all(isinstance(it, dict) for it in items):
+        raise HttpError(400, "expected a transaction object or a non-empty list of them")
+    if len(items) > INGEST_MAX_ITEMS:
+        raise HttpError(413, f"at most {INGEST_MAX_ITEMS} transactions per request")
+    key = headers.get("idempotency-key")
+    if key and len(items) == 1 and not items[0].get("external_ref"):
+        items = [{**items[0], "external_ref": key}]
+    return items
+
+class Service:
+    def __init__(self, token=INGEST_TOKEN, writer=None):
+        self.token = token
+        self.writer = writer or Writer()
+        self.readers = ThreadPoolExecutor(max_workers=READ_WORKERS, thread_name_prefix="ingest-read")
+        self.started = time.time()
+
+    async def dispatch(self, method, target, headers, body):
+        if self.token and not hmac.compare_digest(headers.get("authorization", ""), f"Bearer {self.token}"):
+            raise HttpError(401, "missing or wrong bearer token")
+        url = urlsplit(target)
+        path = url.path.rstrip("/") or "/"
+        if path == "/health":
+            return self.health()
+        if path == "/transactions" and method == "GET":
+            q = parse_qs(url.query)
+            split = lambda k: [v for s in q.get(k, []) for v in s.split(",") if v]
+            try:
+                ids = [int(v) for v in split("ids")]
+            except ValueError:
+                raise HttpError(400, "ids must be integers")
+            refs = split("external_refs")
+            if not ids and not refs:
+                raise HttpError(400, "pass ids and/or external_refs")
+            rows = await asyncio.get_running_loop().run_in_executor(self.readers, payment.get_transactions, ids, refs)
+            return {"transactions": [dict(r) for r in rows]}
+        if method != "POST":
+            raise HttpError(405 if path.startswith("/transactions") else 404, f"{method} {path} not supported")
+        if path in _MONEY_ROUTES and not self.token:
+            raise HttpError(403, "approve/reject are disabled until PYRAMID_INGEST_TOKEN is set")
+        if headers.get("content-type", "").split(";")[0].strip().lower() != "application/json":
+            raise HttpError(415, "send the body as Content-Type: application/json")
+        try:
+            payload = json.loads(body or b"null")
+        except ValueError as e:
+            raise HttpError(400, f"invalid JSON: {e}")
+        if path == "/transactions":
+            items = _create_items(payload, headers)
+            self.writer.stats["requests"] += 1
+            self.writer.stats["items"] += len(items)
+            return await self.writer.submit("create", items)
+        if path in _MONEY_ROUTES:
+            if not isinstance(payload, dict):
+                raise HttpError(400, "expected an object with ids")
+            _ids(payload.get("ids"))
+            self.writer.stats["requests"] += 1
+            return await self.writer.submit(path.rsplit("/", 1)[1], payload)
+        raise HttpError(404, f"no route for {path}")
+
+    def health(self):
+        s = self.writer.stats
+        return {"queued": self.writer.queue.qsize(), "uptime_s": round(time.time() - self.started, 1), **s,
+                "commit_s": round(s["commit_s"], 3),
+                "items_per_group": round(s["items"] / s["groups"], 1) if s["groups"] else None}
+
+    async def handle(self, reader, writer):
+        """One client connection: requests are served in order until the client closes or sends Connection: close."""
+        try:
+            while True:
+                try:
+                    head = await reader.readuntil(b"\r\n\r\n")
+                except (asyncio.IncompleteReadError, ConnectionError):
+                    return
+                except asyncio.LimitOverrunError:
+                    await self._respond(writer, 413, {"error": "headers too large"}, close=True)
+                    return
+                lines = head.decode("latin-1").split("\r\n")
+                try:
+                    method, target, version = lines[0].split(" ", 2)
+                except ValueError:
+                    await self._respond(writer, 400, {"error": "malformed request line"}, close=True)
+                    return
+                headers = {}
+                for line in lines[1:]:
+                    if ":" in line:
+                        k, v = line.split(":", 1)
+                        headers[k.strip().lower()] = v.strip()
+                close = headers.get("connection", "").lower() == "close" or version == "HTTP/1.0"
+                if "chunked" in headers.get("transfer-encoding", "").lower():
+                    await self._respond(writer, 411, {"error": "send Content-Length, chunked bodies are not supported"}, close=True)
+                    return
+                length = headers.get("content-length") or "0"
+                if not length.isdigit():
+                    await self._respond(writer, 400, {"error": "invalid Content-Length"}, close=True)
+                    return
+                length = int(length)
+                if length > INGEST_MAX_BODY:
+                    await self._respond(writer, 413, {"error": f"body larger than {INGEST_MAX_BODY} bytes"}, close=True)
+                    return
+                body = await reader.readexactly(length) if length else b""
+                try:
+                    status, result = 200, await self.dispatch(method, target, headers, body)
+                except HttpError as e:
+                    status, result = e.status, {"error": str(e)}
+                except ValueError as e:  # payment-level validation
+                    status, result = 400, {"error": str(e)}
+                except Exception:
+                    log.exception("%s %s failed", method, target)
+                    status, result = 500, {"error": "internal error"}
+                await self._respond(writer, status, result, close=close)
+                if close:
+                    return
+        except (asyncio.IncompleteReadError, ConnectionError):
+            return
+        finally:
+            writer.close()
+
+    async def _respond(self, writer, status, result, close=False):
+        body = json.dumps(result, default=str).encode()
+        head = [f"HTTP/1.1 {status} {_REASONS.get(status, '')}", "Content-Type: application/json", f"Content-Length: {len(body)}"]
+        if close:
+            head.append("Connection: close")
+        writer.write(("\r\n".join(head) + "\r\n\r\n").encode() + body)
+        await writer.drain()
+
+async def serve(host="127.0.0.1", port=8502, token=INGEST_TOKEN, ready=None):
+    """Run the service until cancelled; ready (an asyncio.Event) is set once the socket listens."""
+    service = Service(token)
+    writer_task = asyncio.create_task(service.writer.run())
+    server = await asyncio.start_server(service.handle, host, port, limit=64 * 1024, backlog=1024)
+    log.info("listening on http://%s:%s (group commit up to %d items)", host, port, service.writer.group_max)
+    if ready is not None:
+        ready.set()
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        writer_task.cancel()
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Batch ingestion API for deposit/withdrawal requests")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=8502)
+    args = ap.parse_args(argv)
+    if not INGEST_TOKEN and args.host not in ("127.0.0.1", "localhost", "::1"):
+        raise SystemExit("set PYRAMID_INGEST_TOKEN before binding to a non-loopback address")
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    db.init_db()
+    try:
+        asyncio.run(serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,148 @@
+# ledger.py
+"""
+Append-only double-entry ledger. Balances are derived from it; users.balance is only a cached projection.
+- post_many(con, postings): append [(tx_id, legs)] where legs = [(account, user_id, amount), ...] sum to 0
+- deposit_legs / withdrawal_legs / commission_legs: the legs for each kind of approval
+- get_balances(con, user_ids) / get_balance(user_id): latest checkpoint + entries after it
+- get_balance_at(user_id, when): balance as of a date/datetime (or ISO string) from the nearest earlier checkpoint
+- compact(min_entries): roll new checkpoints for users with enough new entries and refresh users.balance
+- open_balances(con): opening postings for databases that predate the ledger
+Accounts: 'member' legs carry user_id; 'cash' is money entering/leaving the system, 'commission'
+the payout expense, 'opening' the counterpart of opening balances.
+Writers call post_many inside their own open transaction, so postings commit with the rows they describe.
+get_balance is session-cached under "user:<id>"; writers publish cache.member_changed after commit.
+"""
+
+import os
+from datetime import datetime, date
+from typing import Dict, List
+
+import cache
+from db import get_db, begin, dialect
+from money import require_minor
+from referral import IN_CHUNK
+
+CHECKPOINT_EVERY = int(os.getenv("PYRAMID_CHECKPOINT_EVERY", "50"))  # new entries per user before compact() checkpoints it
+
+_INSERT = "INSERT INTO ledger (tx_id, account, user_id, amount, created_at) VALUES (?, ?, ?, ?, ?)"
+
+BALANCES_SQL = """
+SELECT u.id AS user_id, COALESCE(c.balance, 0) + COALESCE(
+    (SELECT SUM(l.amount) FROM ledger l WHERE l.user_id = u.id AND l.id > COALESCE(c.entry_id, 0)), 0) AS balance
+FROM users u
+LEFT JOIN balance_checkpoints c ON c.user_id = u.id
+    AND c.entry_id = (SELECT MAX(m.entry_id) FROM balance_checkpoints m WHERE m.user_id = u.id)
+WHERE u.id IN ({marks})
+"""
+
+def deposit_legs(member_id, amount):
+    return [("member", member_id, amount), ("cash", None, -amount)]
+
+def withdrawal_legs(member_id, amount):
+    return [("member", member_id, -amount), ("cash", None, amount)]
+
+def commission_legs(parent_id, amount):
+    return [("member", parent_id, amount), ("commission", None, -amount)]
+
+def post_many(con, postings, created_at=None):
+    """Append postings [(tx_id, legs), ...] with one executemany; raises ValueError on an unbalanced posting."""
+    created_at = created_at or datetime.utcnow().isoformat()
+    rows = []
+    for tx_id, legs in postings:
+        if sum(amount for _, _, amount in legs) != 0:
+            raise ValueError(f"Unbalanced ledger posting for transaction {tx_id}")
+        rows.extend((tx_id, account, user_id, require_minor(amount), created_at)
+                    for account, user_id, amount in legs if amount)
+    con.executemany(_INSERT, rows)
+
+def post(con, tx_id, legs, created_at=None):
+    post_many(con, [(tx_id, legs)], created_at)
+
+def get_balances(con, user_ids) -> Dict[int, int]:
+    """{user_id: balance} in minor units for existing users (one query per IN_CHUNK ids)."""
+    ids = list(dict.fromkeys(user_ids))
+    out = {}
+    for i in range(0, len(ids), IN_CHUNK):
+        chunk = ids[i:i + IN_CHUNK]
+        for r in con.execute(BALANCES_SQL.format(marks=",".join("?" * len(chunk))), tuple(chunk)).fetchall():
+            out[r["user_id"]] = int(r["balance"])
+    return out
+
+@cache.cached("user:{user_id}")
+def get_balance(user_id) -> int:
+    with get_db() as con:
+        return get_balances(con, [user_id]).get(user_id, 0)
+
+def _as_of(when) -> str:
+    """
+    Inclusive upper bound comparable with ledger.created_at (isoformat); a date, or a 'YYYY-MM-DD'
+    string, means the end of that day. Other strings are parsed as ISO datetimes.
+    """
+    if isinstance(when, str):
+        when = date.fromisoformat(when) if len(when) == 10 else datetime.fromisoformat(when)
+    if isinstance(when, datetime):
+        return when.isoformat()
+    if isinstance(when, date):
+        return when.isoformat() + "T23:59:59.999999"
+    raise ValueError(f"expected a date, datetime or ISO string, got {when!r}")
+
+def get_balance_at(user_id, when) -> int:
+    """Balance as of `when` (date, datetime or ISO string): nearest checkpoint at or before it + later entries up to it."""
+    bound = _as_of(when)
+    with get_db() as con:
+        cp = con.execute("SELECT entry_id, balance FROM balance_checkpoints WHERE user_id = ? AND as_of <= ? "
+                         "ORDER BY entry_id DESC LIMIT 1", (user_id, bound)).fetchone()
+        entry_id, balance = (cp["entry_id"], cp["balance"]) if cp else (0, 0)
+        r = con.execute("SELECT COALESCE(SUM(amount), 0) AS d FROM ledger WHERE user_id = ? AND id > ? AND created_at <= ?",
+                        (user_id, entry_id, bound)).fetchone()
+        return int(balance) + int(r["d"])
+
+def _checkpoint(con, min_entries) -> int:
+    """Checkpoint every user with >= min_entries ledger entries after their latest checkpoint; returns users checkpointed."""
+    due = con.execute(
+        "SELECT l.user_id, MAX(l.id) AS entry_id FROM ledger l WHERE l.user_id IS NOT NULL "
+        "AND l.id > COALESCE((SELECT MAX(c.entry_id) FROM balance_checkpoints c WHERE c.user_id = l.user_id), 0) "
+        "GROUP BY l.user_id HAVING COUNT(*) >= ?", (min_entries,)).fetchall()
+    for i in range(0, len(due), IN_CHUNK):
+        chunk = due[i:i + IN_CHUNK]
+        ids = [r["user_id"] for r in chunk]
+        balances = get_balances(con, ids)
+        marks = ",".join("?" * len(chunk))
+        as_of = {r["id"]: r["created_at"] for r in con.execute(
+            f"SELECT id, created_at FROM ledger WHERE id IN ({marks})", tuple(r["entry_id"] for r in chunk)).fetchall()}
+        con.executemany("INSERT INTO balance_checkpoints (user_id, entry_id, balance, as_of) VALUES (?, ?, ?, ?)",
+                        [(r["user_id"], r["entry_id"], balances.get(r["user_id"], 0), as_of[r["entry_id"]]) for r in chunk])
+        con.executemany("UPDATE users SET balance = ? WHERE id = ?", [(balances.get(uid, 0), uid) for uid in ids])
+    return len(due)
+
+def compact(min_entries=CHECKPOINT_EVERY) -> int:
+    """
+    Roll checkpoints for users with at least `min_entries` new ledger entries and refresh their
+    cached users.balance. Safe to run while the app is up; min_entries=1 refreshes everyone.
+    """
+    with get_db() as con:
+        begin(con)
+        if dialect() == "postgresql":
+            # wait for in-flight postings so no lower id can commit behind the new checkpoints
+            con.execute("LOCK TABLE ledger IN SHARE MODE")
+        n = _checkpoint(con, min_entries)
+        con.commit()
+    if n:
+        cache.invalidate("user:*")  # cached user rows carry the refreshed users.balance
+    return n
+
+def open_balances(con):
+    """One opening posting carrying every user's current users.balance, then checkpoints (inside the caller's transaction)."""
+    now = datetime.utcnow().isoformat()
+    con.execute("INSERT INTO ledger (tx_id, account, user_id, amount, created_at) "
+                "SELECT NULL, 'member', id, balance, ? FROM users WHERE balance <> 0", (now,))
+    total = int(con.execute("SELECT COALESCE(SUM(balance), 0) AS t FROM users").fetchone()["t"])
+    if total:
+        con.execute(_INSERT, (None, "opening", None, -total, now))
+    _checkpoint(con, 1)
+
+def check_ledger() -> List[str]:
+    """Postings whose legs do not sum to zero (empty list = consistent)."""
+    with get_db() as con:
+        rows = con.execute("SELECT tx_id, SUM(amount) AS s FROM ledger GROUP BY tx_id HAVING SUM(amount) <> 0").fetchall()
+        return [f"posting for transaction {r['tx_id']} is off by {r['s']}" for r in rows]
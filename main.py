@@ -1,27 +1,43 @@
 # main.py  (Streamlit entrypoint)
 import streamlit as st
-import auth, db, payment, referral, ui, config
-from db import get_db
-import pandas as pd
-import io
+import auth, db, payment, referral, ui, config, ledger, commission_worker, cache
+from money import to_minor, format_money
+import os
 
 st.set_page_config(page_title="Pyramid App", layout="wide")
+db.start_render()  # count this run's statements against the per-render query budget (see finish_render below)
 
-# Ensure DB ready
+# Ensure DB ready (init_db does its work once per process; reruns return immediately)
 db.init_db()
+if os.getenv("PYRAMID_BACKUP_DIR") and os.getenv("PYRAMID_BACKUP_EVERY"):
+    db.start_backup_scheduler(os.getenv("PYRAMID_BACKUP_DIR"), float(os.getenv("PYRAMID_BACKUP_EVERY")),
+                              keep=int(os.getenv("PYRAMID_BACKUP_KEEP", "7")))
+# commissions are paid in the background (PYRAMID_COMMISSION_WORKERS=0 when running `python -m commission_worker` instead)
+commission_worker.start_workers()
 
 # Sidebar: Owner login + user auth
 is_owner = auth.owner_login_widget()
 
+def owner_display_name():
+    """Approver name recorded on approvals (falls back to 'owner' when secrets are not configured)."""
+    try:
+        return st.secrets.get("owner", {}).get("name", "owner")
+    except Exception:
+        return "owner"
+
+def client_ip():
+    """Best-effort client address for login throttling (st.context exists on newer Streamlit)."""
+    return getattr(getattr(st, "context", None), "ip_address", None)
+
 def sidebar_user_auth():
     st.sidebar.title("Account")
     if st.session_state.get("user_id"):
         uid = st.session_state["user_id"]
-        with get_db() as con:
-            u = con.execute("SELECT username, balance FROM users WHERE id = ?", (uid,)).fetchone()
-        st.sidebar.markdown(f"**{u['username']}**\n\nBalance: ৳{u['balance']:,}")
+        u = auth.get_user_by_id(uid)
+        st.sidebar.markdown(f"**{u['username']}**\n\nBalance: ৳{format_money(ledger.get_balance(uid))}")
         if st.sidebar.button("Logout"):
             del st.session_state["user_id"]
+            cache.clear_session()
             st.rerun()
     else:
         mode = st.sidebar.radio("Action", ["Login","Register"])
@@ -29,20 +45,24 @@ def sidebar_user_auth():
             username = st.sidebar.text_input("Username", key="login_user")
             password = st.sidebar.text_input("Password", type="password", key="login_pass")
             if st.sidebar.button("Login", key="login_btn"):
-                user = auth.authenticate(username, password)
-                if user:
-                    st.session_state["user_id"] = user["id"]
-                    st.success("Logged in")
-                    st.rerun()
+                try:
+                    user = auth.authenticate(username, password, ip=client_ip())
+                except auth.LoginThrottled as e:
+                    st.error(str(e))
                 else:
-                    st.error("Invalid credentials")
+                    if user:
+                        st.session_state["user_id"] = user["id"]
+                        st.success("Logged in")
+                        st.rerun()
+                    else:
+                        st.error("Invalid credentials")
         else:
             new_user = st.sidebar.text_input("Choose username", key="reg_user")
             new_pass = st.sidebar.text_input("Choose password", type="password", key="reg_pass")
             ref = st.sidebar.text_input("Referral username (optional)", key="reg_ref")
             if st.sidebar.button("Register", key="reg_btn"):
                 try:
-                    auth.register_user(new_user, new_pass, referrer_username=ref if ref else None)
+                    auth.register_user(new_user, new_pass, referrer_username=ref if ref else None, ip=client_ip())
                     st.success("Registration successful. Please login.")
                 except Exception as e:
                     st.error(f"Error: {e}")
@@ -54,7 +74,7 @@ st.title("Pyramid / Referral App")
 # show owner-only controls in sidebar
 if is_owner:
     st.sidebar.success("Owner mode active")
-    admin_view = st.sidebar.selectbox("Owner views", ["Owner Dashboard","Config","Backup DB"])
+    admin_view = st.sidebar.selectbox("Owner views", ["Owner Dashboard","Config","Backup DB","Performance"])
     if admin_view == "Config":
         st.header("Configuration")
         rates = config.get_commission_rates()
@@ -62,44 +82,95 @@ if is_owner:
         new = st.text_input("Comma separated rates", value=",".join(str(r) for r in rates))
         if st.button("Save rates"):
             try:
-                parsed = [float(x.strip()) for x in new.split(",") if x.strip()]
+                parsed = config.parse_rates(new)
                 config.set_commission_rates(parsed)
                 st.success("Saved")
             except Exception as e:
                 st.error("Invalid format")
+        st.markdown("#### What-if over history")
+        more = st.text_area("More rate sets to compare (one comma separated set per line)", key="sim_more")
+        if st.checkbox("Simulate payouts over all approved deposits", key="sim_on"):
+            try:
+                candidates = [rates] + [config.parse_rates(line) for line in [new, *more.splitlines()] if line.strip()]
+            except ValueError:
+                st.error("Invalid format")
+            else:
+                ui.commission_simulator(candidates)
+        with st.expander("Config cache"):
+            st.json(db.config_cache_stats())
     elif admin_view == "Backup DB":
         st.header("Database Backup")
-        b = db.backup_db_bytes()
-        st.download_button("Download DB Backup", b, file_name="pyramid_app.db")
+        gz = st.checkbox("gzip", value=True, key="backup_gz")
+        st.caption("Archived transactions live in a second file: download both and restore them together.")
+        if st.button("Create backup snapshot", key="backup_make"):
+            for _, f in st.session_state.pop("backup_files", ()):
+                f.close()
+            with st.spinner("Copying database online..."):
+                st.session_state["backup_files"] = db.backup_files(compress=gz)
+        for name, f in st.session_state.get("backup_files", ()):
+            st.download_button(f"Download {name}", f, file_name=name,
+                               mime="application/gzip" if name.endswith(".gz") else "application/octet-stream",
+                               key=f"backup_download_{name}")
+    elif admin_view == "Performance":
+        st.header("Performance")
+        ui.performance_view()
     else:
         st.header("Owner Dashboard")
         ui.kpi_cards()
         st.markdown("### Pending Transactions")
-        with get_db() as con:
-            pend = con.execute("SELECT t.*, u.username FROM transactions t LEFT JOIN users u ON u.id = t.member_id WHERE t.status='pending' ORDER BY created_at DESC").fetchall()
+        q = commission_worker.queue_stats()
+        st.caption(f"Commission queue: {q['queued']:,} queued, {q['running']:,} running, {q['failed']:,} failed — "
+                   f"lag {q['lag_s']:.1f}s, {q['workers']} worker(s) in this process")
+        pend = ui.paged_rows("pending_pager", lambda cursor, limit: payment.page_transactions(
+            cursor=cursor, limit=limit, status="pending", with_username=True), page_size=100)
+        owner_name = owner_display_name()
+        summary = st.session_state.pop("bulk_approve_summary", None)
+        if summary:
+            st.success(f"Approved {len(summary['approved'])}, skipped {len(summary['skipped'])} "
+                       f"in {summary['elapsed_s']:.2f}s ({summary['tx_per_sec']:,.0f} tx/s)")
+            for tid, err in summary["failed"].items():
+                st.error(f"Transaction {tid}: {err}")
+        def select_all_pending(ids=tuple(tx["id"] for tx in pend)):
+            # keyed checkboxes ignore `value` after their first render: set their state directly
+            for tid in ids:
+                st.session_state[f"sel_{tid}"] = st.session_state["sel_all_pending"]
+        if pend:
+            st.checkbox("Select all pending", key="sel_all_pending", on_change=select_all_pending)
+        selected = []
         for tx in pend:
-            st.write(dict(tx))
-            col1, col2 = st.columns([1,1])
+            st.write({**dict(tx), "amount": format_money(tx["amount"])})
+            col0, col1, col2 = st.columns([1,1,1])
+            if col0.checkbox("Select", key=f"sel_{tx['id']}"):
+                selected.append(tx["id"])
             if col1.button(f"Approve {tx['id']}", key=f"app_{tx['id']}"):
                 try:
-                    payment.approve_transaction(tx["id"], approver=st.secrets.get("owner", {}).get("name", "owner"))
+                    payment.approve_transaction(tx["id"], approver=owner_name)
                     st.success("Approved")
                     st.rerun()
                 except Exception as e:
                     st.error(f"Approve failed: {e}")
             if col2.button(f"Reject {tx['id']}", key=f"rej_{tx['id']}"):
-                payment.reject_transaction(tx["id"], reason="Rejected by owner")
-                st.warning("Rejected")
-                st.rerun()
+                try:
+                    payment.reject_transaction(tx["id"], reason="Rejected by owner")
+                    st.warning("Rejected")
+                    st.rerun()
+                except ValueError as e:
+                    st.error(f"Reject failed: {e}")
+        if pend and st.button(f"Approve all selected ({len(selected)})", key="app_selected", disabled=not selected):
+            st.session_state["bulk_approve_summary"] = payment.approve_transactions(selected, approver=owner_name)
+            st.rerun()
+
+        st.markdown("### All Transactions")
+        ui.transactions_table("owner_tx", **ui.transaction_filters("owner_tx_f"))
 
 # Regular user view
 if st.session_state.get("user_id"):
     uid = st.session_state["user_id"]
     st.header("User Dashboard")
-    with get_db() as con:
-        user = con.execute("SELECT * FROM users WHERE id = ?", (uid,)).fetchone()
+    user = auth.get_user_by_id(uid)
     st.subheader(f"Welcome, {user['username']}")
-    st.metric("Balance (৳)", f"{user['balance']:,}")
+    balance = ledger.get_balance(uid)
+    st.metric("Balance (৳)", format_money(balance))
 
     # Deposit/Withdraw forms
     st.markdown("#### Deposit Request (Manual)")
@@ -109,7 +180,7 @@ if st.session_state.get("user_id"):
         dep_method = st.selectbox("Method", ["nagad","bkash","rocket"], key="dep_method")
         dep_note = st.text_input("Note / txn id (optional)", key="dep_note")
         if st.button("Request Deposit", key="req_dep"):
-            txid = payment.create_transaction(uid, "deposit", float(dep_amt), method=dep_method, note=dep_note)
+            txid = payment.create_transaction(uid, "deposit", to_minor(dep_amt), method=dep_method, note=dep_note)
             st.success(f"Deposit requested (tx id {txid}). Admin will approve.")
 
     with dep_col2:
@@ -117,26 +188,27 @@ if st.session_state.get("user_id"):
         w_method = st.selectbox("Withdraw method", ["nagad","bkash","rocket"], key="w_method")
         w_note = st.text_input("Withdraw note / mobile", key="w_note")
         if st.button("Request Withdraw", key="req_w"):
-            if user["balance"] is None or user["balance"] < float(w_amt):
+            if balance < to_minor(w_amt):
                 st.error("Insufficient balance")
             else:
-                payment.create_transaction(uid, "withdrawal", float(w_amt), method=w_method, note=w_note)
+                payment.create_transaction(uid, "withdrawal", to_minor(w_amt), method=w_method, note=w_note)
                 st.success("Withdrawal requested. Admin will process it.")
 
     st.markdown("#### Your transactions")
-    df = ui.transactions_df(limit=500)
-    df_user = df[df["member_id"] == uid] if not df.empty else df
-    if not df_user.empty:
-        st.dataframe(df_user)
-        st.download_button("Download my transactions CSV", df_user.to_csv(index=False).encode(), file_name=f"{user['username']}_transactions.csv")
-    else:
-        st.info("No transactions yet.")
+    older = st.checkbox("Include archived transactions", key="my_tx_archive")
+    if ui.transactions_table("my_tx", member_id=uid, include_archive=older, plain=True):
+        ui.export_transactions_csv("my_export", file_name=f"{user['username']}_transactions.csv", member_id=uid)
 
     st.markdown("#### Your referrals")
+    levels = referral.get_level_counts(uid)
+    if levels:
+        st.caption(f"Downline: {sum(levels.values()):,} members — " + ", ".join(f"L{d}: {c:,}" for d, c in levels.items()))
     refs = referral.get_direct_referrals(uid)
     if refs:
         for r in refs:
             st.write(f"{r['username']} — joined {r['created_at']}")
+        with st.expander("Referral tree"):
+            ui.referral_tree_view(uid, key=f"tree_{uid}")
     else:
         st.info("No referrals yet.")
 else:
@@ -149,3 +221,6 @@ if st.sidebar.checkbox("Show analytics"):
     ui.kpi_cards()
     ui.simple_deposit_withdraw_chart()
     ui.export_transactions_csv()
+
+page = admin_view if is_owner else ("user" if st.session_state.get("user_id") else "anonymous")
+db.finish_render(page)
@@ -0,0 +1,125 @@
+# manage.py
+"""
+Maintenance commands for the Pyramid app database.
+Usage:
+    python manage.py rebuild-closure
+    python manage.py check-rollups [--fix]
+    python manage.py rebuild-rollups
+    python manage.py backup --dir backups [--keep 7] [--no-compress] [--every SECONDS]
+    python manage.py compact-ledger [--min-entries N] [--every SECONDS]
+    python manage.py check-ledger
+    python manage.py import-members members.csv|members.jsonl [--rejects PATH] [--batch 5000] [--workers N]
+    python manage.py archive [--days 90] [--batch 2000] [--pause 0.05] [--every SECONDS]
+"""
+
+import argparse
+import time
+
+import archive
+import db
+import importer
+import ledger
+import stats
+
+def cmd_rebuild_closure(args):
+    db.init_db()
+    n = db.rebuild_user_closure()
+    print(f"user_closure rebuilt: {n} rows")
+
+def cmd_check_rollups(args):
+    db.init_db()
+    problems = stats.check_rollups()
+    for p in problems:
+        print(p)
+    if not problems:
+        print("rollups consistent")
+    elif args.fix:
+        stats.rebuild_rollups()
+        print("rollups rebuilt")
+    return 1 if problems and not args.fix else 0
+
+def cmd_rebuild_rollups(args):
+    db.init_db()
+    stats.rebuild_rollups()
+    print("rollups rebuilt")
+
+def cmd_backup(args):
+    while True:
+        for path in db.snapshot(args.dir, keep=args.keep, compress=not args.no_compress):
+            print(f"snapshot written: {path}")
+        if not args.every:
+            return 0
+        time.sleep(args.every)
+
+def cmd_compact_ledger(args):
+    db.init_db()
+    while True:
+        n = ledger.compact(min_entries=args.min_entries)
+        print(f"ledger compacted: {n} balance checkpoints written")
+        if not args.every:
+            return 0
+        time.sleep(args.every)
+
+def cmd_check_ledger(args):
+    db.init_db()
+    problems = ledger.check_ledger()
+    for p in problems:
+        print(p)
+    if not problems:
+        print("ledger balanced")
+    return 1 if problems else 0
+
+def cmd_import_members(args):
+    db.init_db()
+    r = importer.import_members(args.file, rejects_path=args.rejects, batch=args.batch, workers=args.workers)
+    print(f"imported {r['imported']:,} of {r['read']:,} members in {r['seconds']}s ({r['rows_per_sec'] or 0:,.0f}/s)")
+    if r["rejects_path"]:
+        print(f"{r['rejected']:,} rows rejected, see {r['rejects_path']}")
+    return 1 if r["rejected"] else 0
+
+def cmd_archive(args):
+    db.init_db()
+    while True:
+        r = archive.archive_transactions(days=args.days, batch=args.batch, pause_s=args.pause)
+        print(f"archived {r['moved']:,} transactions created before {r['cutoff']} in {r['batches']} batches ({r['seconds']}s)")
+        if not args.every:
+            return 0
+        time.sleep(args.every)
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description="Pyramid app maintenance")
+    sub = ap.add_subparsers(dest="command", required=True)
+    sub.add_parser("rebuild-closure", help="recompute user_closure from users.parent_id").set_defaults(func=cmd_rebuild_closure)
+    p = sub.add_parser("check-rollups", help="compare analytics rollups with the transactions table")
+    p.add_argument("--fix", action="store_true", help="rebuild rollups if they disagree")
+    p.set_defaults(func=cmd_check_rollups)
+    sub.add_parser("rebuild-rollups", help="recompute analytics rollups").set_defaults(func=cmd_rebuild_rollups)
+    p = sub.add_parser("backup", help="online snapshot with rotation (optionally repeating)")
+    p.add_argument("--dir", required=True)
+    p.add_argument("--keep", type=int, default=7)
+    p.add_argument("--no-compress", action="store_true")
+    p.add_argument("--every", type=float, default=0, help="repeat every N seconds")
+    p.set_defaults(func=cmd_backup)
+    p = sub.add_parser("compact-ledger", help="roll balance checkpoints and refresh users.balance")
+    p.add_argument("--min-entries", type=int, default=ledger.CHECKPOINT_EVERY,
+                   help="checkpoint users with at least this many new entries (1 = everyone)")
+    p.add_argument("--every", type=float, default=0, help="repeat every N seconds")
+    p.set_defaults(func=cmd_compact_ledger)
+    sub.add_parser("check-ledger", help="verify every posting sums to zero").set_defaults(func=cmd_check_ledger)
+    p = sub.add_parser("import-members", help="bulk-register members from CSV/JSONL (bad rows go to a rejects file)")
+    p.add_argument("file")
+    p.add_argument("--rejects", default=None, help="rejects file (default: <file>.rejects.<ext>)")
+    p.add_argument("--batch", type=int, default=importer.IMPORT_BATCH, help="users per transaction")
+    p.add_argument("--workers", type=int, default=None, help="password hashing threads (default: PYRAMID_HASH_WORKERS)")
+    p.set_defaults(func=cmd_import_members)
+    p = sub.add_parser("archive", help="move settled transactions older than --days to the archive")
+    p.add_argument("--days", type=int, default=archive.ARCHIVE_DAYS)
+    p.add_argument("--batch", type=int, default=archive.ARCHIVE_BATCH, help="rows per write transaction")
+    p.add_argument("--pause", type=float, default=archive.ARCHIVE_PAUSE_S, help="seconds to sleep between batches")
+    p.add_argument("--every", type=float, default=0, help="repeat every N seconds")
+    p.set_defaults(func=cmd_archive)
+    args = ap.parse_args(argv)
+    return args.func(args)
+
+if __name__ == "__main__":
+    raise SystemExit(main())
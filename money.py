@@ -0,0 +1,43 @@
+# money.py
+"""
+Money helpers. Amounts and balances are stored and computed as integers in minor units
+(poisha: 100 per ৳) end-to-end; only UI input/output converts to/from major units.
+- to_minor(amount) -> int   major units (float/str/Decimal) to minor, half-up
+- to_major(minor) -> Decimal
+- format_money(minor) -> '1,234.50'
+- commission(amount_minor, rate) -> int   exact integer rounding (half-up) of amount * rate
+"""
+
+from decimal import Decimal, ROUND_HALF_UP
+
+MINOR_PER_UNIT = 100
+RATE_SCALE = 1_000_000  # commission rates are applied as integer parts-per-million
+
+def to_minor(amount) -> int:
+    """Major units (e.g. 12.345 ৳) to integer minor units, rounding half-up (1235)."""
+    if amount is None:
+        return 0
+    return int((Decimal(str(amount)) * MINOR_PER_UNIT).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+def to_major(minor) -> Decimal:
+    return (Decimal(int(minor or 0)) / MINOR_PER_UNIT).quantize(Decimal("0.01"))
+
+def format_money(minor) -> str:
+    return f"{to_major(minor):,.2f}"
+
+def rate_ppm(rate) -> int:
+    """Commission rate (0.05) as integer parts-per-million (50000)."""
+    return int((Decimal(str(rate)) * RATE_SCALE).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+def commission(amount_minor: int, rate) -> int:
+    """amount_minor * rate rounded half-up to a whole minor unit, in pure integer math."""
+    ppm = rate_ppm(rate)
+    if amount_minor <= 0 or ppm <= 0:
+        return 0
+    return (amount_minor * ppm + RATE_SCALE // 2) // RATE_SCALE
+
+def require_minor(amount):
+    """Guard for write paths: amounts must already be integer minor units."""
+    if isinstance(amount, bool) or not isinstance(amount, int):
+        raise TypeError(f"amount must be integer minor units (see money.to_minor), got {amount!r}")
+    return amount
@@ -3,56 +3,346 @@
 # ============================================================================
 """
 Payment & transaction logic:
-- create_transaction(member_id, type_, amount, method, note)
-- approve_transaction(tx_id, approver_is_admin=True) -> does credit/debit and commission distribution
-- reject_transaction(tx_id)
+- create_transaction(member_id, type_, amount, method, note, external_ref)
+- create_transactions(items) -> batch create in one write transaction, idempotent on external_ref (ingest.py)
+- get_transactions(ids, external_refs) -> status lookup over hot + archived rows
+- approve_transaction(tx_id, approver_is_admin=True) -> does credit/debit and enqueues the commission job
+- approve_transactions(tx_ids, approver) -> bulk approval in chunked transactions with per-tx failures
+- reject_transaction(tx_id) / reject_transactions(tx_ids) (pending rows only)
+- list_transactions / page_transactions: filtered listing with keyset (created_at, id) cursors
+- iter_transactions: server-side cursor streaming for exports
+- listings read the hot table; include_archive=True reads all_transactions (hot + archived, see archive.py)
+- pay_commissions(con, deposits): batched commission payout run by commission_worker.py
 - idempotency safeguards for commission distribution (checks source_tx_id)
-- credit_user / debit_user low-level helpers
+- balances only change through append-only ledger postings (ledger.py); users.balance is a cached projection
+- every status/amount change also updates the analytics rollups (stats.py) in the same transaction
+- amounts are integer minor units (money.py) throughout; floats are rejected on write
+- page_transactions is session-cached (cache.py); every write publishes the members it touched after commit
 """
 
-from db import get_db, get_config, set_config  # CHANGED: removed relative import
-from datetime import datetime
-from referral import get_parent_chain  # CHANGED: removed relative import
-import json
+import cache
+from db import get_db, get_config, begin, for_update, insert_id, reserve_ids, stream  # CHANGED: removed relative import
+from datetime import datetime, date, timedelta
+from referral import get_ancestors, get_ancestors_many, IN_CHUNK  # CHANGED: removed relative import
+from stats import RollupDelta, bump_tx
+from money import commission, require_minor
+from ledger import post, post_many, get_balances, deposit_legs, withdrawal_legs, commission_legs
+import time
 
-def create_transaction(member_id:int, type_:str, amount:float, method:str="manual", note:str=None, source_tx_id=None):
+DEFAULT_COMMISSION_RATES = [0.10, 0.05, 0.02]
+APPROVE_CHUNK_SIZE = 500  # transactions per BEGIN/commit in approve_transactions
+REQUEST_TYPES = ("deposit", "withdrawal")  # what members (and create_transactions) may request
+
+_INSERT_TX = ("INSERT INTO transactions (member_id, type, method, amount, status, note, source_tx_id, created_at, external_ref) "
+              "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)")
+
+def create_transaction(member_id:int, type_:str, amount:int, method:str="manual", note:str=None, source_tx_id=None, external_ref=None):
+    """amount in minor units (money.to_minor for user input). external_ref must be unique when given."""
+    require_minor(amount)
     now = datetime.utcnow().isoformat()
     with get_db() as con:
-        cur = con.execute(
-            "INSERT INTO transactions (member_id, type, method, amount, status, note, source_tx_id, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
-            (member_id, type_, method, amount, "pending", note, source_tx_id, now)
-        )
+        tx_id = insert_id(con, _INSERT_TX, (member_id, type_, method, amount, "pending", note, source_tx_id, now, external_ref))
+        bump_tx(con, type_, "pending", amount, now)
         con.commit()
-        return cur.lastrowid
+    cache.member_changed(member_id)
+    return tx_id
+
+def _by_column(con, sql, values):
+    """Rows of `sql` (with an IN ({marks}) placeholder) for values, queried IN_CHUNK at a time."""
+    values = list(values)
+    rows = []
+    for i in range(0, len(values), IN_CHUNK):
+        chunk = values[i:i + IN_CHUNK]
+        rows += con.execute(sql.format(marks=",".join("?" * len(chunk))), tuple(chunk)).fetchall()
+    return rows
 
-def list_transactions(member_id=None, status=None, type_=None, limit=200):
-    q = "SELECT * FROM transactions WHERE 1=1"
+def _request_item(item, usernames, members):
+    """(member_id, type, amount, method, note, external_ref) from one create_transactions item; ValueError if invalid."""
+    member_id = item.get("member_id")
+    if member_id is None and item.get("username") is not None:
+        member_id = usernames.get(item["username"])
+        if member_id is None:
+            raise ValueError(f"unknown username {item['username']!r}")
+    if not isinstance(member_id, int) or isinstance(member_id, bool):
+        raise ValueError("member_id (integer) or username is required")
+    if member_id not in members:
+        raise ValueError(f"unknown member_id {member_id}")
+    type_ = item.get("type")
+    if type_ not in REQUEST_TYPES:
+        raise ValueError(f"type must be one of {REQUEST_TYPES}")
+    amount = item.get("amount")
+    require_minor(amount)
+    if amount <= 0:
+        raise ValueError("amount must be positive")
+    ref = item.get("external_ref")
+    if ref is not None and (not isinstance(ref, str) or not ref.strip()):
+        raise ValueError("external_ref must be a non-empty string")
+    return member_id, type_, amount, item.get("method") or "manual", item.get("note"), ref
+
+def create_transactions(items):
+    """
+    Record many pending deposit/withdrawal requests in one write transaction (ingest.py group commit).
+    items: dicts with member_id (or username), type, amount (minor units), method, note, external_ref.
+    Idempotent on external_ref: an item whose key already exists (earlier in the batch, in the hot
+    table or in the archive) is not inserted again and reports the existing transaction.
+    Invalid items are reported and do not affect the others. Returns one dict per item:
+    {"id", "status", "duplicate"} or {"error"}.
+    """
+    refs = {it.get("external_ref") for it in items if isinstance(it.get("external_ref"), str)}
+    names = {it["username"] for it in items if it.get("member_id") is None and isinstance(it.get("username"), str)}
+    ids = {it["member_id"] for it in items if isinstance(it.get("member_id"), int)}
+    results = [None] * len(items)
+    rows, repeats = [], []  # repeats: (index, index of the earlier item with the same external_ref)
+    members = set()
+    rollup = RollupDelta()
+    now = datetime.utcnow().isoformat()
+    with get_db() as con:
+        try:
+            begin(con)
+            known = {r["external_ref"]: {"id": r["id"], "status": r["status"], "duplicate": True} for r in _by_column(
+                con, "SELECT id, status, external_ref FROM all_transactions WHERE external_ref IN ({marks})", refs)}
+            usernames = {r["username"]: r["id"] for r in _by_column(con, "SELECT id, username FROM users WHERE username IN ({marks})", names)}
+            existing = {r["id"] for r in _by_column(con, "SELECT id FROM users WHERE id IN ({marks})", ids)} | set(usernames.values())
+            first = {}
+            for i, item in enumerate(items):
+                try:
+                    member_id, type_, amount, method, note, ref = _request_item(item, usernames, existing)
+                except (ValueError, TypeError) as e:
+                    results[i] = {"error": str(e)}
+                    continue
+                if ref in known:
+                    results[i] = known[ref]
+                elif ref in first:
+                    repeats.append((i, first[ref]))
+                else:
+                    if ref is not None:
+                        first[ref] = i
+                    rows.append((i, (member_id, type_, method, amount, "pending", note, None, now, ref)))
+                    members.add(member_id)
+                    rollup.add(type_, "pending", amount, now)
+            # one executemany with reserved ids instead of an INSERT round trip per item
+            new_ids = reserve_ids(con, "transactions", len(rows)) if rows else []
+            con.executemany("INSERT INTO transactions (id, member_id, type, method, amount, status, note, source_tx_id, created_at, external_ref) "
+                            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", [(tx_id, *row) for tx_id, (_, row) in zip(new_ids, rows)])
+            for tx_id, (i, _) in zip(new_ids, rows):
+                results[i] = {"id": tx_id, "status": "pending", "duplicate": False}
+            for i, j in repeats:
+                results[i] = dict(results[j], duplicate=True)
+            rollup.apply(con)
+            con.commit()
+        except Exception:
+            con.rollback()
+            raise
+    if members:
+        cache.member_changed(*members)
+    return results
+
+def get_transactions(ids=(), external_refs=()):
+    """Transactions (hot or archived) by id and/or external_ref, in no particular order."""
+    cols = "id, member_id, type, method, amount, status, created_at, external_ref"
+    with get_db() as con:
+        rows = _by_column(con, f"SELECT {cols} FROM all_transactions WHERE id IN ({{marks}})", ids)
+        seen = {r["id"] for r in rows}
+        rows += [r for r in _by_column(con, f"SELECT {cols} FROM all_transactions WHERE external_ref IN ({{marks}})", external_refs)
+                 if r["id"] not in seen]
+    return rows
+
+def _day_bound(d, next_day=False) -> str:
+    """'YYYY-MM-DD' for a date/str bound; next_day=True gives the exclusive upper bound for an inclusive date_to."""
+    if isinstance(d, str):
+        d = date.fromisoformat(d[:10])
+    if isinstance(d, datetime):
+        d = d.date()
+    return (d + timedelta(days=1)).isoformat() if next_day else d.isoformat()
+
+def _transaction_filters(member_id=None, status=None, type_=None, date_from=None, date_to=None, cursor=None):
+    """WHERE clause (on alias t) + params shared by every transaction listing; all filters are index-backed."""
+    q = " WHERE 1=1"
     params = []
     if member_id:
-        q += " AND member_id = ?"; params.append(member_id)
+        q += " AND t.member_id = ?"; params.append(member_id)
     if status:
-        q += " AND status = ?"; params.append(status)
+        q += " AND t.status = ?"; params.append(status)
     if type_:
-        q += " AND type = ?"; params.append(type_)
-    q += " ORDER BY created_at DESC LIMIT ?"; params.append(limit)
+        q += " AND t.type = ?"; params.append(type_)
+    if date_from:
+        q += " AND t.created_at >= ?"; params.append(_day_bound(date_from))
+    if date_to:
+        q += " AND t.created_at < ?"; params.append(_day_bound(date_to, next_day=True))
+    if cursor:
+        # keyset: strictly after the last row of the previous page in (created_at DESC, id DESC) order
+        q += " AND (t.created_at, t.id) < (?, ?)"; params.extend(cursor)
+    return q, params
+
+def list_transactions(member_id=None, status=None, type_=None, limit=200, cursor=None, date_from=None, date_to=None, with_username=False,
+                      include_archive=False):
+    cols = "t.*, u.username" if with_username else "t.*"
+    join = " LEFT JOIN users u ON u.id = t.member_id" if with_username else ""
+    table = "all_transactions" if include_archive else "transactions"
+    where, params = _transaction_filters(member_id, status, type_, date_from, date_to, cursor)
+    q = f"SELECT {cols} FROM {table} t{join}{where} ORDER BY t.created_at DESC, t.id DESC LIMIT ?"
+    params.append(limit)
     with get_db() as con:
         return con.execute(q, tuple(params)).fetchall()
 
-def _credit_user(con, user_id:int, amount:float):
-    con.execute("UPDATE users SET balance = COALESCE(balance,0) + ? WHERE id = ?", (amount, user_id))
+@cache.cached(lambda a: cache.tx_tag(a.get("member_id")))
+def page_transactions(cursor=None, limit=50, **filters):
+    """
+    One page of transactions, newest first. Returns (rows, next_cursor); pass next_cursor back
+    to get the following page, next_cursor is None on the last page.
+    filters: member_id, status, type_, date_from, date_to, with_username, include_archive
+    """
+    rows = list_transactions(limit=limit + 1, cursor=cursor, **filters)
+    if len(rows) > limit:
+        rows = rows[:limit]
+        return rows, (rows[-1]["created_at"], rows[-1]["id"])
+    return rows, None
 
-def _debit_user(con, user_id:int, amount:float):
-    con.execute("UPDATE users SET balance = COALESCE(balance,0) - ? WHERE id = ?", (amount, user_id))
+def iter_transactions(chunk_size=1000, member_id=None, status=None, type_=None, date_from=None, date_to=None, with_username=True,
+                      include_archive=False):
+    """
+    Stream matching transactions newest first without materializing them: yields the column
+    names first, then row tuples fetched `chunk_size` at a time (db.stream: a server-side cursor
+    on Postgres). Holds a pooled connection until the generator is exhausted or closed.
+    """
+    cols = "t.*, u.username" if with_username else "t.*"
+    join = " LEFT JOIN users u ON u.id = t.member_id" if with_username else ""
+    table = "all_transactions" if include_archive else "transactions"
+    where, params = _transaction_filters(member_id, status, type_, date_from, date_to)
+    with get_db() as con:
+        yield from stream(con, f"SELECT {cols} FROM {table} t{join}{where} ORDER BY t.created_at DESC, t.id DESC", params, chunk_size)
 
 def _record_transaction(con, member_id, amount, type_, method, status, note, source_tx_id=None):
+    require_minor(amount)
     now = datetime.utcnow().isoformat()
     con.execute("INSERT INTO transactions (member_id, type, method, amount, status, note, source_tx_id, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
                 (member_id, type_, method, amount, status, note, source_tx_id, now))
+    bump_tx(con, type_, status, amount, now)
+
+def _commission_rates():
+    return get_config("commission_rates", DEFAULT_COMMISSION_RATES) or DEFAULT_COMMISSION_RATES
+
+def _commissions_for(member_id:int, amount:int, parents, rates):
+    """Yield (parent_id, commission_amount, level) for an upline list ordered nearest first (integer minor units)."""
+    for idx, parent_id in enumerate(parents):
+        rate = rates[idx] if idx < len(rates) else 0
+        if rate <= 0:
+            continue
+        comm_amount = commission(amount, rate)
+        if comm_amount <= 0:
+            continue
+        yield parent_id, comm_amount, idx + 1
+
+def _rows_by_id(con, table_sql, ids):
+    rows = {}
+    for i in range(0, len(ids), IN_CHUNK):
+        chunk = ids[i:i + IN_CHUNK]
+        for r in con.execute(table_sql.format(marks=",".join("?" * len(chunk))), tuple(chunk)).fetchall():
+            rows[r["id"]] = r
+    return rows
+
+_ENQUEUE_COMMISSION = ("INSERT INTO commission_jobs (source_tx_id, member_id, amount, created_at, available_at) "
+                       "VALUES (?, ?, ?, ?, ?) ON CONFLICT(source_tx_id) DO NOTHING")
+
+def _approve_chunk(con, tx_ids, approver):
+    """
+    Approve tx_ids inside the caller's open transaction.
+    Validation happens in memory first (same order and rules as approving one by one),
+    then all writes go out with executemany. Deposits enqueue a commission job instead of
+    walking the upline here (see pay_commissions / commission_worker.py).
+    Returns (approved_ids, skipped_ids, {tx_id: error}, member_ids whose balance changed).
+    """
+    approved, skipped, failures = [], [], {}
+    # rows are locked (FOR UPDATE on Postgres; SQLite holds the database write lock from begin())
+    txs = _rows_by_id(con, "SELECT * FROM transactions WHERE id IN ({marks}) ORDER BY id" + for_update(), tx_ids)
+    todo = []
+    for tx_id in tx_ids:
+        tx = txs.get(tx_id)
+        if not tx:
+            failures[tx_id] = "Transaction not found"
+        elif tx["status"] == "approved":
+            skipped.append(tx_id)  # already approved
+        else:
+            todo.append(tx)
+    if not todo:
+        return approved, skipped, failures, set()
+
+    # credits are plain ledger inserts; only members withdrawing need a (locked) balance
+    withdrawers = sorted({tx["member_id"] for tx in todo if tx["type"] == "withdrawal"})
+    _rows_by_id(con, "SELECT id FROM users WHERE id IN ({marks}) ORDER BY id" + for_update(), withdrawers)
+    balances = get_balances(con, withdrawers)
+
+    postings = []
+    jobs = []
+    members = set()
+    rollup = RollupDelta()
+    note = f" | approved_by:{approver}"
+    now = datetime.utcnow().isoformat()
+    for tx in todo:
+        member_id, amount = tx["member_id"], tx["amount"]
+        if tx["type"] == "deposit":
+            postings.append((tx["id"], deposit_legs(member_id, amount)))
+            balances[member_id] = balances.get(member_id, 0) + amount
+            jobs.append((tx["id"], member_id, amount, now, now))
+        elif tx["type"] == "withdrawal":
+            if balances.get(member_id, 0) < amount:
+                failures[tx["id"]] = "Insufficient balance to approve withdrawal"
+                continue
+            postings.append((tx["id"], withdrawal_legs(member_id, amount)))
+            balances[member_id] -= amount
+        approved.append(tx["id"])
+        members.add(member_id)
+        rollup.move(tx["type"], tx["status"], "approved", amount, tx["created_at"])
+
+    post_many(con, postings, now)
+    con.executemany("UPDATE transactions SET status='approved', note=COALESCE(note,'') || ? WHERE id = ?",
+                    [(note, tx_id) for tx_id in approved])
+    con.executemany(_ENQUEUE_COMMISSION, jobs)
+    rollup.apply(con)
+    return approved, skipped, failures, members
+
+def pay_commissions(con, deposits, rates=None):
+    """
+    Pay upline commissions for approved deposits [(source_tx_id, member_id, amount), ...] inside the
+    caller's open transaction: commission rows, ledger postings and rollups with executemany.
+    Idempotent on source_tx_id: deposits that already have commission rows are skipped.
+    Returns (source_tx_ids paid, member ids credited).
+    """
+    rates = rates or _commission_rates()
+    paid = set()
+    src_ids = [src for src, _, _ in deposits if src is not None]
+    for i in range(0, len(src_ids), IN_CHUNK):
+        chunk = src_ids[i:i + IN_CHUNK]
+        paid.update(r["source_tx_id"] for r in con.execute(
+            f"SELECT DISTINCT source_tx_id FROM transactions WHERE type='commission' AND source_tx_id IN ({','.join('?' * len(chunk))})",
+            tuple(chunk)).fetchall())
+    todo = [d for d in deposits if d[0] not in paid]
+    uplines = get_ancestors_many([member_id for _, member_id, _ in todo], len(rates), con)
+
+    now = datetime.utcnow().isoformat()
+    postings, rows = [], []
+    credited = set()
+    rollup = RollupDelta()
+    for src, member_id, amount in todo:
+        legs = []
+        parents = [pid for pid, _ in uplines.get(member_id, [])]
+        for parent_id, comm_amount, level in _commissions_for(member_id, amount, parents, rates):
+            legs += commission_legs(parent_id, comm_amount)
+            rows.append((parent_id, comm_amount, f"Level {level} commission from member {member_id}", src, now))
+            credited.add(parent_id)
+            rollup.add("commission", "approved", comm_amount, now)
+        if legs:
+            postings.append((src, legs))
+    con.executemany("INSERT INTO transactions (member_id, type, method, amount, status, note, source_tx_id, created_at) VALUES (?, 'commission', 'system', ?, 'approved', ?, ?, ?)",
+                    rows)
+    post_many(con, postings, now)
+    rollup.apply(con)
+    return [src for src, _, _ in todo], credited
 
 def approve_transaction(tx_id:int, approver="admin"):
     """
     Approve pending tx:
-     - deposit: credit user + distribute commissions (idempotent)
+     - deposit: credit user + enqueue its commission job (paid asynchronously by commission_worker)
      - withdrawal: debit user (if not already debited) and mark approved
      - commission/adjustment: handled as recorded
     """
@@ -64,49 +354,107 @@ def approve_transaction(tx_id:int, approver="admin"):
             return tx  # already approved
         # begin atomic block
         try:
-            con.execute("BEGIN")
-            if tx["type"] == "deposit":
-                _credit_user(con, tx["member_id"], tx["amount"])
-                # mark the original transaction as approved
-                con.execute("UPDATE transactions SET status='approved', note=COALESCE(note,'') || ? WHERE id = ?", (f" | approved_by:{approver}", tx_id))
-                # record commission distribution (ensure idempotent by checking commission presence for source_tx_id)
-                distribute_commissions(con, tx["member_id"], tx["amount"], source_tx_id=tx_id)
-            elif tx["type"] == "withdrawal":
-                # check balance and debit
-                curbal = con.execute("SELECT balance FROM users WHERE id = ?", (tx["member_id"],)).fetchone()["balance"] or 0
-                if curbal < tx["amount"]:
-                    raise ValueError("Insufficient balance to approve withdrawal")
-                _debit_user(con, tx["member_id"], tx["amount"])
-                con.execute("UPDATE transactions SET status='approved', note=COALESCE(note,'') || ? WHERE id = ?", (f" | approved_by:{approver}", tx_id))
-            else:
-                # generic approve
-                con.execute("UPDATE transactions SET status='approved', note=COALESCE(note,'') || ? WHERE id = ?", (f" | approved_by:{approver}", tx_id))
+            begin(con)
+            _, _, failures, members = _approve_chunk(con, [tx_id], approver)
+            if failures:
+                raise ValueError(failures[tx_id])
             con.commit()
-            return con.execute("SELECT * FROM transactions WHERE id = ?", (tx_id,)).fetchone()
         except Exception as e:
             con.rollback()
             raise
+        cache.member_changed(*members)
+        return con.execute("SELECT * FROM transactions WHERE id = ?", (tx_id,)).fetchone()
+
+def approve_transactions(tx_ids, approver="admin", chunk_size:int=APPROVE_CHUNK_SIZE):
+    """
+    Bulk approve. Each chunk of `chunk_size` ids is one write transaction; deposits only
+    enqueue their commission jobs, so a chunk's cost does not depend on upline depth.
+    A failing transaction (e.g. insufficient balance) is reported and the rest still commit.
+    Returns {"approved": [...], "skipped": [...], "failed": {tx_id: error}, "chunks", "elapsed_s", "tx_per_sec"}.
+    """
+    tx_ids = list(dict.fromkeys(tx_ids))
+    result = {"approved": [], "skipped": [], "failed": {}, "chunks": 0}
+    started = time.perf_counter()
+    with get_db() as con:
+        for i in range(0, len(tx_ids), chunk_size):
+            chunk = tx_ids[i:i + chunk_size]
+            result["chunks"] += 1
+            try:
+                begin(con)
+                approved, skipped, failures, members = _approve_chunk(con, chunk, approver)
+                con.commit()
+                cache.member_changed(*members)
+            except Exception:
+                con.rollback()
+                # isolate the offending row(s): fall back to one transaction per id for this chunk
+                approved, skipped, failures = [], [], {}
+                for tx_id in chunk:
+                    try:
+                        before = con.execute("SELECT status FROM transactions WHERE id = ?", (tx_id,)).fetchone()
+                        approve_transaction(tx_id, approver=approver)
+                        (skipped if before and before["status"] == "approved" else approved).append(tx_id)
+                    except Exception as e:
+                        failures[tx_id] = str(e)
+            result["approved"].extend(approved)
+            result["skipped"].extend(skipped)
+            result["failed"].update(failures)
+    elapsed = time.perf_counter() - started
+    result["elapsed_s"] = elapsed
+    result["tx_per_sec"] = len(result["approved"]) / elapsed if elapsed > 0 else 0.0
+    return result
 
 def reject_transaction(tx_id:int, reason:str=None):
+    """
+    Reject one pending transaction (same path as reject_transactions). Raises ValueError if it does not
+    exist or is no longer pending: an approved row keeps its ledger postings and commissions.
+    """
+    failures = reject_transactions([tx_id], reason)["failed"]
+    if failures:
+        raise ValueError(failures[tx_id])
+
+def reject_transactions(tx_ids, reason:str=None):
+    """
+    Bulk reject in one write transaction. Only pending rows change; anything else is reported
+    with its current status. Returns {"rejected": [...], "failed": {tx_id: error}}.
+    """
+    tx_ids = list(dict.fromkeys(tx_ids))
+    rejected, failures, members = [], {}, set()
+    rollup = RollupDelta()
     with get_db() as con:
-        con.execute("UPDATE transactions SET status='rejected', note = COALESCE(note,'') || ? WHERE id = ?", (f" | rejected: {reason}" if reason else " | rejected", tx_id))
-        con.commit()
+        try:
+            begin(con)
+            txs = _rows_by_id(con, "SELECT id, member_id, type, status, amount, created_at FROM transactions "
+                                   "WHERE id IN ({marks}) ORDER BY id" + for_update(), tx_ids)
+            for tx_id in tx_ids:
+                tx = txs.get(tx_id)
+                if not tx:
+                    failures[tx_id] = "Transaction not found"
+                elif tx["status"] != "pending":
+                    failures[tx_id] = f"Transaction is {tx['status']}"
+                else:
+                    rejected.append(tx_id)
+                    members.add(tx["member_id"])
+                    rollup.move(tx["type"], "pending", "rejected", tx["amount"], tx["created_at"])
+            con.executemany("UPDATE transactions SET status='rejected', note = COALESCE(note,'') || ? WHERE id = ? AND status = 'pending'",
+                            [(f" | rejected: {reason}" if reason else " | rejected", tx_id) for tx_id in rejected])
+            rollup.apply(con)
+            con.commit()
+        except Exception:
+            con.rollback()
+            raise
+    if members:
+        cache.member_changed(*members)
+    return {"rejected": rejected, "failed": failures}
 
-def distribute_commissions(con, member_id:int, amount:float, source_tx_id:int=None):
+def distribute_commissions(con, member_id:int, amount:int, source_tx_id:int=None):
     """
     Distribute commissions up the parent chain according to stored commission_rates.
     - IDENTITY: check whether commission entries for given source_tx_id already exist to prevent double-credit.
     - con: an open sqlite connection in transaction
     """
-    rates = get_config("commission_rates", [0.10, 0.05, 0.02]) or [0.10, 0.05, 0.02]
-    parents = []
-    # gather parent chain
-    cur = con.execute("SELECT parent_id FROM users WHERE id = ?", (member_id,)).fetchone()
-    current = cur["parent_id"] if cur else None
-    while current and len(parents) < len(rates):
-        parents.append(current)
-        cur = con.execute("SELECT parent_id FROM users WHERE id = ?", (current,)).fetchone()
-        current = cur["parent_id"] if cur else None
+    rates = _commission_rates()
+    # gather parent chain (one recursive query, depth-limited to the configured levels)
+    parents = [pid for pid, _ in get_ancestors(member_id, len(rates), con=con)]
 
     # idempotency guard: if source_tx_id is provided, check whether any commission rows exist referencing it
     if source_tx_id is not None:
@@ -114,14 +462,11 @@ def distribute_commissions(con, member_id:int, amount:float, source_tx_id:int=No
         if exists and exists > 0:
             return  # already processed
 
-    for idx, parent_id in enumerate(parents):
-        rate = rates[idx] if idx < len(rates) else 0
-        if rate <= 0:
-            continue
-        comm_amount = round(amount * rate, 2)
-        if comm_amount <= 0:
-            continue
-        # credit parent and write commission tx (approved)
-        _credit_user(con, parent_id, comm_amount)
-        _record_transaction(con, parent_id, comm_amount, "commission", "system", "approved", f"Level {idx+1} commission from member {member_id}", source_tx_id)
+    legs = []
+    for parent_id, comm_amount, level in _commissions_for(member_id, amount, parents, rates):
+        # credit parent (ledger leg) and write commission tx (approved)
+        legs += commission_legs(parent_id, comm_amount)
+        _record_transaction(con, parent_id, comm_amount, "commission", "system", "approved", f"Level {level} commission from member {member_id}", source_tx_id)
+    if legs:
+        post(con, source_tx_id, legs)
     # note: commit handled by outer transaction
@@ -5,46 +5,166 @@
 Referral utilities:
 - register_referral chain queries
 - get_direct_referrals(user_id)
+- get_ancestors(user_id, max_levels, con) -> [(ancestor_id, depth)] in one recursive query
+- get_ancestors_many(user_ids, max_levels, con) -> {user_id: [(ancestor_id, depth)]} for a batch
 - get_parent_chain(user_id, max_levels)
-- referral_tree(user_id, depth) -> nested dict for visualization
+- referral_tree(user_id, depth, child_limit, expanded) -> nested dict for visualization, one query per level
+- closure-table lookups: get_downline_count, get_level_counts, get_descendants, get_ancestor_list
+- get_direct_referrals / get_level_counts / referral_tree are session-cached under "referrals:<id>"
+  (auth.register_user invalidates every ancestor of the new member)
 """
 
+import cache
 from db import get_db, get_config  # CHANGED: removed relative import
-from typing import List, Dict
+from typing import List, Dict, Tuple
 
+@cache.cached("referrals:{user_id}")
 def get_direct_referrals(user_id: int):
     with get_db() as con:
         rows = con.execute("SELECT id, username, level, created_at FROM users WHERE parent_id = ? ORDER BY created_at DESC", (user_id,)).fetchall()
         return rows
 
+ANCESTORS_SQL = """
+WITH RECURSIVE chain(id, depth) AS (
+    SELECT parent_id, 1 FROM users WHERE id = ? AND parent_id IS NOT NULL
+    UNION ALL
+    SELECT u.parent_id, c.depth + 1 FROM users u JOIN chain c ON u.id = c.id
+    WHERE u.parent_id IS NOT NULL AND c.depth < ?
+)
+SELECT id, depth FROM chain ORDER BY depth
+"""
+
+def get_ancestors(user_id:int, max_levels:int, con=None) -> List[Tuple[int, int]]:
+    """
+    Depth-limited upline of user_id as [(ancestor_id, depth), ...], nearest first (depth 1 = parent).
+    Resolved in a single WITH RECURSIVE statement; pass `con` to run inside an open transaction.
+    """
+    if max_levels is None or max_levels <= 0:
+        return []
+    if con is None:
+        with get_db() as con:
+            return get_ancestors(user_id, max_levels, con)
+    rows = con.execute(ANCESTORS_SQL, (user_id, max_levels)).fetchall()
+    return [(r["id"], r["depth"]) for r in rows]
+
+ANCESTORS_MANY_SQL = """
+WITH RECURSIVE chain(member_id, id, depth) AS (
+    SELECT id, parent_id, 1 FROM users WHERE id IN ({marks}) AND parent_id IS NOT NULL
+    UNION ALL
+    SELECT c.member_id, u.parent_id, c.depth + 1 FROM users u JOIN chain c ON u.id = c.id
+    WHERE u.parent_id IS NOT NULL AND c.depth < ?
+)
+SELECT member_id, id, depth FROM chain ORDER BY member_id, depth
+"""
+
+IN_CHUNK = 500  # keep IN (...) lists well below SQLite's bound-parameter limit
+
+def get_ancestors_many(user_ids, max_levels:int, con=None) -> Dict[int, List[Tuple[int, int]]]:
+    """Batch form of get_ancestors: {user_id: [(ancestor_id, depth), ...]} with one recursive query per IN_CHUNK ids."""
+    ids = list(dict.fromkeys(user_ids))
+    out = {uid: [] for uid in ids}
+    if not ids or max_levels is None or max_levels <= 0:
+        return out
+    if con is None:
+        with get_db() as con:
+            return get_ancestors_many(ids, max_levels, con)
+    for i in range(0, len(ids), IN_CHUNK):
+        chunk = ids[i:i + IN_CHUNK]
+        sql = ANCESTORS_MANY_SQL.format(marks=",".join("?" * len(chunk)))
+        for r in con.execute(sql, (*chunk, max_levels)).fetchall():
+            out[r["member_id"]].append((r["id"], r["depth"]))
+    return out
+
 def get_parent_chain(user_id:int, max_levels:int=None) -> List[int]:
     if max_levels is None:
         max_levels = get_config("max_levels", 10)
-    chain = []
-    cur_id = user_id
+    return [pid for pid, _ in get_ancestors(user_id, max_levels)]
+
+_NO_LIMIT = 2**31 - 1  # bound used when no max_depth / child_limit is given
+
+def get_downline_count(user_id:int, max_depth:int=None) -> int:
+    """Number of members below user_id (optionally only down to max_depth levels)."""
     with get_db() as con:
-        for i in range(max_levels):
-            r = con.execute("SELECT parent_id FROM users WHERE id = ?", (cur_id,)).fetchone()
-            if not r or not r["parent_id"]:
-                break
-            pid = r["parent_id"]
-            chain.append(pid)
-            cur_id = pid
-    return chain
-
-def referral_tree(user_id:int, depth=3) -> Dict:
-    """Return nested tree: {'id':..., 'username':..., 'children':[...]}"""
+        return con.execute(
+            "SELECT COUNT(*) AS c FROM user_closure WHERE ancestor_id = ? AND depth BETWEEN 1 AND ?",
+            (user_id, max_depth if max_depth is not None else _NO_LIMIT)).fetchone()["c"]
+
+@cache.cached("referrals:{user_id}")
+def get_level_counts(user_id:int, max_depth:int=None) -> Dict[int, int]:
+    """{depth: members at that depth} for the downline of user_id."""
+    with get_db() as con:
+        rows = con.execute(
+            "SELECT depth, COUNT(*) AS c FROM user_closure WHERE ancestor_id = ? AND depth BETWEEN 1 AND ? GROUP BY depth ORDER BY depth",
+            (user_id, max_depth if max_depth is not None else _NO_LIMIT)).fetchall()
+        return {r["depth"]: r["c"] for r in rows}
+
+def get_descendants(user_id:int, depth:int):
+    """Members exactly `depth` levels below user_id (id, username, level, created_at)."""
     with get_db() as con:
-        root = con.execute("SELECT id, username FROM users WHERE id = ?", (user_id,)).fetchone()
+        return con.execute(
+            "SELECT u.id, u.username, u.level, u.created_at FROM user_closure c JOIN users u ON u.id = c.descendant_id "
+            "WHERE c.ancestor_id = ? AND c.depth = ? ORDER BY u.id", (user_id, depth)).fetchall()
+
+def get_ancestor_list(user_id:int, max_depth:int=None) -> List[int]:
+    """Upline ids nearest first, read from the closure table."""
+    with get_db() as con:
+        rows = con.execute(
+            "SELECT ancestor_id FROM user_closure WHERE descendant_id = ? AND depth BETWEEN 1 AND ? ORDER BY depth",
+            (user_id, max_depth if max_depth is not None else _NO_LIMIT)).fetchall()
+        return [r["ancestor_id"] for r in rows]
+
+TREE_LEVEL_SQL = """
+SELECT id, username, parent_id, child_count, siblings FROM (
+    SELECT u.id, u.username, u.parent_id,
+           ROW_NUMBER() OVER (PARTITION BY u.parent_id ORDER BY u.created_at, u.id) AS rn,
+           COUNT(*) OVER (PARTITION BY u.parent_id) AS siblings,
+           (SELECT COUNT(*) FROM users c WHERE c.parent_id = u.id) AS child_count
+    FROM users u WHERE u.parent_id IN ({marks})
+) AS lvl WHERE rn <= ? ORDER BY parent_id, rn
+"""
+
+@cache.cached("referrals:{user_id}")
+def referral_tree(user_id:int, depth=3, child_limit:int=None, expanded=()) -> Dict:
+    """
+    Return nested tree: {'id', 'username', 'child_count', 'children':[...], 'collapsed', 'truncated'}
+    Loaded breadth-first with one query per level (per IN_CHUNK parents), usernames inline.
+    - depth: levels loaded below user_id; deeper nodes come back with collapsed=True if they have children
+    - child_limit: at most this many children per node (oldest first); truncated=True when more exist
+    - expanded: node ids whose children are loaded even past `depth` (lazy expansion of collapsed branches)
+    """
+    with get_db() as con:
+        root = con.execute("SELECT id, username, (SELECT COUNT(*) FROM users c WHERE c.parent_id = users.id) AS child_count "
+                           "FROM users WHERE id = ?", (user_id,)).fetchone()
         if not root:
             return {}
-    def build(node_id, current_depth):
-        with get_db() as con:
-            children = con.execute("SELECT id, username FROM users WHERE parent_id = ?", (node_id,)).fetchall()
-        if current_depth >= depth:
-            return {"id": node_id, "children": [{"id": c["id"], "username": c["username"]} for c in children]}
-        return {"id": node_id, "username": get_username(node_id), "children":[build(c["id"], current_depth+1) for c in children]}
-    return build(user_id, 0)
+        expanded = set(expanded)
+        def node(r):
+            return {"id": r["id"], "username": r["username"], "child_count": r["child_count"],
+                    "children": [], "collapsed": r["child_count"] > 0, "truncated": False}
+        tree = node(root)
+        frontier = {tree["id"]: tree}
+        level = 0
+        limit = child_limit if child_limit else _NO_LIMIT
+        while frontier:
+            parents = {nid: n for nid, n in frontier.items() if level < depth or nid in expanded}
+            frontier = {}
+            ids = list(parents)
+            for i in range(0, len(ids), IN_CHUNK):
+                chunk = ids[i:i + IN_CHUNK]
+                for r in con.execute(TREE_LEVEL_SQL.format(marks=",".join("?" * len(chunk))), (*chunk, limit)).fetchall():
+                    parent = parents[r["parent_id"]]
+                    child = node(r)
+                    parent["children"].append(child)
+                    parent["truncated"] = r["siblings"] > len(parent["children"]) if child_limit else False
+                    frontier[child["id"]] = child
+            for n in parents.values():
+                n["collapsed"] = False
+            level += 1
+        return tree
+
+def expand_node(node_id:int, depth=1, child_limit:int=None) -> Dict:
+    """Load one collapsed branch on demand (same shape as referral_tree)."""
+    return referral_tree(node_id, depth=depth, child_limit=child_limit)
 
 def get_username(user_id):
     with get_db() as con:
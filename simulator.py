@@ -0,0 +1,131 @@
+# simulator.py
+"""
+Commission what-if simulator over the existing history, vectorized with NumPy.
+- load_network(max_age_s) -> Network: parent array (users.id -> parent) and approved deposits (archived too), loaded
+  once per process and reused until max_age_s old
+- Network.ancestors(k): ancestor index at depth k (1 = parent) for every user, -1 when there is none
+- Network.simulate(rate_vectors) -> one result per candidate vector: payout and recipients per level,
+  total, payout per user
+- Network.top_earners(result, n) -> [(user_id, payout)]
+Payouts follow payment._commissions_for exactly: per deposit, level k pays money.commission(amount,
+rates[k-1]) (integer ppm math, half-up) to the ancestor at depth k, for every level of the vector.
+"""
+
+import os
+import threading
+import time
+
+import numpy as np
+
+from db import get_db
+from money import RATE_SCALE, rate_ppm
+
+SIM_MAX_AGE = float(os.getenv("PYRAMID_SIM_MAX_AGE", "300"))  # seconds a loaded network is reused
+FETCH_CHUNK = 200_000
+
+_lock = threading.Lock()
+_network = None
+
+def _int_columns(con, sql, ncols):
+    """(rows, ncols) int64 array from a query whose columns are all non-NULL integers, fetched in chunks."""
+    cur = con.execute(sql)
+    parts = []
+    while True:
+        rows = cur.fetchmany(FETCH_CHUNK)
+        if not rows:
+            break
+        parts.append(np.fromiter((v for r in rows for v in r), dtype=np.int64, count=len(rows) * ncols).reshape(-1, ncols))
+    return np.concatenate(parts) if parts else np.empty((0, ncols), dtype=np.int64)
+
+class Network:
+    """Users as indexes 0..n-1 (ascending id); parent[i] / deposit_member[j] are such indexes (-1 = none)."""
+
+    def __init__(self, ids, parent_ids, deposit_members, deposit_amounts):
+        self.ids = ids
+        self.n = len(ids)
+        self.parent = self._index(parent_ids)
+        self.deposit_member = self._index(deposit_members)
+        keep = (self.deposit_member >= 0) & (deposit_amounts > 0)  # deleted members and empty deposits pay nobody
+        self.deposit_member = self.deposit_member[keep]
+        self.deposit_amount = deposit_amounts[keep]
+        self.loaded_at = time.time()
+        self._ancestors = [self.parent]
+        self._recipients = {}
+
+    def _index(self, user_ids):
+        if not self.n:
+            return np.full(len(user_ids), -1, dtype=np.int64)
+        pos = np.minimum(np.searchsorted(self.ids, user_ids), self.n - 1)
+        return np.where(self.ids[pos] == user_ids, pos, -1)
+
+    def ancestors(self, k):
+        """Ancestor index at depth k for every user (-1 when the upline is shorter than k)."""
+        while len(self._ancestors) < k:
+            prev = self._ancestors[-1]
+            self._ancestors.append(np.where(prev >= 0, self.parent[prev], -1))
+        return self._ancestors[k - 1]
+
+    def recipients(self, k):
+        """Ancestor index at depth k of each deposit's member."""
+        if k not in self._recipients:
+            self._recipients[k] = self.ancestors(k)[self.deposit_member]
+        return self._recipients[k]
+
+    def simulate(self, rate_vectors):
+        """
+        rate_vectors: one rate list (e.g. [0.10, 0.05, 0.02]) or a list of them. Returns, per vector,
+        {"rates", "levels": [{"level", "rate", "payout", "recipients", "deposits"}], "total", "per_user"}
+        with amounts in minor units; per_user is an int64 array aligned with self.ids.
+        """
+        if rate_vectors and not isinstance(rate_vectors[0], (list, tuple, np.ndarray)):
+            rate_vectors = [rate_vectors]
+        results = []
+        for rates in rate_vectors:
+            per_user = np.zeros(self.n, dtype=np.int64)
+            levels = []
+            for k, rate in enumerate(rates, 1):
+                ppm = rate_ppm(rate) if rate > 0 else 0
+                if ppm:
+                    to = self.recipients(k)
+                    paid = to >= 0
+                    comm = (self.deposit_amount[paid] * ppm + RATE_SCALE // 2) // RATE_SCALE
+                    earned = np.bincount(to[paid], weights=comm, minlength=self.n)
+                    per_user += np.rint(earned).astype(np.int64)
+                    levels.append({"level": k, "rate": rate, "payout": int(comm.sum()),
+                                   "recipients": int(np.count_nonzero(earned)), "deposits": int(np.count_nonzero(comm))})
+                else:
+                    levels.append({"level": k, "rate": rate, "payout": 0, "recipients": 0, "deposits": 0})
+            results.append({"rates": list(rates), "levels": levels, "total": sum(l["payout"] for l in levels),
+                            "per_user": per_user})
+        return results
+
+    def top_earners(self, result, n=10):
+        """[(user_id, payout)] of the n largest per-user payouts in a simulate() result."""
+        per_user = result["per_user"]
+        if not len(per_user):
+            return []
+        top = np.argpartition(per_user, -min(n, len(per_user)))[-n:]
+        top = top[np.argsort(per_user[top])[::-1]]
+        return [(int(self.ids[i]), int(per_user[i])) for i in top if per_user[i] > 0]
+
+    def summary(self):
+        return {"users": self.n, "deposits": int(len(self.deposit_amount)), "deposit_total": int(self.deposit_amount.sum()),
+                "loaded_at": self.loaded_at}
+
+def _load():
+    with get_db() as con:
+        users = _int_columns(con, "SELECT id, COALESCE(parent_id, 0) FROM users ORDER BY id", 2)
+        deposits = _int_columns(con, "SELECT member_id, amount FROM all_transactions WHERE type = 'deposit' AND status = 'approved'", 2)
+    return Network(users[:, 0], users[:, 1], deposits[:, 0], deposits[:, 1])
+
+def load_network(max_age_s=SIM_MAX_AGE, force=False) -> Network:
+    """The process-wide Network, reloaded when older than max_age_s (or force=True)."""
+    global _network
+    with _lock:
+        if force or _network is None or time.time() - _network.loaded_at > max_age_s:
+            _network = _load()
+        return _network
+
+def simulate(rate_vectors, max_age_s=SIM_MAX_AGE):
+    """Shortcut: load_network(max_age_s).simulate(rate_vectors)."""
+    return load_network(max_age_s).simulate(rate_vectors)
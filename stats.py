@@ -0,0 +1,128 @@
+# stats.py
+"""
+Incrementally maintained rollups for the analytics pages:
+- tx_rollup_totals(type, status): running count/amount per type and status
+- tx_rollup_daily(day, type, status): the same per date(created_at)
+- counters(name): scalar counters (e.g. 'users')
+Writers call bump_tx / move_tx / bump_counter inside their own open transaction,
+so rollups commit (or roll back) together with the rows they describe.
+check_rollups() / rebuild_rollups() compare against / recompute from the base tables.
+The read helpers are session-cached under the "kpi" tag (cache.py); writers publish it after commit.
+"""
+
+from collections import defaultdict
+from typing import Dict, List, Tuple
+
+import cache
+from db import get_db, upsert_sql
+
+_UPSERT_TOTALS = upsert_sql("tx_rollup_totals", ["type", "status"], ["tx_count", "amount"], add=("tx_count", "amount"))
+_UPSERT_DAILY = upsert_sql("tx_rollup_daily", ["day", "type", "status"], ["tx_count", "amount"], add=("tx_count", "amount"))
+_UPSERT_COUNTER = upsert_sql("counters", ["name"], ["value"], add=("value",))
+
+def _day(created_at) -> str:
+    # created_at is either datetime('now') 'YYYY-MM-DD HH:MM:SS' or isoformat 'YYYY-MM-DDTHH:MM:SS'
+    return str(created_at)[:10]
+
+class RollupDelta:
+    """Accumulates rollup changes for a batch of writes; apply() flushes them with executemany."""
+    def __init__(self):
+        self.daily = defaultdict(lambda: [0, 0])
+
+    def add(self, type_, status, amount, created_at, count=1):
+        d = self.daily[(_day(created_at), type_, status)]
+        d[0] += count
+        d[1] += amount * count
+        return self
+
+    def move(self, type_, old_status, new_status, amount, created_at):
+        self.add(type_, old_status, amount, created_at, count=-1)
+        return self.add(type_, new_status, amount, created_at)
+
+    def apply(self, con):
+        totals = defaultdict(lambda: [0, 0])
+        for (day, type_, status), (c, a) in self.daily.items():
+            totals[(type_, status)][0] += c
+            totals[(type_, status)][1] += a
+        con.executemany(_UPSERT_TOTALS, [(t, s, c, a) for (t, s), (c, a) in totals.items() if c or a])
+        con.executemany(_UPSERT_DAILY, [(d, t, s, c, a) for (d, t, s), (c, a) in self.daily.items() if c or a])
+        self.daily.clear()
+
+def bump_tx(con, type_, status, amount, created_at, count=1):
+    RollupDelta().add(type_, status, amount, created_at, count).apply(con)
+
+def move_tx(con, type_, old_status, new_status, amount, created_at):
+    RollupDelta().move(type_, old_status, new_status, amount, created_at).apply(con)
+
+def bump_counter(con, name, delta=1):
+    con.execute(_UPSERT_COUNTER, (name, delta))
+
+@cache.cached("kpi")
+def get_counter(name, default=0):
+    with get_db() as con:
+        r = con.execute("SELECT value FROM counters WHERE name = ?", (name,)).fetchone()
+        return r["value"] if r else default
+
+@cache.cached("kpi")
+def get_total(type_, status) -> Tuple[int, int]:
+    """(count, amount in minor units) of transactions with this type and status."""
+    with get_db() as con:
+        r = con.execute("SELECT tx_count, amount FROM tx_rollup_totals WHERE type = ? AND status = ?", (type_, status)).fetchone()
+        return (r["tx_count"], r["amount"]) if r else (0, 0)
+
+@cache.cached("kpi")
+def daily_series(days=30, status="approved"):
+    """Last `days` days that have data: rows of (d, deposits, withdraws), newest first."""
+    with get_db() as con:
+        return con.execute(
+            "SELECT day AS d, "
+            "SUM(CASE WHEN type='deposit' THEN amount ELSE 0 END) AS deposits, "
+            "SUM(CASE WHEN type='withdrawal' THEN amount ELSE 0 END) AS withdraws "
+            "FROM tx_rollup_daily WHERE day IN (SELECT DISTINCT day FROM tx_rollup_daily ORDER BY day DESC LIMIT ?) "
+            "AND status = ? GROUP BY day ORDER BY day DESC", (days, status)).fetchall()
+
+# rollups cover archived transactions too (archive.py), so they are checked against the full history
+_EXPECTED_DAILY = ("SELECT substr(created_at, 1, 10) AS day, type, status, COUNT(*) AS tx_count, COALESCE(SUM(amount), 0) AS amount "
+                   "FROM all_transactions GROUP BY 1, 2, 3")
+
+def rebuild_rollups(con=None):
+    """Recompute every rollup from users/transactions in one transaction."""
+    if con is None:
+        with get_db() as con:
+            return rebuild_rollups(con)
+    con.execute("DELETE FROM tx_rollup_daily")
+    con.execute("DELETE FROM tx_rollup_totals")
+    con.execute(f"INSERT INTO tx_rollup_daily (day, type, status, tx_count, amount) {_EXPECTED_DAILY}")
+    con.execute("INSERT INTO tx_rollup_totals (type, status, tx_count, amount) "
+                "SELECT type, status, SUM(tx_count), SUM(amount) FROM tx_rollup_daily GROUP BY type, status")
+    con.execute("DELETE FROM counters WHERE name = 'users'")
+    con.execute("INSERT INTO counters (name, value) SELECT 'users', COUNT(*) FROM users")
+    con.commit()
+    cache.invalidate("kpi")
+
+def check_rollups() -> List[str]:
+    """Return human readable mismatches between rollups and base tables (empty list = consistent)."""
+    problems = []
+    with get_db() as con:
+        expected = {(r["day"], r["type"], r["status"]): (r["tx_count"], r["amount"]) for r in con.execute(_EXPECTED_DAILY)}
+        actual = {(r["day"], r["type"], r["status"]): (r["tx_count"], r["amount"])
+                  for r in con.execute("SELECT day, type, status, tx_count, amount FROM tx_rollup_daily")}
+        for key in sorted(set(expected) | set(actual)):
+            e, a = expected.get(key, (0, 0)), actual.get(key, (0, 0))
+            if e != a:
+                problems.append(f"daily {key}: expected count={e[0]} amount={e[1]}, rollup has count={a[0]} amount={a[1]}")
+        totals: Dict[Tuple[str, str], List] = defaultdict(lambda: [0, 0])
+        for (_, t, s), (c, a) in expected.items():
+            totals[(t, s)][0] += c
+            totals[(t, s)][1] += a
+        actual_totals = {(r["type"], r["status"]): (r["tx_count"], r["amount"])
+                         for r in con.execute("SELECT type, status, tx_count, amount FROM tx_rollup_totals")}
+        for key in sorted(set(totals) | set(actual_totals)):
+            e, a = tuple(totals.get(key, (0, 0))), actual_totals.get(key, (0, 0))
+            if e != a:
+                problems.append(f"totals {key}: expected count={e[0]} amount={e[1]}, rollup has count={a[0]} amount={a[1]}")
+        users = con.execute("SELECT COUNT(*) AS c FROM users").fetchone()["c"]
+        r = con.execute("SELECT value FROM counters WHERE name = 'users'").fetchone()
+        if (r["value"] if r else 0) != users:
+            problems.append(f"counters users: expected {users}, rollup has {r['value'] if r else 0}")
+    return problems
@@ -0,0 +1,53 @@
+# tests/conftest.py
+"""
+Shared fixtures. The app modules read their settings (PYRAMID_DB, DATABASE_URL, ...) at import
+time, so `app` imports a fresh copy of them for every test against a throwaway database.
+"""
+
+import importlib
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+# every module that holds database or settings state (dependents after their dependencies)
+APP_MODULES = ("db", "cache", "money", "stats", "ledger", "referral", "auth", "config", "payment",
+               "commission_worker", "archive", "importer", "simulator", "ingest", "ui")
+
+def _forget_app_modules():
+    db = sys.modules.get("db")
+    if db is not None:
+        db.close_pool()
+    for name in APP_MODULES:
+        sys.modules.pop(name, None)
+
+class App:
+    """Attribute access imports the app module of that name (app.payment, app.db, ...)."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def __getattr__(self, name):
+        return importlib.import_module(name)
+
+@pytest.fixture
+def app_env(tmp_path, monkeypatch):
+    """Environment for a fresh SQLite database under tmp_path; app modules are re-imported afterwards."""
+    monkeypatch.setenv("PYRAMID_DB", str(tmp_path / "test.db"))
+    monkeypatch.delenv("DATABASE_URL", raising=False)
+    monkeypatch.setenv("PYRAMID_PBKDF2_ITERATIONS", "1000")
+    monkeypatch.setenv("PYRAMID_COMMISSION_WORKERS", "0")
+    _forget_app_modules()
+    yield tmp_path
+    _forget_app_modules()
+
+@pytest.fixture
+def app(app_env):
+    """Fresh app modules on an initialized database."""
+    a = App(app_env / "test.db")
+    a.db.init_db()
+    return a
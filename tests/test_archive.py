@@ -0,0 +1,40 @@
+# tests/test_archive.py
+"""Archiving moves old settled rows out of the hot table, never pending ones or those a commission job still needs."""
+
+OLD = "2000-01-01T00:00:00"
+
+def test_archive_moves_settled_rows_only(app):
+    app.auth.register_user("root", "pw")
+    app.auth.register_user("child", "pw", referrer_username="root")
+    child = app.auth.get_user_by_username("child")["id"]
+    paid = app.payment.create_transaction(child, "deposit", 10_000)
+    app.payment.approve_transaction(paid)
+    app.commission_worker.drain()
+    unpaid = app.payment.create_transaction(child, "deposit", 20_000)
+    app.payment.approve_transaction(unpaid)  # its commission job is still queued
+    pending = app.payment.create_transaction(child, "deposit", 30_000)
+    with app.db.get_db() as con:
+        con.execute("UPDATE transactions SET created_at = ?", (OLD,))
+        con.commit()
+    app.stats.rebuild_rollups()  # daily rollups follow the backdated rows
+    recent = app.payment.create_transaction(child, "withdrawal", 1_000)
+    app.payment.approve_transaction(recent)
+    commission = app.payment.list_transactions(type_="commission")[0]["id"]
+    everything = sorted(r["id"] for r in app.payment.list_transactions(include_archive=True))
+
+    result = app.archive.archive_transactions(days=30, batch=1, pause_s=0)
+    assert (result["moved"], result["batches"]) == (2, 2)
+    assert sorted(r["id"] for r in app.payment.list_transactions()) == sorted([unpaid, pending, recent])
+    assert sorted(r["id"] for r in app.payment.list_transactions(include_archive=True)) == everything
+    with app.db.get_db() as con:
+        assert sorted(r["id"] for r in con.execute("SELECT id FROM archive.transactions")) == sorted([paid, commission])
+    assert app.archive.archive_stats()["archived_rows"] == 2
+
+    app.commission_worker.drain()  # the queued job finishes and its deposit becomes due
+    assert app.archive.archive_transactions(days=30, pause_s=0)["moved"] == 1
+    hot = app.payment.list_transactions()
+    assert sorted((r["id"], r["source_tx_id"]) for r in hot if r["type"] == "deposit") == [(pending, None)]
+    assert [r["source_tx_id"] for r in hot if r["type"] == "commission"] == [unpaid]  # new row, not old yet
+    assert app.ledger.get_balance(child) == 29_000
+    assert app.ledger.check_ledger() == []
+    assert app.stats.check_rollups() == []
@@ -0,0 +1,42 @@
+# tests/test_auth.py
+"""Hashing pool admission: a slot stays taken for as long as its hash runs."""
+
+import threading
+import time
+from concurrent.futures import TimeoutError
+
+import pytest
+
+from conftest import App
+
+def test_timed_out_hash_keeps_its_slot_until_it_finishes(app_env, monkeypatch):
+    monkeypatch.setenv("PYRAMID_HASH_QUEUE", "1")
+    app = App(app_env / "test.db")
+    auth = app.auth
+    release, finished = threading.Event(), threading.Event()
+    real = auth._pbkdf2
+    def slow(password, salt, iterations):
+        release.wait(10)
+        try:
+            return real(password, salt, iterations)
+        finally:
+            finished.set()
+    monkeypatch.setattr(auth, "_pbkdf2", slow)
+    monkeypatch.setattr(auth, "HASH_TIMEOUT", 0.05)
+
+    with pytest.raises(TimeoutError):
+        auth._hash_password("pw", "salt")
+    with pytest.raises(auth.LoginThrottled):  # the first hash is still running on the pool
+        auth._hash_password("pw", "salt")
+
+    release.set()
+    assert finished.wait(10)
+    monkeypatch.setattr(auth, "_pbkdf2", real)
+    for _ in range(50):  # the done callback runs right after the worker returns
+        try:
+            assert auth._hash_password("pw", "salt") == real("pw", "salt", auth.ITERATIONS)
+            break
+        except auth.LoginThrottled:
+            time.sleep(0.01)
+    else:
+        pytest.fail("slot was never released")
@@ -0,0 +1,143 @@
+# tests/test_backends.py
+"""
+The same flows on every supported backend: SQLite through the sqlite3 pool, SQLite through
+SQLAlchemy (_SAConnection), and Postgres. Postgres runs against PYRAMID_TEST_POSTGRES_URL
+(a server URL; each test creates and drops its own database) or, when that is unset, a
+throwaway local server from the `pgserver` package; without either it is skipped.
+"""
+
+import os
+import uuid
+
+import pytest
+
+from conftest import App
+
+BACKENDS = ["sqlite", "sqlalchemy-sqlite", "postgresql"]
+
+@pytest.fixture(scope="session")
+def postgres_url(tmp_path_factory):
+    """URL of a Postgres server's maintenance database."""
+    url = os.getenv("PYRAMID_TEST_POSTGRES_URL")
+    if url:
+        return url
+    pgserver = pytest.importorskip("pgserver")
+    server = pgserver.get_server(tmp_path_factory.mktemp("pgdata"), cleanup_mode="stop")
+    return server.get_uri().replace("postgresql://", "postgresql+psycopg2://", 1)
+
+@pytest.fixture
+def postgres_database(request):
+    """A fresh database on the test server; dropped afterwards."""
+    sqlalchemy = pytest.importorskip("sqlalchemy")
+    pytest.importorskip("psycopg2")
+    server = sqlalchemy.engine.make_url(request.getfixturevalue("postgres_url"))
+    name = f"pyramid_test_{uuid.uuid4().hex[:12]}"
+    admin = sqlalchemy.create_engine(server, isolation_level="AUTOCOMMIT")
+    with admin.connect() as c:
+        c.execute(sqlalchemy.text(f'CREATE DATABASE "{name}"'))
+    yield server.set(database=name).render_as_string(hide_password=False)
+    with admin.connect() as c:
+        c.execute(sqlalchemy.text(f'DROP DATABASE IF EXISTS "{name}" WITH (FORCE)'))
+    admin.dispose()
+
+@pytest.fixture(params=BACKENDS)
+def app(request, app_env, monkeypatch):
+    """Fresh app modules on an initialized database of each backend."""
+    if request.param == "sqlalchemy-sqlite":
+        pytest.importorskip("sqlalchemy")
+        monkeypatch.setenv("DATABASE_URL", f"sqlite:///{app_env / 'test.db'}")
+    elif request.param == "postgresql":
+        monkeypatch.setenv("DATABASE_URL", request.getfixturevalue("postgres_database"))
+    a = App(app_env / "test.db")
+    a.db.init_db()
+    yield a
+    a.db.close_pool()  # Postgres cannot drop a database with open connections
+
+def _register(app, username, referrer=None):
+    assert app.auth.register_user(username, "pw", referrer_username=referrer) is True
+    return app.auth.get_user_by_username(username)["id"]
+
+def test_connection_facade(app):
+    expected = "sqlite" if app.db.DATABASE_URL is None else app.db.DATABASE_URL.split(":")[0].split("+")[0]
+    assert app.db.dialect() == expected
+    with app.db.get_db() as con:
+        raw = getattr(con, "_conn", con)  # unwrap the query-stats proxy
+        assert isinstance(raw, app.db._SAConnection) == bool(app.db.DATABASE_URL)
+        app.db.begin(con)
+        con.executemany("INSERT INTO config (key, value) VALUES (?, ?)", [("t.a", "1"), ("t.b", "2")])
+        con.rollback()
+        assert con.execute("SELECT COUNT(*) AS n FROM config WHERE key LIKE 't.%'").fetchone()["n"] == 0
+        app.db.begin(con)
+        con.execute(app.db.upsert_sql("config", ["key"], ["value"]), ("t.a", "3"))
+        con.commit()
+        row = con.execute("SELECT key, value FROM config WHERE key = ?", ("t.a",)).fetchone()
+    assert (row["key"], row["value"]) == ("t.a", "3")
+    assert dict(row) == {"key": "t.a", "value": "3"}
+
+def test_register_deposit_approve_commissions(app):
+    root = _register(app, "root")
+    child = _register(app, "child", "root")
+    grandchild = _register(app, "grandchild", "child")
+    assert app.referral.get_parent_chain(grandchild) == [child, root]
+    assert app.auth.authenticate("grandchild", "pw")["id"] == grandchild
+
+    tx = app.payment.create_transaction(grandchild, "deposit", 10_000, method="bkash")
+    assert app.payment.approve_transactions([tx], approver="test")["approved"] == [tx]
+    app.commission_worker.drain()
+
+    assert app.ledger.get_balance(grandchild) == 10_000
+    assert app.ledger.get_balance(child) == 1_000  # level 1 at 10%
+    assert app.ledger.get_balance(root) == 500  # level 2 at 5%
+    commissions = app.payment.list_transactions(type_="commission")
+    assert sorted((r["member_id"], r["source_tx_id"]) for r in commissions) == [(root, tx), (child, tx)]
+    assert app.ledger.check_ledger() == []
+    assert app.stats.check_rollups() == []
+
+    w = app.payment.create_transaction(grandchild, "withdrawal", 2_500)
+    app.payment.approve_transaction(w)
+    assert app.ledger.get_balance(grandchild) == 7_500
+
+def test_insert_id_and_reserved_ids_share_the_sequence(app):
+    member = _register(app, "member")
+    first = app.payment.create_transaction(member, "deposit", 100)  # insert_id
+    batch = app.payment.create_transactions([{"member_id": member, "type": "deposit", "amount": 100 + i} for i in range(3)])
+    batch_ids = [r["id"] for r in batch]  # explicit ids from reserve_ids
+    after = app.payment.create_transaction(member, "deposit", 200)  # the sequence moved past the batch
+    assert first < batch_ids[0] < batch_ids[1] < batch_ids[2] < after
+    with app.db.get_db() as con:
+        app.db.begin(con)
+        reserved = app.db.reserve_ids(con, "transactions", 2)
+        con.rollback()
+    assert reserved[0] > after and reserved[1] == reserved[0] + 1
+
+def test_pagination(app):
+    member = _register(app, "member")
+    created = [app.payment.create_transaction(member, "deposit", 100 * (i + 1)) for i in range(7)]
+    seen, cursor, pages = [], None, 0
+    while True:
+        rows, cursor = app.payment.page_transactions(cursor=cursor, limit=3, member_id=member, with_username=True)
+        seen += [r["id"] for r in rows]
+        pages += 1
+        assert all(r["username"] == "member" for r in rows)
+        if cursor is None:
+            break
+    assert pages == 3
+    assert seen == sorted(created, reverse=True)  # newest first, each row once
+
+def test_iter_transactions_streams(app):
+    member = _register(app, "member")
+    created = [app.payment.create_transaction(member, "deposit", 100 * (i + 1)) for i in range(5)]
+    rows = app.payment.iter_transactions(chunk_size=2, member_id=member)
+    header = next(rows)
+    assert header[:2] == ["id", "member_id"] and header[-1] == "username"
+    assert app.db.pool_stats()["in_use"] == 1  # the connection is held while streaming
+    assert [r[0] for r in rows] == sorted(created, reverse=True)
+    assert app.db.pool_stats()["in_use"] == 0
+
+    with app.db.get_db() as con:
+        rows = app.db.stream(con, "SELECT id FROM transactions ORDER BY id", chunk_size=2)
+        assert next(rows) == ["id"] and next(rows) == (created[0],)
+        if app.db.dialect() == "postgresql":  # the result stays on the server behind a named cursor
+            open_cursors = con.execute("SELECT name FROM pg_cursors").fetchall()
+            assert [c["name"] for c in open_cursors if c["name"].startswith("pyramid_stream_")]
+        rows.close()
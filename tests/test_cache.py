@@ -0,0 +1,42 @@
+# tests/test_cache.py
+"""Session read cache: writes invalidate the entries they change; no session means no cache."""
+
+import logging
+
+import pytest
+
+@pytest.fixture
+def session(app, monkeypatch):
+    """Pretend the test runs inside one Streamlit session with its own SessionCache."""
+    c = app.cache.SessionCache()
+    with app.cache._lock:
+        app.cache._caches.add(c)
+    monkeypatch.setattr(app.cache, "_session_cache", lambda: c)
+    return c
+
+def test_write_invalidates_cached_page(app, session):
+    app.auth.register_user("alice", "pw")
+    app.auth.register_user("bob", "pw")
+    alice, bob = (app.auth.get_user_by_username(n)["id"] for n in ("alice", "bob"))
+    app.payment.create_transaction(alice, "deposit", 100)
+    app.payment.create_transaction(bob, "deposit", 100)
+
+    first, _ = app.payment.page_transactions(member_id=alice)
+    bobs, _ = app.payment.page_transactions(member_id=bob)
+    hits = app.cache.stats()["hits"]
+    assert app.payment.page_transactions(member_id=alice)[0] is first  # served from the session cache
+    assert app.cache.stats()["hits"] == hits + 1
+
+    tx = app.payment.create_transaction(alice, "deposit", 250)  # publishes tx:<alice> after commit
+    rows, _ = app.payment.page_transactions(member_id=alice)
+    assert [r["id"] for r in rows][0] == tx and len(rows) == len(first) + 1
+    assert app.payment.page_transactions(member_id=bob)[0] is bobs  # other members' entries survive
+
+def test_no_session_bypasses_quietly(app, caplog):
+    app.auth.register_user("alice", "pw")
+    alice = app.auth.get_user_by_username("alice")["id"]
+    misses = app.cache.stats()["misses"]
+    with caplog.at_level(logging.WARNING):
+        app.payment.page_transactions(member_id=alice)
+    assert app.cache.stats()["misses"] == misses  # never looked up: read straight from the database
+    assert not [r for r in caplog.records if "ScriptRunContext" in r.getMessage()]
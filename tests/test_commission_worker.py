@@ -0,0 +1,51 @@
+# tests/test_commission_worker.py
+"""Commission workers: idle polls stay read-only, due and stale jobs are picked up, failures are logged."""
+
+import logging
+import sqlite3
+from datetime import datetime, timedelta
+
+def _deposit(app):
+    app.auth.register_user("root", "pw")
+    app.auth.register_user("child", "pw", referrer_username="root")
+    child = app.auth.get_user_by_username("child")["id"]
+    tx = app.payment.create_transaction(child, "deposit", 10_000)
+    app.payment.approve_transaction(tx)
+    return tx
+
+def test_idle_poll_takes_no_write_lock(app):
+    writer = sqlite3.connect(app.path, timeout=0)
+    writer.execute("BEGIN IMMEDIATE")  # another process holds the write lock
+    try:
+        started = datetime.utcnow()
+        assert app.commission_worker.process_batch() == 0
+        assert datetime.utcnow() - started < timedelta(seconds=5)  # did not wait for the lock
+    finally:
+        writer.rollback()
+        writer.close()
+
+def test_due_and_stale_jobs_are_claimed(app):
+    tx = _deposit(app)
+    assert app.commission_worker.process_batch() == 1
+    with app.db.get_db() as con:
+        # a worker died mid-job: the lease has expired and nothing else is queued
+        con.execute("UPDATE commission_jobs SET status = 'running', claimed_at = ? WHERE source_tx_id = ?",
+                    ((datetime.utcnow() - timedelta(seconds=app.commission_worker.LEASE_S + 1)).isoformat(), tx))
+        con.commit()
+    assert app.commission_worker.process_batch() == 1
+    assert app.commission_worker.process_batch() == 0
+    root = app.auth.get_user_by_username("root")["id"]
+    assert app.ledger.get_balance(root) == 1_000  # paid once despite the reclaim
+
+def test_worker_failures_are_logged_with_traceback(app, monkeypatch, caplog):
+    worker = app.commission_worker
+    def boom(size, worker=None):
+        app.commission_worker._stop.set()  # one iteration
+        raise RuntimeError("database went away")
+    monkeypatch.setattr(worker, "process_batch", boom)
+    worker._stop.clear()
+    with caplog.at_level(logging.ERROR, logger="commission_worker"):
+        worker._loop("w1", 10)
+    worker._stop.clear()
+    [record] = [r for r in caplog.records if r.name == "commission_worker"]
+    assert "w1" in record.getMessage() and record.exc_info[0] is RuntimeError
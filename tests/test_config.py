@@ -0,0 +1,34 @@
+# tests/test_config.py
+"""The in-process config cache picks up other processes' writes once the generation counter moves."""
+
+def _write_elsewhere(app, key, value, bump):
+    """What another process's set_config does to the database, without touching this process's cache."""
+    with app.db.get_db() as con:
+        con.execute(app.db.upsert_sql("config", ["key"], ["value"]), (key, value))
+        if bump:
+            con.execute("UPDATE config SET value = CAST(CAST(value AS INTEGER) + 1 AS TEXT) WHERE key = ?",
+                        (app.db.CONFIG_GENERATION_KEY,))
+        con.commit()
+
+def test_generation_bump_invalidates_cached_values(app, monkeypatch):
+    monkeypatch.setattr(app.db, "CONFIG_CHECK_INTERVAL", 3600.0)
+    app.config.set_commission_rates([0.1, 0.05])
+    assert app.config.get_commission_rates() == [0.1, 0.05]
+    assert app.config.get_max_levels() == 10
+    before = app.db.config_cache_stats()
+
+    _write_elsewhere(app, "max_levels", "3", bump=False)
+    _write_elsewhere(app, "commission_rates", "[0.2]", bump=True)
+    assert app.config.get_commission_rates() == [0.1, 0.05]  # served from cache until the next check
+
+    app.db._config_state["checked_at"] = 0.0  # the check interval has passed
+    assert app.config.get_commission_rates() == [0.2]
+    stats = app.db.config_cache_stats()
+    assert stats["generation"] == before["generation"] + 1
+    assert stats["invalidations"] == before["invalidations"] + 1
+    assert app.config.get_max_levels() == 3  # the bump drops every cached key
+
+    _write_elsewhere(app, "max_levels", "4", bump=False)  # no bump: caches keep the old value
+    app.db._config_state["checked_at"] = 0.0
+    assert app.config.get_max_levels() == 3
+    assert app.db.config_cache_stats()["invalidations"] == stats["invalidations"]
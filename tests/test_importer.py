@@ -0,0 +1,47 @@
+# tests/test_importer.py
+"""Bulk member import: rejects file contents and index rebuild."""
+
+import csv
+import json
+
+import pytest
+
+def _index_exists(app):
+    with app.db.get_db() as con:
+        return con.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_users_parent'").fetchone() is not None
+
+def test_rejects_file_blanks_plaintext_passwords(app, tmp_path):
+    src = tmp_path / "members.csv"
+    src.write_text("username,email,referrer,password\n"
+                   "root,r@example.com,,s3cret-root\n"
+                   "child,c@example.com,root,s3cret-child\n"
+                   "orphan,o@example.com,nobody,s3cret-orphan\n"
+                   "root,dup@example.com,,s3cret-dup\n", encoding="utf-8")
+    r = app.importer.import_members(str(src))
+    assert (r["imported"], r["rejected"]) == (2, 2)
+    text = open(r["rejects_path"], encoding="utf-8").read()
+    assert "s3cret" not in text
+    rows = list(csv.DictReader(open(r["rejects_path"], newline="", encoding="utf-8")))
+    assert [(row["username"], row["password"]) for row in rows] == [("orphan", ""), ("root", "")]
+    assert all(row["error"] for row in rows)
+    assert app.auth.authenticate("child", "s3cret-child") is not None
+    assert _index_exists(app)
+
+def test_jsonl_rejects_are_redacted(app, tmp_path):
+    src = tmp_path / "members.jsonl"
+    src.write_text(json.dumps({"username": "a", "referrer": "ghost", "password": "s3cret-a"}) + "\n"
+                   + '{"username": "b", "password": "s3cret-b"\n', encoding="utf-8")
+    r = app.importer.import_members(str(src))
+    assert (r["imported"], r["rejected"]) == (0, 2)
+    assert "s3cret" not in open(r["rejects_path"], encoding="utf-8").read()
+
+def test_index_is_rebuilt_when_the_load_fails(app, tmp_path, monkeypatch):
+    src = tmp_path / "members.csv"
+    src.write_text("username,password\nroot,pw\n", encoding="utf-8")
+    def boom(m):
+        raise RuntimeError("hashing failed")
+    monkeypatch.setattr(app.importer, "_hash", boom)
+    with pytest.raises(RuntimeError):
+        app.importer.import_members(str(src))
+    assert _index_exists(app)
+    assert app.auth.get_user_by_username("root") is None
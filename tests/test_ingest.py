@@ -0,0 +1,64 @@
+# tests/test_ingest.py
+"""Ingestion API (ingest.Service / Writer) access rules and error handling, driven without a socket."""
+
+import asyncio
+import json
+import logging
+
+import pytest
+
+JSON = {"content-type": "application/json"}
+
+def _call(app, token, method, path, body=None, headers=None):
+    """Run one request against a fresh Service; returns (status, result)."""
+    async def go():
+        service = app.ingest.Service(token)
+        task = asyncio.create_task(service.writer.run())
+        try:
+            return 200, await service.dispatch(method, path, headers or {}, json.dumps(body).encode() if body is not None else b"")
+        except app.ingest.HttpError as e:
+            return e.status, str(e)
+        finally:
+            task.cancel()
+    return asyncio.run(go())
+
+@pytest.fixture
+def pending(app):
+    app.auth.register_user("alice", "pw")
+    alice = app.auth.get_user_by_username("alice")["id"]
+    return app, app.payment.create_transaction(alice, "deposit", 10_000)
+
+@pytest.mark.parametrize("path", ["/transactions/approve", "/transactions/reject"])
+def test_money_routes_need_a_token(pending, path):
+    app, tx = pending
+    status, _ = _call(app, None, "POST", path, {"ids": [tx]}, JSON)
+    assert status == 403
+    assert _call(app, "s3cret", "POST", path, {"ids": [tx]}, JSON)[0] == 401
+    auth = dict(JSON, authorization="Bearer s3cret")
+    assert _call(app, "s3cret", "POST", path, {"ids": [tx]}, auth)[0] == 200
+    assert app.payment.get_transactions([tx])[0]["status"] != "pending"
+
+@pytest.mark.parametrize("content_type", [None, "text/plain", "application/x-www-form-urlencoded"])
+def test_post_requires_json_content_type(pending, content_type):
+    app, tx = pending
+    headers = {"content-type": content_type} if content_type else {}
+    item = {"username": "alice", "type": "deposit", "amount": 500, "external_ref": "ct-1"}
+    assert _call(app, None, "POST", "/transactions", [item], headers)[0] == 415
+    assert app.payment.get_transactions([], ["ct-1"]) == []
+    status, result = _call(app, None, "POST", "/transactions", [item], {"content-type": "application/json; charset=utf-8"})
+    assert status == 200 and result["results"][0]["duplicate"] is False
+
+def test_group_failure_is_logged_and_isolated(pending, monkeypatch, caplog):
+    app, _ = pending
+    real = app.payment.create_transactions
+    def flaky(items):
+        if len(items) > 1:
+            raise RuntimeError("constraint hit by one of the requests")
+        return real(items)
+    monkeypatch.setattr(app.payment, "create_transactions", flaky)
+    item = lambda ref: [{"username": "alice", "type": "deposit", "amount": 500, "external_ref": ref}]
+    with caplog.at_level(logging.ERROR, logger="ingest"):
+        outcomes = app.ingest.Writer()._create_group([item("g-1"), item("g-2")])
+    assert [o[0]["duplicate"] for o in outcomes] == [False, False]
+    [record] = [r for r in caplog.records if r.name == "ingest"]
+    assert "retrying one by one" in record.getMessage() and record.exc_info[0] is RuntimeError
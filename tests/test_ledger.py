@@ -0,0 +1,26 @@
+# tests/test_ledger.py
+"""Point-in-time balances from the ledger (get_balance_at)."""
+
+from datetime import datetime, timedelta
+
+import pytest
+
+def test_balance_at_accepts_date_strings(app):
+    app.auth.register_user("alice", "pw")
+    alice = app.auth.get_user_by_username("alice")["id"]
+    tx = app.payment.create_transaction(alice, "deposit", 37_035)
+    app.payment.approve_transaction(tx)
+    today = datetime.utcnow().date()
+    yesterday = today - timedelta(days=1)
+
+    assert app.ledger.get_balance_at(alice, today) == 37_035
+    assert app.ledger.get_balance_at(alice, today.isoformat()) == 37_035  # end of that day, like a date
+    assert app.ledger.get_balance_at(alice, yesterday.isoformat()) == 0
+    assert app.ledger.get_balance_at(alice, f"{yesterday} 23:59:59") == 0
+    assert app.ledger.get_balance_at(alice, f"{today + timedelta(days=1)} 00:00:00") == 37_035
+
+    app.ledger.compact(min_entries=1)  # same answers from a checkpoint
+    assert app.ledger.get_balance_at(alice, today.isoformat()) == 37_035
+    assert app.ledger.get_balance_at(alice, yesterday.isoformat()) == 0
+    with pytest.raises(ValueError):
+        app.ledger.get_balance_at(alice, "last tuesday")
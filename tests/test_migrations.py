@@ -0,0 +1,81 @@
+# tests/test_migrations.py
+"""Upgrading a database created by the original (pre-migrations) schema."""
+
+import sqlite3
+
+import pytest
+
+from conftest import App
+
+# schema as created by the first release: REAL money columns, no schema_version, no ledger/archive
+LEGACY_SCHEMA = r"""
+CREATE TABLE users (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    username TEXT UNIQUE NOT NULL,
+    email TEXT,
+    password_hash TEXT NOT NULL,
+    salt TEXT NOT NULL,
+    balance REAL DEFAULT 0,
+    parent_id INTEGER,
+    level INTEGER DEFAULT 0,
+    role TEXT DEFAULT 'user',
+    created_at TEXT DEFAULT (datetime('now'))
+);
+CREATE TABLE transactions (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    member_id INTEGER NOT NULL,
+    type TEXT NOT NULL,
+    method TEXT,
+    amount REAL NOT NULL,
+    status TEXT DEFAULT 'pending',
+    note TEXT,
+    source_tx_id INTEGER,
+    created_at TEXT DEFAULT (datetime('now')),
+    FOREIGN KEY(member_id) REFERENCES users(id) ON DELETE CASCADE
+);
+CREATE TABLE config (key TEXT PRIMARY KEY, value TEXT);
+CREATE INDEX idx_users_parent ON users(parent_id);
+CREATE INDEX idx_tx_member ON transactions(member_id);
+CREATE INDEX idx_tx_status ON transactions(status);
+"""
+
+def _legacy_database(path):
+    con = sqlite3.connect(path)
+    con.executescript(LEGACY_SCHEMA)
+    con.executemany("INSERT INTO users (username, password_hash, salt, balance, parent_id, level) VALUES (?, 'x', 'y', ?, ?, ?)",
+                    [("root", 1.5, None, 0), ("child", 12.25, 1, 1)])
+    con.executemany("INSERT INTO transactions (member_id, type, method, amount, status, created_at) VALUES (?, ?, 'bkash', ?, ?, ?)",
+                    [(2, "deposit", 12.25, "approved", "2020-01-01 10:00:00"), (2, "deposit", 3.1, "pending", "2020-01-02 10:00:00"),
+                     (1, "commission", 1.5, "approved", "2020-01-01 10:00:00")])
+    con.commit()
+    con.close()
+
+@pytest.mark.parametrize("driver", ["sqlite3", "sqlalchemy"])
+def test_upgrade_legacy_database(app_env, monkeypatch, driver):
+    path = app_env / "test.db"
+    _legacy_database(path)
+    if driver == "sqlalchemy":
+        pytest.importorskip("sqlalchemy")
+        monkeypatch.setenv("DATABASE_URL", f"sqlite:///{path}")
+    app = App(path)
+    app.db.init_db()
+
+    with app.db.get_db() as con:
+        assert app.db.schema_version(con) == app.db.SCHEMA_VERSION
+        assert {"iterations", "balance"} <= app.db.table_columns(con, "users")
+        assert "external_ref" in app.db.table_columns(con, "transactions")
+        amounts = [r["amount"] for r in con.execute("SELECT amount FROM all_transactions ORDER BY id")]
+    assert amounts == [1225, 310, 150]  # REAL taka -> integer poisha
+    assert app.ledger.get_balance(2) == 1225
+    assert app.ledger.check_ledger() == []
+    assert app.stats.check_rollups() == []
+    assert app.referral.get_parent_chain(2) == [1]
+
+    # the upgraded database works end to end, including the archive
+    moved = app.archive.archive_transactions(days=30, pause_s=0)["moved"]
+    assert moved == 2  # the pending deposit stays hot
+    assert len(app.payment.list_transactions(include_archive=True)) == 3
+    tx = app.payment.create_transaction(2, "deposit", 500, external_ref="after-upgrade")
+    app.payment.approve_transaction(tx)
+    app.commission_worker.drain()
+    assert app.ledger.get_balance(1) == 150 + 50  # level 1 commission at 10%
@@ -0,0 +1,35 @@
+# tests/test_payment.py
+"""Rejecting transactions: only pending rows change, approved money stays where it is."""
+
+import pytest
+
+@pytest.fixture
+def member(app):
+    app.auth.register_user("root", "pw")
+    app.auth.register_user("child", "pw", referrer_username="root")
+    return app, app.auth.get_user_by_username("child")["id"]
+
+def test_reject_pending(member):
+    app, child = member
+    tx = app.payment.create_transaction(child, "deposit", 10_000)
+    app.payment.reject_transaction(tx, reason="no such payment")
+    row = app.payment.list_transactions(member_id=child)[0]
+    assert row["status"] == "rejected" and row["note"].endswith("rejected: no such payment")
+    assert app.stats.get_total("deposit", "rejected")[1] == 10_000
+    with pytest.raises(ValueError, match="rejected"):
+        app.payment.reject_transaction(tx)
+    with pytest.raises(ValueError, match="not found"):
+        app.payment.reject_transaction(tx + 100)
+
+def test_reject_refuses_approved(member):
+    app, child = member
+    tx = app.payment.create_transaction(child, "deposit", 10_000)
+    app.payment.approve_transaction(tx)
+    app.commission_worker.drain()
+    with pytest.raises(ValueError, match="approved"):
+        app.payment.reject_transaction(tx)
+    assert app.payment.get_transactions([tx])[0]["status"] == "approved"
+    assert app.ledger.get_balance(child) == 10_000
+    assert app.stats.get_total("deposit", "approved")[1] == 10_000
+    assert app.stats.check_rollups() == []
+    assert app.ledger.check_ledger() == []
@@ -0,0 +1,22 @@
+# tests/test_query_stats.py
+"""Slow-query log and per-render query budget warnings go through logging."""
+
+import logging
+
+from conftest import App
+
+def test_slow_queries_and_budget_overruns_are_logged(app_env, monkeypatch, caplog):
+    monkeypatch.setenv("PYRAMID_SLOW_QUERY_MS", "0")  # every statement counts as slow
+    app = App(app_env / "test.db")
+    app.db.init_db()
+    caplog.clear()
+    with caplog.at_level(logging.WARNING, logger="db"):
+        app.db.start_render()
+        with app.db.get_db() as con:
+            con.execute("SELECT COUNT(*) FROM users").fetchone()
+            con.execute("SELECT COUNT(*) FROM transactions").fetchone()
+        scope = app.db.finish_render("test-page", budget=1)
+    assert scope["over_budget"]
+    messages = [r.getMessage() for r in caplog.records if r.name == "db"]
+    assert any(m.startswith("slow query:") and "SELECT COUNT(*) FROM users" in m for m in messages)
+    assert "query budget exceeded: test-page ran 2 statements in one render (budget 1)" in messages
@@ -0,0 +1,39 @@
+# tests/test_referral.py
+"""user_closure holds every (ancestor, descendant, depth) path: kept up by register_user, recomputed by rebuild_user_closure."""
+
+def _closure(app):
+    with app.db.get_db() as con:
+        return {(r["ancestor_id"], r["descendant_id"], r["depth"])
+                for r in con.execute("SELECT ancestor_id, descendant_id, depth FROM user_closure")}
+
+def _expected(app):
+    """Closure rows derived by walking users.parent_id."""
+    with app.db.get_db() as con:
+        parent = {r["id"]: r["parent_id"] for r in con.execute("SELECT id, parent_id FROM users")}
+    rows = set()
+    for uid in parent:
+        node, depth = uid, 0
+        while node is not None:
+            rows.add((node, uid, depth))
+            node, depth = parent[node], depth + 1
+    return rows
+
+def test_closure_follows_register_and_rebuild(app):
+    ids = {}
+    for name, referrer in [("root", None), ("a", "root"), ("b", "a"), ("c", "b"), ("a2", "root"), ("loner", None)]:
+        app.auth.register_user(name, "pw", referrer_username=referrer)
+        ids[name] = app.auth.get_user_by_username(name)["id"]
+    assert _closure(app) == _expected(app)
+    assert app.referral.get_ancestor_list(ids["c"]) == [ids["b"], ids["a"], ids["root"]]
+    assert app.referral.get_level_counts(ids["root"]) == {1: 2, 2: 1, 3: 1}
+    assert app.referral.get_downline_count(ids["root"], max_depth=2) == 3
+
+    # a bulk load writes parent_id directly; the rebuild brings the closure back in line
+    with app.db.get_db() as con:
+        con.execute("UPDATE users SET parent_id = ? WHERE id = ?", (ids["a2"], ids["b"]))
+        con.execute("DELETE FROM user_closure WHERE descendant_id = ?", (ids["loner"],))
+        con.commit()
+    assert app.db.rebuild_user_closure() == len(_expected(app))
+    assert _closure(app) == _expected(app)
+    assert app.referral.get_ancestor_list(ids["c"]) == [ids["b"], ids["a2"], ids["root"]]
+    assert app.referral.get_downline_count(ids["a"]) == 0
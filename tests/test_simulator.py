@@ -0,0 +1,36 @@
+# tests/test_simulator.py
+"""The what-if simulator pays exactly what payment.pay_commissions would for the same rates."""
+
+from collections import Counter
+
+import pytest
+
+pytest.importorskip("numpy")
+
+def test_simulated_payouts_match_pay_commissions(app):
+    ids = {}
+    for name, referrer in [("root", None), ("a", "root"), ("b", "a"), ("c", "b"), ("d", "c"), ("side", "root")]:
+        app.auth.register_user(name, "pw", referrer_username=referrer)
+        ids[name] = app.auth.get_user_by_username(name)["id"]
+    amounts = {"d": 12_345, "c": 999, "b": 10_001, "side": 7, "root": 50_000}  # odd amounts exercise half-up rounding
+    deposits = []
+    for name, amount in amounts.items():
+        tx = app.payment.create_transaction(ids[name], "deposit", amount)
+        app.payment.approve_transaction(tx)  # no workers: the queued commission jobs stay unpaid
+        deposits.append((tx, ids[name], amount))
+    app.payment.create_transaction(ids["a"], "deposit", 40_000)  # pending deposits pay nothing
+
+    rates = [0.10, 0.05, 0.02, 0.015]
+    with app.db.get_db() as con:
+        app.db.begin(con)
+        app.payment.pay_commissions(con, deposits, rates)
+        con.commit()
+    paid = Counter()
+    for r in app.payment.list_transactions(type_="commission"):
+        paid[r["member_id"]] += r["amount"]
+
+    net = app.simulator.load_network(force=True)
+    result = net.simulate(rates)[0]
+    assert {int(uid): int(v) for uid, v in zip(net.ids, result["per_user"]) if v} == dict(paid)
+    assert result["total"] == sum(paid.values())
+    assert result["levels"][3]["payout"] > 0  # d's deposit reaches root at level 4
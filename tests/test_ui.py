@@ -0,0 +1,113 @@
+# tests/test_ui.py
+"""Rendering main.py with Streamlit's AppTest against a throwaway database."""
+
+import csv
+import gzip
+import os
+import subprocess
+import sys
+
+import pytest
+
+pytest.importorskip("streamlit")
+from streamlit.testing.v1 import AppTest
+
+from conftest import ROOT
+
+def _run(state=None, analytics=False):
+    at = AppTest.from_file(str(ROOT / "main.py"), default_timeout=60)
+    for k, v in (state or {}).items():
+        at.session_state[k] = v
+    at.run()
+    if analytics:
+        next(c for c in at.sidebar.checkbox if c.label == "Show analytics").check().run()
+    return at
+
+def _prepare_export(at, key):
+    at.button(key=f"{key}_prepare").click().run()
+    assert not at.exception, [e.message for e in at.exception]
+    return at.get("download_button")
+
+@pytest.fixture
+def members(app):
+    app.auth.register_user("alice", "pw")
+    app.auth.register_user("bob", "pw", referrer_username="alice")
+    bob = app.auth.get_user_by_username("bob")["id"]
+    tx = app.payment.create_transaction(bob, "deposit", 10_000)
+    app.payment.create_transaction(bob, "deposit", 5_000)
+    app.payment.approve_transaction(tx)
+    return app
+
+@pytest.mark.parametrize("gz", [False, True])
+def test_member_export_download(members, gz):
+    at = _run({"user_id": members.auth.get_user_by_username("bob")["id"]})
+    assert not at.exception, [e.message for e in at.exception]
+    if gz:
+        at.checkbox(key="my_export_gz").check().run()
+    buttons = _prepare_export(at, "my_export")
+    assert len(buttons) == 1
+    path, count, was_gz = at.session_state["my_export"]
+    assert (count, was_gz) == (2, gz)
+    with (gzip.open if gz else open)(path, "rt", encoding="utf-8", newline="") as f:
+        rows = list(csv.DictReader(f))
+    assert sorted(r["amount"] for r in rows) == ["100.00", "50.00"]
+
+    # preparing again replaces the previous file
+    _prepare_export(at, "my_export")
+    assert not os.path.exists(path)
+    os.remove(at.session_state["my_export"][0])
+
+def test_public_export_download(members):
+    at = _run(analytics=True)
+    assert not at.exception, [e.message for e in at.exception]
+    assert len(_prepare_export(at, "export_tx")) == 1
+    os.remove(at.session_state["export_tx"][0])
+
+@pytest.mark.parametrize("gz", [False, True])
+def test_backup_download(members, gz):
+    at = _run({"owner": "owner"})
+    next(s for s in at.sidebar.selectbox if s.label == "Owner views").select("Backup DB").run()
+    if not gz:
+        at.checkbox(key="backup_gz").uncheck().run()
+    at.button(key="backup_make").click().run()
+    assert not at.exception, [e.message for e in at.exception]
+    suffix = ".gz" if gz else ""
+    assert [b.label for b in at.get("download_button")] == ["Download test.db" + suffix, "Download test_archive.db" + suffix]
+    for _, f in at.session_state["backup_files"]:
+        f.seek(0)
+        head = gzip.GzipFile(fileobj=f).read(16) if gz else f.read(16)
+        assert head == b"SQLite format 3\x00"
+        f.close()
+
+def test_member_dashboard_renders_without_pandas(members):
+    bob = members.auth.get_user_by_username("bob")["id"]
+    members.payment.create_transaction(bob, "deposit", 2_500, note="ref *42* | [x](y)")
+    at = _run({"user_id": bob})
+    assert not at.exception, [e.message for e in at.exception]
+    assert not at.dataframe
+    table = next(m.value for m in at.markdown if m.value.startswith("| id |"))
+    assert len(table.splitlines()) == 2 + 3
+    assert "| 25.00 | pending | ref \\*42\\* \\| \\[x\\]\\(y\\) |" in table
+
+    # the same render in a fresh interpreter leaves pandas unimported
+    code = ("import sys; from streamlit.testing.v1 import AppTest; "
+            f"at = AppTest.from_file({str(ROOT / 'main.py')!r}, default_timeout=60); "
+            f"at.session_state['user_id'] = {bob}; at.run(); "
+            "assert not at.exception; print('pandas' in sys.modules)")
+    proc = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, check=True)
+    assert proc.stdout.strip().splitlines()[-1] == "False"
+
+def test_select_all_pending_enables_bulk_approval(members):
+    at = _run({"owner": "owner"})
+    pending = [r["id"] for r in members.payment.list_transactions(status="pending")]
+    assert at.button(key="app_selected").disabled
+    at.checkbox(key="sel_all_pending").check().run()
+    assert all(at.checkbox(key=f"sel_{tid}").value for tid in pending)
+    at.checkbox(key="sel_all_pending").uncheck().run()
+    assert not any(at.checkbox(key=f"sel_{tid}").value for tid in pending)
+    at.checkbox(key="sel_all_pending").check().run()
+    approve = at.button(key="app_selected")
+    assert approve.label == f"Approve all selected ({len(pending)})" and not approve.disabled
+    approve.click().run()
+    assert not at.exception, [e.message for e in at.exception]
+    assert members.payment.list_transactions(status="pending") == []
@@ -2,52 +2,326 @@
 # ui.py - FIXED IMPORTS
 # ============================================================================
 """
-UI helper functions: kpi_cards, transactions_table, referrals_tree_visual (text),
-export_csv, basic charts (matplotlib).
+UI helper functions: kpi_cards, transactions_table (keyset paged), referral_tree_view (plotly, expand on demand),
+export_csv (streamed to a temp file on disk), basic charts (st.line_chart), performance_view (query profiler, read cache, archive),
+commission_simulator (what-if payouts for candidate rates, numpy).
+pandas (and numpy through simulator) are imported on first use, so pages that never show a
+dataframe or an analytics chart do not pay for them at startup; the member dashboard's table is plain Markdown.
 """
 
 import streamlit as st
+import archive
+import cache
+import db
 from db import get_db  # CHANGED: removed relative import
-import pandas as pd
+import stats
+import payment
+import referral
+from money import format_money, MINOR_PER_UNIT
 import io
-import matplotlib.pyplot as plt
+import csv
+import gzip
+import os
+import re
+import tempfile
+from contextlib import closing
+import time
+
+def _frame(rows):
+    """pandas DataFrame from row dicts; pandas is imported here rather than at module load."""
+    import pandas as pd
+    return pd.DataFrame(rows)
 
 def kpi_cards():
-    with get_db() as con:
-        total_users = con.execute("SELECT COUNT(*) as c FROM users").fetchone()["c"]
-        total_deposits = con.execute("SELECT COALESCE(SUM(amount),0) as s FROM transactions WHERE type='deposit' AND status='approved'").fetchone()["s"]
-        total_withdrawals = con.execute("SELECT COALESCE(SUM(amount),0) as s FROM transactions WHERE type='withdrawal' AND status='approved'").fetchone()["s"]
+    # constant-time reads from the rollup tables maintained by payment/auth writes
+    total_users = stats.get_counter("users")
+    total_deposits = stats.get_total("deposit", "approved")[1]
+    total_withdrawals = stats.get_total("withdrawal", "approved")[1]
     c1, c2, c3 = st.columns(3)
     c1.metric("Total users", f"{total_users:,}")
-    c2.metric("Approved deposits (৳)", f"{total_deposits:,}")
-    c3.metric("Approved withdrawals (৳)", f"{total_withdrawals:,}")
-
-def transactions_df(limit=500):
-    with get_db() as con:
-        rows = con.execute("SELECT t.*, u.username FROM transactions t LEFT JOIN users u ON u.id = t.member_id ORDER BY t.created_at DESC LIMIT ?", (limit,)).fetchall()
-    df = pd.DataFrame([dict(r) for r in rows])
-    return df
-
-def export_transactions_csv():
-    df = transactions_df(10000)
-    if df.empty:
+    c2.metric("Approved deposits (৳)", format_money(total_deposits))
+    c3.metric("Approved withdrawals (৳)", format_money(total_withdrawals))
+
+def _display_rows(rows):
+    """Row dicts with amounts converted from minor units to ৳ for display."""
+    out = [dict(r) for r in rows]
+    for d in out:
+        if d.get("amount") is not None:
+            d["amount"] = d["amount"] / MINOR_PER_UNIT
+    return out
+
+def paged_rows(key, fetch, page_size=50, filters=None):
+    """
+    Keyset pager: keeps the cursor stack in st.session_state[key], draws Prev/Next and
+    returns the rows of the current page. fetch(cursor=, limit=) -> (rows, next_cursor).
+    Changing `filters` starts again from the first page.
+    """
+    sig = repr(sorted((filters or {}).items()))
+    state = st.session_state.get(key)
+    if not state or state["filters"] != sig:
+        state = st.session_state[key] = {"filters": sig, "cursors": [None]}
+    rows, next_cursor = fetch(cursor=state["cursors"][-1], limit=page_size)
+    c1, c2, c3 = st.columns([1, 1, 4])
+    if c1.button("◀ Prev", key=f"{key}_prev", disabled=len(state["cursors"]) == 1):
+        state["cursors"].pop()
+        st.rerun()
+    if c2.button("Next ▶", key=f"{key}_next", disabled=next_cursor is None):
+        state["cursors"].append(next_cursor)
+        st.rerun()
+    c3.caption(f"Page {len(state['cursors'])}")
+    return rows
+
+PLAIN_COLUMNS = ("id", "created_at", "type", "method", "amount", "status", "note")
+_MD_SPECIAL = re.compile(r"([\\`*_{}\[\]()#+\-.!|<>~])")
+
+def _markdown_table(rows, columns=PLAIN_COLUMNS):
+    """Markdown table of transaction rows (amounts in ৳); rendering it needs neither pandas nor pyarrow."""
+    def cell(col, v):
+        if v is None:
+            return ""
+        if col == "amount":
+            return format_money(v)
+        return _MD_SPECIAL.sub(r"\\\1", str(v)).replace("\n", " ")  # notes are member-entered text
+    lines = ["| " + " | ".join(columns) + " |", "|" + "---|" * len(columns)]
+    lines += ["| " + " | ".join(cell(c, r[c]) for c in columns) + " |" for r in rows]
+    return "\n".join(lines)
+
+def transactions_table(key, page_size=50, plain=False, **filters):
+    """
+    Paged transactions table (newest first) for the given filters; returns the rows shown.
+    plain=True draws a Markdown table instead of st.dataframe (which converts through pandas), so
+    pages like the member dashboard never import pandas.
+    """
+    rows = paged_rows(key, lambda cursor, limit: payment.page_transactions(cursor=cursor, limit=limit, with_username=True, **filters),
+                      page_size=page_size, filters=filters)
+    if not rows:
+        st.info("No transactions.")
+    elif plain:
+        st.markdown(_markdown_table(rows))
+    else:
+        st.dataframe(_frame(_display_rows(rows)))
+    return rows
+
+def transaction_filters(key):
+    """Owner-side filter widgets; returns kwargs for transactions_table / payment.page_transactions."""
+    c1, c2, c3, c4 = st.columns(4)
+    status = c1.selectbox("Status", ["", "pending", "approved", "rejected"], key=f"{key}_status")
+    type_ = c2.selectbox("Type", ["", "deposit", "withdrawal", "commission", "adjustment"], key=f"{key}_type")
+    date_from = c3.date_input("From", value=None, key=f"{key}_from")
+    date_to = c4.date_input("To", value=None, key=f"{key}_to")
+    c5, c6 = st.columns([3, 1])
+    member = c5.text_input("Member id", key=f"{key}_member")
+    include_archive = c6.checkbox("Include archive", key=f"{key}_archive")
+    return {"status": status or None, "type_": type_ or None, "date_from": date_from, "date_to": date_to,
+            "member_id": int(member) if member.strip().isdigit() else None, "include_archive": include_archive}
+
+def transactions_csv_file(compress=False, include_archive=True, **filters):
+    """
+    Write matching transactions as CSV (optionally gzip'd) to a temp file on disk by streaming
+    payment.iter_transactions (full history unless include_archive=False), so building the export
+    never holds the ledger in memory. The caller owns the file and removes it when done.
+    Returns (path, row_count). Amounts are written in ৳ with two decimals.
+    """
+    fd, path = tempfile.mkstemp(prefix="pyramid_export_", suffix=".csv.gz" if compress else ".csv")
+    try:
+        with open(fd, "wb") as out:
+            raw = gzip.GzipFile(fileobj=out, mode="wb") if compress else out
+            with io.TextIOWrapper(raw, encoding="utf-8", newline="") as text:
+                writer = csv.writer(text)
+                # closing(): hand the pooled connection back even if writing fails midway
+                with closing(payment.iter_transactions(include_archive=include_archive, **filters)) as rows:
+                    header = next(rows)
+                    writer.writerow(header)
+                    amount_at = header.index("amount")
+                    count = 0
+                    for row in rows:
+                        row = list(row)
+                        row[amount_at] = format_money(row[amount_at]).replace(",", "")
+                        writer.writerow(row)
+                        count += 1
+    except BaseException:
+        os.remove(path)
+        raise
+    return path, count
+
+def _discard_export(key):
+    old = st.session_state.pop(key, None)
+    if old:
+        try:
+            os.remove(old[0])
+        except OSError:
+            pass
+
+def export_transactions_csv(key="export_tx", file_name="transactions.csv", member_id=None, **filters):
+    """
+    Export widget: date range + gzip option, builds the file on demand and offers it for download.
+    Only the temp file path lives in session_state; the button reads the file when it renders
+    (Streamlit keeps the bytes it serves in memory, so very large exports are best filtered by date).
+    """
+    c1, c2, c3 = st.columns(3)
+    date_from = c1.date_input("From", value=None, key=f"{key}_from")
+    date_to = c2.date_input("To", value=None, key=f"{key}_to")
+    compress = c3.checkbox("gzip", key=f"{key}_gz")
+    if st.button("Prepare CSV export", key=f"{key}_prepare"):
+        _discard_export(key)
+        st.session_state[key] = transactions_csv_file(compress=compress, member_id=member_id,
+                                                      date_from=date_from, date_to=date_to, **filters) + (compress,)
+    prepared = st.session_state.get(key)
+    if not prepared:
+        return
+    path, count, gz = prepared
+    if count == 0:
         st.info("No transactions to export.")
         return
-    csv = df.to_csv(index=False)
-    b = csv.encode()
-    st.download_button("Download Transactions CSV", b, file_name="transactions.csv", mime="text/csv")
+    if not os.path.exists(path):  # temp dir cleaned up under a long-lived session
+        _discard_export(key)
+        st.info("The prepared export expired, prepare it again.")
+        return
+    with open(path, "rb") as f:
+        st.download_button(f"Download Transactions CSV ({count:,} rows)", f,
+                           file_name=file_name + (".gz" if gz else ""), mime="application/gzip" if gz else "text/csv",
+                           key=f"{key}_download")
 
 def simple_deposit_withdraw_chart():
-    with get_db() as con:
-        rows = con.execute("SELECT date(created_at) as d, SUM(CASE WHEN type='deposit' AND status='approved' THEN amount ELSE 0 END) as deposits, SUM(CASE WHEN type='withdrawal' AND status='approved' THEN amount ELSE 0 END) as withdraws FROM transactions GROUP BY date(created_at) ORDER BY d DESC LIMIT 30").fetchall()
+    rows = stats.daily_series(30)
     if not rows:
         st.info("No data to plot")
         return
-    df = pd.DataFrame([dict(r) for r in rows])
-    df = df.sort_values("d")
-    plt.figure()
-    plt.plot(df["d"], df["deposits"])
-    plt.plot(df["d"], df["withdraws"])
-    plt.xticks(rotation=45)
-    plt.tight_layout()
-    st.pyplot(plt)
+    # rows are newest first; st.line_chart draws client-side, no figure is built per rerun
+    st.line_chart([{"d": r["d"], "deposits": r["deposits"] / MINOR_PER_UNIT, "withdraws": r["withdraws"] / MINOR_PER_UNIT}
+                   for r in reversed(rows)], x="d", y=["deposits", "withdraws"])
+
+def _tree_positions(tree):
+    """Layered layout: y = -depth, leaves spread left to right, parents centred over their children."""
+    import networkx as nx
+    g = nx.DiGraph()
+    pos, next_x = {}, [0]
+    def walk(n, d):
+        g.add_node(n["id"], label=n["username"], collapsed=n["collapsed"], truncated=n["truncated"], child_count=n["child_count"])
+        for c in n["children"]:
+            g.add_edge(n["id"], c["id"])
+            walk(c, d + 1)
+        if n["children"]:
+            xs = [pos[c["id"]][0] for c in n["children"]]
+            pos[n["id"]] = ((min(xs) + max(xs)) / 2, -d)
+        else:
+            pos[n["id"]] = (next_x[0], -d)
+            next_x[0] += 1
+    walk(tree, 0)
+    return g, pos
+
+def referral_tree_view(root_id, key="ref_tree", depth=2, child_limit=25):
+    """
+    Plotly view of the referral tree under root_id. Only `depth` levels (at most `child_limit`
+    children per node) are loaded; collapsed branches are expanded one at a time on request.
+    """
+    import plotly.graph_objects as go
+    exp_key = f"{key}_expanded"
+    expanded = st.session_state.setdefault(exp_key, set())
+    tree = referral.referral_tree(root_id, depth=depth, child_limit=child_limit, expanded=expanded)
+    if not tree:
+        st.info("No referral tree.")
+        return
+    g, pos = _tree_positions(tree)
+    edge_x, edge_y = [], []
+    for a, b in g.edges():
+        edge_x += [pos[a][0], pos[b][0], None]
+        edge_y += [pos[a][1], pos[b][1], None]
+    nodes = list(g.nodes(data=True))
+    fig = go.Figure([
+        go.Scatter(x=edge_x, y=edge_y, mode="lines", line=dict(width=1, color="#94A3B8"), hoverinfo="none"),
+        go.Scatter(x=[pos[n][0] for n, _ in nodes], y=[pos[n][1] for n, _ in nodes], mode="markers+text",
+                   text=[d["label"] + (" +" if d["collapsed"] or d["truncated"] else "") for _, d in nodes],
+                   textposition="bottom center", hovertext=[f"{d['label']} — {d['child_count']} direct" for _, d in nodes],
+                   marker=dict(size=14, color=["#FFD700" if d["collapsed"] else "#0F172A" for _, d in nodes])),
+    ])
+    fig.update_layout(showlegend=False, height=420, margin=dict(l=10, r=10, t=10, b=10),
+                      xaxis=dict(visible=False), yaxis=dict(visible=False))
+    st.plotly_chart(fig, use_container_width=True)
+    collapsed = {d["label"]: n for n, d in nodes if d["collapsed"]}
+    c1, c2 = st.columns([3, 1])
+    pick = c1.selectbox("Expand branch", [""] + sorted(collapsed), key=f"{key}_pick")
+    if pick and c1.button("Expand", key=f"{key}_expand"):
+        expanded.add(collapsed[pick])
+        st.rerun()
+    if expanded and c2.button("Collapse all", key=f"{key}_reset"):
+        expanded.clear()
+        st.rerun()
+
+def _rates_label(rates):
+    return ", ".join(f"{r:g}" for r in rates) or "none"
+
+def commission_simulator(candidates, key="sim", top=10):
+    """
+    Payout of each candidate rate vector over every approved deposit so far (simulator.py); the first
+    candidate is taken as the baseline. The network is loaded once per process and reused for a few minutes.
+    """
+    import simulator
+    c1, c2 = st.columns([4, 1])
+    with st.spinner("Loading referral network and deposits..."):
+        net = simulator.load_network(force=c2.button("Reload data", key=f"{key}_reload"))
+    started = time.perf_counter()
+    results = net.simulate(candidates)
+    elapsed = time.perf_counter() - started
+    info = net.summary()
+    c1.caption(f"{info['users']:,} members, {info['deposits']:,} approved deposits (৳{format_money(info['deposit_total'])}), "
+               f"loaded {time.time() - info['loaded_at']:.0f}s ago; {len(results)} rate set(s) simulated in {elapsed * 1000:.0f} ms")
+    labels = [f"{'current' if i == 0 else f'#{i}'}: {_rates_label(r['rates'])}" for i, r in enumerate(results)]
+    depth = max((len(r["levels"]) for r in results), default=0)
+    table = []
+    for k in range(depth):
+        row = {"level": str(k + 1)}
+        for label, r in zip(labels, results):
+            row[label] = r["levels"][k]["payout"] / MINOR_PER_UNIT if k < len(r["levels"]) else 0.0
+        table.append(row)
+    table.append({"level": "total", **{label: r["total"] / MINOR_PER_UNIT for label, r in zip(labels, results)}})
+    if info["deposit_total"]:
+        table.append({"level": "% of deposits", **{label: round(100 * r["total"] / info["deposit_total"], 2)
+                                                    for label, r in zip(labels, results)}})
+    st.dataframe(_frame(table).set_index("level"))
+    st.caption(f"Commissions actually paid so far: ৳{format_money(stats.get_total('commission', 'approved')[1])}")
+    pick = st.selectbox("Top earners for", labels, index=len(labels) - 1, key=f"{key}_top")
+    earners = net.top_earners(results[labels.index(pick)], top)
+    if earners:
+        ids = [uid for uid, _ in earners]
+        with get_db() as con:
+            names = {r["id"]: r["username"] for r in con.execute(
+                f"SELECT id, username FROM users WHERE id IN ({','.join('?' * len(ids))})", tuple(ids)).fetchall()}
+        st.dataframe(_frame([{"member": names.get(uid, uid), "id": uid, "payout (৳)": p / MINOR_PER_UNIT}
+                                   for uid, p in earners]))
+
+def performance_view():
+    """Owner view over db query instrumentation: render budgets, heaviest statements/callers, slow-query plans."""
+    st.caption(f"Statements slower than {db.SLOW_QUERY_MS:g} ms are logged with their plan; "
+               f"renders issuing more than {db.QUERY_BUDGET} statements are flagged.")
+    renders = db.render_stats()
+    if renders:
+        st.markdown("#### Page renders")
+        st.dataframe(_frame([{"page": p, **r} for p, r in renders.items()]))
+    order = st.selectbox("Order statements by", ["total_s", "count", "p95", "rows"], key="perf_order")
+    stmts = db.query_stats(order=order, limit=50)
+    if stmts:
+        st.markdown("#### Statements")
+        st.dataframe(_frame([{k: v for k, v in q.items() if k not in ("callers", "plan")} for q in stmts]).round(3))
+        st.markdown("#### Callers")
+        st.dataframe(_frame(db.caller_stats()).round(3))
+    else:
+        st.info("No statements recorded yet (PYRAMID_QUERY_STATS=0 disables instrumentation).")
+    slow = db.slow_queries()
+    if slow:
+        st.markdown("#### Slow queries")
+        for q in reversed(slow[-20:]):
+            with st.expander(f"{q['ms']} ms — {q['caller']} — {q['at']}"):
+                st.code(q["sql"], language="sql")
+                if q["plan"]:
+                    st.text(q["plan"])
+    st.markdown("#### Session read cache")
+    st.json(cache.stats())
+    st.markdown("#### Transaction archive")
+    st.json(archive.archive_stats())
+    c1, c2 = st.columns(2)
+    c1.download_button("Download Prometheus metrics", db.query_metrics_prometheus(), file_name="pyramid_metrics.prom",
+                       mime="text/plain", key="perf_prom")
+    if c2.button("Reset statistics", key="perf_reset"):
+        db.reset_query_stats()
+        st.rerun()